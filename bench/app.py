@@ -30,6 +30,7 @@ from bench.utils import (
 	run_frappe_cmd,
 )
 from bench.utils.bench import build_assets, install_python_dev_dependencies
+from bench.utils.node import install_node_dependencies
 from bench.utils.render import step
 
 if typing.TYPE_CHECKING:
@@ -227,6 +228,7 @@ class App(AppMeta):
 		resolved=False,
 		restart_bench=True,
 		ignore_resolution=False,
+		skip_node=False,
 	):
 		import bench.cli
 		from bench.utils.app import get_app_name
@@ -247,6 +249,7 @@ class App(AppMeta):
 			skip_assets=skip_assets,
 			restart_bench=restart_bench,
 			resolution=self.local_resolution,
+			skip_node=skip_node,
 		)
 
 	@step(title="Cloning and installing {repo}", success="App {repo} Installed")
@@ -550,6 +553,7 @@ def install_app(
 	restart_bench=True,
 	skip_assets=False,
 	resolution=UNSET_ARG,
+	skip_node=False,
 ):
 	import bench.cli as bench_cli
 	from bench.bench import Bench
@@ -577,8 +581,8 @@ def install_app(
 	if conf.get("developer_mode"):
 		install_python_dev_dependencies(apps=app, bench_path=bench_path, verbose=verbose)
 
-	if os.path.exists(os.path.join(app_path, "package.json")):
-		bench.run("yarn install", cwd=app_path)
+	if not skip_node:
+		install_node_dependencies(app, bench_path=bench_path)
 
 	bench.apps.sync(app_name=app, required=resolution, branch=tag, app_dir=app_path)
 
@@ -591,29 +595,25 @@ def install_app(
 		bench.reload(_raise=False)
 
 
-def pull_apps(apps=None, bench_path=".", reset=False):
-	"""Check all apps if there no local changes, pull"""
+def check_local_changes(apps=None, bench_path="."):
+	"""Exits if any of the apps has uncommitted changes, which pulling would clash with"""
 	from bench.bench import Bench
-	from bench.utils.app import get_current_branch, get_remote
 
 	bench = Bench(bench_path)
-	rebase = "--rebase" if bench.conf.get("rebase_on_pull") else ""
 	apps = apps or bench.apps
 	excluded_apps = bench.excluded_apps
 
-	# check for local changes
-	if not reset:
-		for app in apps:
-			if app in excluded_apps:
-				print(f"Skipping reset for app {app}")
-				continue
-			app_dir = get_repo_dir(app, bench_path=bench_path)
-			if os.path.exists(os.path.join(app_dir, ".git")):
-				out = subprocess.check_output("git status", shell=True, cwd=app_dir)
-				out = out.decode("utf-8")
-				if not re.search(r"nothing to commit, working (directory|tree) clean", out):
-					print(
-						f"""
+	for app in apps:
+		if app in excluded_apps:
+			print(f"Skipping reset for app {app}")
+			continue
+		app_dir = get_repo_dir(app, bench_path=bench_path)
+		if os.path.exists(os.path.join(app_dir, ".git")):
+			out = subprocess.check_output("git status", shell=True, cwd=app_dir)
+			out = out.decode("utf-8")
+			if not re.search(r"nothing to commit, working (directory|tree) clean", out):
+				print(
+					f"""
 
 Cannot proceed with update: You have local changes in app "{app}" that are not committed.
 
@@ -624,8 +624,22 @@ Here are your choices:
 	with "bench update --reset" or for individual repositries "git reset --hard"
 2. If your changes are helpful for others, send in a pull request via GitHub and
 	wait for them to be merged in the core."""
-					)
-					sys.exit(1)
+				)
+				sys.exit(1)
+
+
+def pull_apps(apps=None, bench_path=".", reset=False):
+	"""Check all apps if there no local changes, pull"""
+	from bench.bench import Bench
+	from bench.utils.app import get_current_branch, get_remote
+
+	bench = Bench(bench_path)
+	rebase = "--rebase" if bench.conf.get("rebase_on_pull") else ""
+	apps = apps or bench.apps
+	excluded_apps = bench.excluded_apps
+
+	if not reset:
+		check_local_changes(apps=apps, bench_path=bench_path)
 
 	for app in apps:
 		if app in excluded_apps:
@@ -21,7 +21,6 @@ from bench.utils import (
 	get_cmd_output,
 	get_git_version,
 	log,
-	run_frappe_cmd,
 )
 from bench.utils.bench import (
 	validate_app_installed_on_sites,
@@ -137,9 +136,11 @@ class Bench(Base, Validator):
 		self.reload(_raise=False)
 
 	@step(title="Building Bench Assets", success="Bench Assets Built")
-	def build(self):
-		# build assets & stuff
-		run_frappe_cmd("build", bench_path=self.name)
+	def build(self, jobs=None):
+		# build assets & stuff, reusing cached builds of unchanged apps
+		from bench.utils.bench import build_assets
+
+		build_assets(bench_path=self.name, jobs=jobs)
 
 	@step(title="Reloading Bench Processes", success="Bench Processes Reloaded")
 	def reload(self, web=False, supervisor=True, systemd=True, _raise=True):
@@ -436,16 +437,35 @@ class BenchSetup(Base):
 		user = self.bench.conf.get("frappe_user")
 		logfile = os.path.join(bench_dir, "logs", "backup.log")
 		system_crontab = CronTab(user=user)
-		backup_command = f"cd {bench_dir} && {sys.argv[0]} --verbose --site all backup"
+		backup_command = f"cd {bench_dir} && {sys.argv[0]} --verbose backups run-scheduled"
 		job_command = f"{backup_command} >> {logfile} 2>&1"
 
+		# all sites used to be backed up together every 6 hours; the scheduler spreads
+		# them over backup_interval instead
+		for legacy_command in ("--site all backup", "backup-all-sites"):
+			legacy_command = f"cd {bench_dir} && {sys.argv[0]} --verbose {legacy_command}"
+			system_crontab.remove_all(command=f"{legacy_command} >> {logfile} 2>&1")
+
 		if job_command not in str(system_crontab):
 			job = system_crontab.new(
-				command=job_command, comment="bench auto backups set for every 6 hours"
+				command=job_command, comment="bench scheduled backups, checked every 10 minutes"
+			)
+			job.minute.every(10)
+
+		# incremental snapshots of sites' files, if enabled
+		file_backup_command = (
+			f"cd {bench_dir} && {sys.argv[0]} --verbose file-backup create >> {logfile} 2>&1"
+		)
+		if not self.bench.conf.get("incremental_file_backups"):
+			system_crontab.remove_all(command=file_backup_command)
+		elif file_backup_command not in str(system_crontab):
+			job = system_crontab.new(
+				command=file_backup_command,
+				comment="bench incremental file backups set for every 6 hours",
 			)
 			job.every(6).hours()
-			system_crontab.write()
 
+		system_crontab.write()
 		logger.log("backups were set up")
 
 	@job(title="Setting Up Bench Dependencies", success="Bench Dependencies Set Up")
@@ -199,6 +199,12 @@ def app_cmd(bench_path="."):
 
 
 def frappe_cmd(bench_path="."):
+	from bench.utils.lock import LOCKED_FRAPPE_COMMANDS, hold_bench_lock_across_exec
+
+	cmd_from_sys = get_cmd_from_sysargv()
+	if cmd_from_sys in LOCKED_FRAPPE_COMMANDS:
+		hold_bench_lock_across_exec(cmd_from_sys, bench_path=bench_path)
+
 	f = get_env_cmd("python", bench_path=bench_path)
 	os.chdir(os.path.join(bench_path, "sites"))
 	os.execv(f, [f] + ["-m", "frappe.utils.bench_helper", "frappe"] + sys.argv[1:])
@@ -38,6 +38,7 @@ def bench_command(bench_path="."):
 
 
 from bench.commands.make import (
+	clone_bench,
 	drop,
 	exclude_app_for_update,
 	get_app,
@@ -50,6 +51,7 @@ from bench.commands.make import (
 
 bench_command.add_command(init)
 bench_command.add_command(drop)
+bench_command.add_command(clone_bench)
 bench_command.add_command(get_app)
 bench_command.add_command(new_app)
 bench_command.add_command(remove_app)
@@ -60,6 +62,7 @@ bench_command.add_command(pip)
 
 from bench.commands.update import (
 	retry_upgrade,
+	rollback,
 	switch_to_branch,
 	switch_to_develop,
 	update,
@@ -67,6 +70,7 @@ from bench.commands.update import (
 
 bench_command.add_command(update)
 bench_command.add_command(retry_upgrade)
+bench_command.add_command(rollback)
 bench_command.add_command(switch_to_branch)
 bench_command.add_command(switch_to_develop)
 
@@ -78,6 +82,7 @@ from bench.commands.utils import (
 	download_translations,
 	find_benches,
 	migrate_env,
+	node_store,
 	renew_lets_encrypt,
 	restart,
 	set_mariadb_host,
@@ -108,6 +113,7 @@ bench_command.add_command(disable_production)
 bench_command.add_command(bench_src)
 bench_command.add_command(find_benches)
 bench_command.add_command(migrate_env)
+bench_command.add_command(node_store)
 
 from bench.commands.setup import setup
 
@@ -127,3 +133,27 @@ bench_command.add_command(remote_urls)
 from bench.commands.install import install
 
 bench_command.add_command(install)
+
+from bench.commands.assets import assets_cache
+
+bench_command.add_command(assets_cache)
+
+from bench.commands.release import release
+
+bench_command.add_command(release)
+
+from bench.commands.backup import backups, file_backup, restore_parallel, split_backup
+
+bench_command.add_command(file_backup)
+bench_command.add_command(backups)
+bench_command.add_command(restore_parallel)
+bench_command.add_command(split_backup)
+
+from bench.commands.site_template import new_site_from_template, site_template
+
+bench_command.add_command(site_template)
+bench_command.add_command(new_site_from_template)
+
+from bench.commands.site import clone_site
+
+bench_command.add_command(clone_site)
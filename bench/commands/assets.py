@@ -0,0 +1,82 @@
+# imports - standard imports
+import sys
+from datetime import datetime
+
+# imports - third party imports
+import click
+
+
+@click.group("assets-cache", help="Inspect & manage the host-wide store of built assets")
+def assets_cache():
+	pass
+
+
+def get_store():
+	from bench.utils import log
+	from bench.utils.assets import get_assets_store
+
+	store = get_assets_store(bench_path=".")
+	if not store:
+		log("assets_store is disabled in common_site_config.json", level=3)
+		sys.exit(1)
+
+	return store
+
+
+@click.command("list", help="List builds in the assets store")
+@click.option("--app", "apps", multiple=True, help="Only list builds of these apps")
+def list_assets_cache(apps=None):
+	store = get_store()
+	index = store.read_index()
+
+	for key, entry in sorted(index.items(), key=lambda x: x[1]["last_used"], reverse=True):
+		if apps and entry["app"] not in apps:
+			continue
+		last_used = datetime.fromtimestamp(entry["last_used"]).strftime("%Y-%m-%d %H:%M")
+		print(f"{key}\t{entry['size'] / (1024 * 1024):.1f} MB\tlast used {last_used}")
+
+	print(
+		f"\n{len(index)} builds, {store.size(index) / (1024 * 1024):.1f} MB of"
+		f" {store.max_size / (1024 * 1024):.0f} MB at {store.path}"
+	)
+
+
+@click.command("prune", help="Evict least recently used builds from the assets store")
+@click.option("--max-size", type=int, help="Size (in MB) to shrink the store to")
+@click.option("--app", "apps", multiple=True, help="Remove all builds of these apps")
+@click.option("--all", "prune_all", is_flag=True, help="Remove all builds")
+def prune_assets_cache(max_size=None, apps=None, prune_all=False):
+	store = get_store()
+
+	if prune_all or apps:
+		keys = [
+			key
+			for key, entry in store.read_index().items()
+			if prune_all or entry["app"] in apps
+		]
+		store.remove(keys)
+	else:
+		keys = store.evict(None if max_size is None else max_size * 1024 * 1024)
+
+	print(f"Removed {len(keys)} builds from {store.path}")
+
+
+@click.command("export", help="Export builds from the assets store to a tarball")
+@click.argument("path")
+@click.option("--app", "apps", multiple=True, help="Only export builds of these apps")
+def export_assets_cache(path, apps=None):
+	keys = get_store().export(path, apps=apps)
+	print(f"Exported {len(keys)} builds to {path}")
+
+
+@click.command("import", help="Import builds into the assets store from a tarball")
+@click.argument("path", type=click.Path(exists=True))
+def import_assets_cache(path):
+	keys = get_store().import_(path)
+	print(f"Imported {len(keys)} builds from {path}")
+
+
+assets_cache.add_command(list_assets_cache)
+assets_cache.add_command(prune_assets_cache)
+assets_cache.add_command(export_assets_cache)
+assets_cache.add_command(import_assets_cache)
@@ -0,0 +1,195 @@
+# imports - third party imports
+import click
+
+
+@click.group(
+	"file-backup",
+	help="Incremental, deduplicated backups of sites' public & private files",
+)
+def file_backup():
+	pass
+
+
+@click.command("create", help="Snapshot files of all sites, or the given ones")
+@click.option("--site", "sites", multiple=True, help="Only back up files of these sites")
+@click.option("--jobs", type=int, help="Number of files to read concurrently")
+def create_file_backup(sites=None, jobs=None):
+	from bench.utils.file_backup import backup_site_files
+
+	backup_site_files(sites=list(sites) or None, jobs=jobs)
+
+
+@click.command("list", help="List snapshots in the file backup repository")
+def list_file_backups():
+	from bench.utils.file_backup import get_file_backup_repository
+
+	repository = get_file_backup_repository()
+	for snapshot_id in repository.get_snapshot_ids():
+		snapshot = repository.read_snapshot(snapshot_id)
+		stats = snapshot["stats"]
+		click.echo(
+			f"{snapshot_id}\t{len(snapshot['sites'])} sites\t{stats['files']} files"
+			f"\t{stats['changed_files']} changed"
+		)
+
+
+@click.command("restore", help="Restore sites' files from a snapshot")
+@click.argument("snapshot_id")
+@click.option("--site", "sites", multiple=True, help="Only restore files of these sites")
+@click.option(
+	"--target",
+	type=click.Path(file_okay=False),
+	help="Restore into this directory instead of the bench's sites",
+)
+@click.option("--jobs", type=int, help="Number of files to write concurrently")
+def restore_file_backup(snapshot_id, sites=None, target=None, jobs=None):
+	from bench.utils import log
+	from bench.utils.file_backup import get_file_backup_repository
+
+	restored = get_file_backup_repository().restore_snapshot(
+		snapshot_id, target or "sites", sites=list(sites) or None, jobs=jobs
+	)
+	log(f"Restored {restored} files from snapshot {snapshot_id}", level=1)
+
+
+@click.command("verify", help="Check that chunks of all snapshots, or the given ones, are intact")
+@click.argument("snapshot_ids", nargs=-1)
+@click.option("--jobs", type=int, help="Number of chunks to check concurrently")
+def verify_file_backups(snapshot_ids=None, jobs=None):
+	from bench.utils.file_backup import verify_file_backups
+
+	verify_file_backups(snapshot_ids=list(snapshot_ids) or None, jobs=jobs)
+
+
+@click.command("prune", help="Remove old snapshots & the chunks only they use")
+@click.option("--keep", type=int, required=True, help="Number of snapshots to keep")
+def prune_file_backups(keep):
+	from bench.utils.file_backup import get_file_backup_repository
+
+	removed = get_file_backup_repository().prune(keep)
+	click.echo(f"Removed {len(removed)} snapshots")
+
+
+file_backup.add_command(create_file_backup)
+file_backup.add_command(list_file_backups)
+file_backup.add_command(restore_file_backup)
+file_backup.add_command(verify_file_backups)
+file_backup.add_command(prune_file_backups)
+
+
+@click.group("backups", help="Scheduled site backups & their offsite copies")
+def backups():
+	pass
+
+
+@click.command(
+	"run-scheduled",
+	help="Back up sites that are due. Run every few minutes by the cron job set up with `bench setup backups`",
+)
+def run_scheduled_backups():
+	from bench.utils.backup import run_scheduled_backups
+
+	run_scheduled_backups()
+
+
+@click.command("schedule", help="Show when sites are due for backups & how their last ones went")
+def show_backup_schedule():
+	import time
+	from datetime import datetime
+
+	from bench.bench import Bench
+	from bench.utils.backup import get_backup_history, get_backup_interval, get_backup_slot
+
+	now = time.time()
+	interval = get_backup_interval()
+
+	for site in Bench(".").sites:
+		history = get_backup_history(site)
+		slot = get_backup_slot(site, now, interval)
+		next_slot = slot if (history["last_slot"] or 0) < slot else slot + interval
+		last = history["runs"][-1] if history["runs"] else None
+
+		click.echo(
+			f"{site}\tnext {datetime.fromtimestamp(next_slot).strftime('%Y-%m-%d %H:%M')}"
+			+ (
+				f"\tlast {last['started_at'][:16]} {last['status']} in {last['duration']:.0f}s"
+				if last
+				else "\tnever backed up"
+			)
+		)
+
+
+@click.command(
+	"push",
+	help="Upload backup runs, or those not pushed yet, to the bucket set in backup_s3 & prune old ones there",
+)
+@click.argument("run_ids", nargs=-1)
+@click.option("--jobs", type=int, help="Number of files or parts to upload concurrently")
+def push_backups(run_ids=None, jobs=None):
+	from bench.utils.offload import push_backups
+
+	push_backups(run_ids=list(run_ids) or None, jobs=jobs)
+
+
+@click.command("pull", help="Download a backup run, the latest if not given, from the bucket")
+@click.argument("run_id", required=False)
+@click.option("--site", "sites", multiple=True, help="Only download backups of these sites")
+@click.option(
+	"--target",
+	type=click.Path(file_okay=False),
+	help="Download into this directory instead of the sites' backup folders",
+)
+@click.option("--jobs", type=int, help="Number of parts to download concurrently")
+def pull_backups(run_id=None, sites=None, target=None, jobs=None):
+	from bench.utils.offload import pull_backups
+
+	pull_backups(run_id=run_id, sites=list(sites) or None, target=target, jobs=jobs)
+
+
+@click.command("list-remote", help="List backup runs in the bucket")
+def list_remote_backups():
+	from bench.utils.offload import get_backup_store
+
+	store = get_backup_store()
+	for run_id in store.get_run_ids():
+		manifest = store.get_manifest(run_id)
+		files = [f for result in manifest["sites"].values() for f in result.get("files", [])]
+		click.echo(
+			f"{run_id}\t{len(manifest['sites'])} sites\t{len(files)} files"
+			f"\t{sum(f['size'] for f in files) / 1024 / 1024:.1f} MB"
+		)
+
+
+@click.command(
+	"restore-parallel",
+	help="Restore a site's database from a split backup, or a .sql[.gz|.zst] backup split on the way, loading tables concurrently",
+)
+@click.argument("site")
+@click.argument("backup", type=click.Path(exists=True))
+@click.option("--jobs", type=int, help="Number of tables to load & index concurrently")
+def restore_parallel(site, backup, jobs=None):
+	from bench.utils.restore import restore_parallel
+
+	restore_parallel(site, backup, jobs=jobs)
+
+
+@click.command(
+	"split-backup",
+	help="Convert a database backup into the split format of `bench restore-parallel`",
+)
+@click.argument("backup", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+	"--output", type=click.Path(file_okay=False), help="Defaults to <backup name>.split"
+)
+def split_backup(backup, output=None):
+	from bench.utils import log
+	from bench.utils.restore import split_dump
+
+	log(f"Split {backup} into {split_dump(backup, output)}", level=1)
+
+
+backups.add_command(run_scheduled_backups)
+backups.add_command(show_backup_schedule)
+backups.add_command(push_backups)
+backups.add_command(pull_backups)
+backups.add_command(list_remote_backups)
@@ -43,6 +43,35 @@ def config_serve_default_site(state):
 	update_config({"serve_default_site": state == "on"})
 
 
+@click.command(
+	"precompress_assets",
+	help="Enable/Disable serving assets precompressed with gzip & brotli from nginx",
+)
+@click.argument("state", type=click.Choice(["on", "off"]))
+def config_precompress_assets(state):
+	from bench.utils import log
+	from bench.utils.assets import compress_assets
+
+	update_config({"precompress_assets": state == "on"})
+
+	if state == "on":
+		compress_assets(bench_path=".")
+
+	log("Run `bench setup nginx` and reload nginx for this to take effect", level=3)
+
+
+@click.command(
+	"incremental_file_backups",
+	help="Take incremental snapshots of sites' files along with the scheduled backups",
+)
+@click.argument("state", type=click.Choice(["on", "off"]))
+def config_incremental_file_backups(state):
+	from bench.bench import Bench
+
+	update_config({"incremental_file_backups": state == "on"})
+	Bench(".").setup.backups()
+
+
 @click.command("rebase_on_pull", help="Rebase repositories on pulling")
 @click.argument("state", type=click.Choice(["on", "off"]))
 def config_rebase_on_pull(state):
@@ -94,6 +123,8 @@ config.add_command(config_restart_systemd_on_update)
 config.add_command(config_dns_multitenant)
 config.add_command(config_rebase_on_pull)
 config.add_command(config_serve_default_site)
+config.add_command(config_precompress_assets)
+config.add_command(config_incremental_file_backups)
 config.add_command(config_http_timeout)
 config.add_command(set_common_config)
 config.add_command(remove_common_config)
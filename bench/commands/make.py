@@ -25,6 +25,12 @@ import click
 @click.option(
 	"--clone-without-update", is_flag=True, help="copy repos from path without update"
 )
+@click.option(
+	"--jobs",
+	type=int,
+	default=None,
+	help="Number of apps to set up concurrently while cloning. Defaults to the CPU count",
+)
 @click.option("--no-procfile", is_flag=True, help="Do not create a Procfile")
 @click.option(
 	"--no-backups",
@@ -54,6 +60,7 @@ def init(
 	skip_assets=False,
 	python="python3",
 	install_app=None,
+	jobs=None,
 ):
 	import os
 
@@ -79,6 +86,7 @@ def init(
 			skip_assets=skip_assets,
 			python=python,
 			verbose=verbose,
+			jobs=jobs,
 		)
 		log(f"Bench {path} initialized", level=1)
 	except SystemExit:
@@ -119,6 +127,18 @@ def drop(path):
 	print("Bench dropped")
 
 
+@click.command(
+	"clone-bench",
+	help="Copy this bench's apps, env, assets & config into a new bench, with its own ports, without reinstalling anything",
+)
+@click.argument("path")
+@click.option("--jobs", type=int, help="Number of files to copy concurrently")
+def clone_bench(path, jobs=None):
+	from bench.utils.bench import clone_bench
+
+	clone_bench(path, jobs=jobs)
+
+
 @click.command(
 	["get", "get-app"],
 	help="Clone an app from the internet or filesystem and set it up in your bench",
@@ -0,0 +1,82 @@
+# imports - third party imports
+import click
+
+
+@click.group(
+	"release",
+	help="Build releases of the bench's apps, env & assets alongside the live ones and switch between them",
+)
+def release():
+	pass
+
+
+@click.command("build", help="Build a release with apps at the latest commits of their branches")
+@click.option("--python", type=str, help="Python to build the release's env with")
+@click.option("--jobs", type=int, help="Number of concurrent jobs. Defaults to the CPU count")
+def build_release(python=None, jobs=None):
+	from bench.utils.release import build_release
+
+	build_release(python=python, jobs=jobs)
+
+
+@click.command(
+	"activate",
+	help="Migrate sites with a release & switch the bench over to it. Activates the latest release if none is given",
+)
+@click.argument("release_id", required=False)
+@click.option("--skip-migrate", is_flag=True, help="Don't migrate sites before switching")
+@click.option(
+	"--site-maintenance",
+	is_flag=True,
+	help="Keep sites up while migrating, putting each in maintenance mode only while it's migrated",
+)
+@click.option("--jobs", type=int, help="Number of sites to migrate concurrently")
+@click.option("--restart-supervisor", is_flag=True, help="Restart supervisor processes after switching")
+@click.option("--restart-systemd", is_flag=True, help="Restart systemd units after switching")
+def activate_release(
+	release_id=None,
+	skip_migrate=False,
+	site_maintenance=False,
+	jobs=None,
+	restart_supervisor=False,
+	restart_systemd=False,
+):
+	from bench.utils.lock import bench_lock
+	from bench.utils.release import activate_release
+
+	with bench_lock("release activate"):
+		activate_release(
+			release_id=release_id,
+			migrate=not skip_migrate,
+			jobs=jobs,
+			site_maintenance=site_maintenance,
+			restart_supervisor=restart_supervisor,
+			restart_systemd=restart_systemd,
+		)
+
+
+@click.command("list", help="List releases of the bench")
+def list_releases():
+	from bench.utils.release import get_active_release, get_releases
+
+	active = get_active_release()
+	for release in get_releases():
+		apps = ", ".join(
+			f"{app}@{(commit or 'unknown')[:10]}" for app, commit in release["apps"].items()
+		)
+		marker = click.style("* ", fg="green") if release["id"] == active else "  "
+		click.echo(f"{marker}{release['id']}\t{apps}")
+
+
+@click.command("prune", help="Remove old releases, keeping release_keep (or 3) of them")
+@click.option("--keep", type=int, help="Number of releases to keep")
+def prune_releases(keep=None):
+	from bench.utils.release import prune_releases
+
+	prune_releases(keep=keep)
+
+
+release.add_command(build_release)
+release.add_command(activate_release)
+release.add_command(list_releases)
+release.add_command(prune_releases)
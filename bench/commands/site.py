@@ -0,0 +1,30 @@
+# imports - third party imports
+import click
+
+
+@click.command("clone-site", help="Copy a site into a new one, e.g. for staging")
+@click.argument("source")
+@click.argument("site")
+@click.option("--db-root-username", help="Defaults to root_login of common_site_config.json, or root")
+@click.option("--db-root-password", help="Defaults to root_password of common_site_config.json")
+@click.option(
+	"--hardlink-files",
+	is_flag=True,
+	help="Hardlink files instead of copying them; only safe if neither site edits files in place",
+)
+@click.option(
+	"--as-is", is_flag=True, help="Don't mute emails & pause the scheduler of the new site"
+)
+def clone_site(
+	source, site, db_root_username=None, db_root_password=None, hardlink_files=False, as_is=False
+):
+	from bench.utils.site import clone_site
+
+	clone_site(
+		source,
+		site,
+		db_root_username=db_root_username,
+		db_root_password=db_root_password,
+		hardlink_files=hardlink_files,
+		as_is=as_is,
+	)
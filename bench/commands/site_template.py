@@ -0,0 +1,65 @@
+# imports - third party imports
+import click
+
+
+@click.group("site-template", help="Pre-built sites to create new ones from in seconds")
+def site_template():
+	pass
+
+
+@click.command("create", help="Capture a site's database & files as a template")
+@click.argument("name")
+@click.option("--from", "site", required=True, help="Site to make the template from")
+def create_site_template(name, site):
+	from bench.utils.site_template import create_site_template
+
+	create_site_template(name, site)
+
+
+@click.command("list", help="List site templates")
+def list_site_templates():
+	from bench.utils.site_template import get_site_templates
+
+	for template in get_site_templates():
+		click.echo(f"{template['name']}\tfrom {template['site']}\t{template['created_at'][:16]}")
+
+
+@click.command("remove", help="Remove a site template")
+@click.argument("name")
+def remove_site_template(name):
+	from bench.utils.site_template import remove_site_template
+
+	remove_site_template(name)
+
+
+site_template.add_command(create_site_template)
+site_template.add_command(list_site_templates)
+site_template.add_command(remove_site_template)
+
+
+@click.command("new-site-from-template", help="Create a site from a site template")
+@click.argument("site")
+@click.option("--template", required=True, help="Name of the site template")
+@click.option(
+	"--admin-password",
+	prompt=True,
+	hide_input=True,
+	confirmation_prompt=True,
+	help="Administrator password of the new site",
+)
+@click.option("--db-root-username", help="Defaults to root_login of common_site_config.json, or root")
+@click.option("--db-root-password", help="Defaults to root_password of common_site_config.json")
+@click.option("--jobs", type=int, help="Number of tables to load concurrently")
+def new_site_from_template(
+	site, template, admin_password, db_root_username=None, db_root_password=None, jobs=None
+):
+	from bench.utils.site_template import new_site_from_template
+
+	new_site_from_template(
+		site,
+		template,
+		admin_password,
+		db_root_username=db_root_username,
+		db_root_password=db_root_password,
+		jobs=jobs,
+	)
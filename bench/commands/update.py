@@ -35,7 +35,46 @@ from bench.utils.bench import post_upgrade, patch_sites, build_assets
 	is_flag=True,
 	help="[DEPRECATED] This flag doesn't do anything now.",
 )
-@click.option("--force", is_flag=True, help="Forces major version upgrades")
+@click.option(
+	"--force",
+	is_flag=True,
+	help="Forces major version upgrades, and migrating sites whose apps haven't changed",
+)
+@click.option(
+	"--jobs",
+	type=int,
+	help="Number of pulls, installs, snapshot copies, builds & site migrations to run concurrently",
+)
+@click.option(
+	"--prepare",
+	is_flag=True,
+	help="Fetch apps & build wheels and assets for the update without touching the live bench or taking sites down",
+)
+@click.option(
+	"--apply",
+	is_flag=True,
+	help="Apply the update staged by --prepare: fast-forward apps, install prepared wheels, migrate & restore prepared assets",
+)
+@click.option(
+	"--site-maintenance",
+	is_flag=True,
+	help="Keep sites up during the update, putting each in maintenance mode only while it's backed up & migrated",
+)
+@click.option(
+	"--continue-on-error",
+	is_flag=True,
+	help="Keep migrating other sites when a site's migration fails",
+)
+@click.option(
+	"--resume",
+	is_flag=True,
+	help="Continue the last failed update with the options it was started with, skipping phases, apps & sites already done",
+)
+@click.option(
+	"--snapshot",
+	is_flag=True,
+	help="Snapshot apps' commits, the env, assets & sites' backups first, so that `bench rollback` can undo the update",
+)
 @click.option(
 	"--reset",
 	is_flag=True,
@@ -53,21 +92,77 @@ def update(
 	no_compile,
 	force,
 	reset,
+	jobs,
+	continue_on_error,
+	site_maintenance,
+	prepare,
+	apply,
+	snapshot,
+	resume,
 ):
 	from bench.utils.bench import update
+	from bench.utils.lock import bench_lock
+
+	if prepare:
+		from bench.utils.update import prepare_update
+
+		return prepare_update(apps=apps and apps.replace(",", " ").split(), jobs=jobs)
+
+	with bench_lock("update"):
+		update(
+			pull=pull,
+			apps=apps,
+			patch=patch,
+			build=build,
+			requirements=requirements,
+			restart_supervisor=restart_supervisor,
+			restart_systemd=restart_systemd,
+			backup=not no_backup,
+			compile=not no_compile,
+			force=force,
+			reset=reset,
+			jobs=jobs,
+			continue_on_error=continue_on_error,
+			site_maintenance=site_maintenance,
+			apply=apply,
+			snapshot=snapshot,
+			resume=resume,
+		)
+
+
+@click.command(
+	"rollback",
+	help="Restore a snapshot taken by `bench update --snapshot`, the latest if none is given",
+)
+@click.argument("snapshot", required=False)
+@click.option("--list", "list_snapshots", is_flag=True, help="List snapshots")
+@click.option(
+	"--code-only",
+	is_flag=True,
+	help="Only roll back apps, the env & assets, keeping sites' databases as they are",
+)
+@click.option("--jobs", type=int, help="Number of concurrent jobs, defaults to the CPU count")
+@click.option(
+	"--restart-supervisor", is_flag=True, help="Restart supervisor processes after rollback"
+)
+@click.option(
+	"--restart-systemd", is_flag=True, help="Restart systemd units after rollback"
+)
+def rollback(snapshot, list_snapshots, code_only, jobs, restart_supervisor, restart_systemd):
+	from bench.utils.snapshot import get_snapshots, rollback
+
+	if list_snapshots:
+		for s in get_snapshots():
+			apps = ", ".join(f"{app} {state['commit'][:7]}" for app, state in s["apps"].items() if state)
+			click.echo(f"{s['id']}  {len(s['sites'])} sites  {apps}")
+		return
 
-	update(
-		pull=pull,
-		apps=apps,
-		patch=patch,
-		build=build,
-		requirements=requirements,
+	rollback(
+		snapshot,
+		code_only=code_only,
+		jobs=jobs,
 		restart_supervisor=restart_supervisor,
 		restart_systemd=restart_systemd,
-		backup=not no_backup,
-		compile=not no_compile,
-		force=force,
-		reset=reset,
 	)
 
 
@@ -135,10 +135,28 @@ def renew_lets_encrypt():
 
 
 @click.command("backup-all-sites", help="Backup all sites in current bench")
-def backup_all_sites():
+@click.option(
+	"--jobs",
+	type=int,
+	help="Number of sites to back up concurrently. Defaults to backup_jobs from common_site_config.json or 2",
+)
+@click.option("--with-files", is_flag=True, help="Back up public & private files too")
+@click.option(
+	"--compress",
+	type=click.Choice(["zstd"]),
+	help="Recompress backups with multi-threaded zstd. Defaults to backup_compression from common_site_config.json",
+)
+@click.option(
+	"--idle-io",
+	is_flag=True,
+	help="Only use the disk when nothing else needs it (ionice idle class)",
+)
+def backup_all_sites(jobs=None, with_files=False, compress=None, idle_io=False):
 	from bench.utils.system import backup_all_sites
 
-	backup_all_sites(bench_path=".")
+	backup_all_sites(
+		bench_path=".", jobs=jobs, with_files=with_files, compress=compress, idle_io=idle_io
+	)
 
 
 @click.command(
@@ -170,9 +188,44 @@ def find_benches(location):
 @click.command(
 	"migrate-env", help="Migrate Virtual Environment to desired Python Version"
 )
-@click.argument("python", type=str)
+@click.argument("python", type=str, required=False)
 @click.option("--no-backup", "backup", is_flag=True, default=True)
-def migrate_env(python, backup=True):
-	from bench.utils.bench import migrate_env
+@click.option(
+	"--rollback", is_flag=True, default=False, help="Switch back to the previous env"
+)
+@click.option("--jobs", type=int, default=None, help="Number of concurrent import checks")
+def migrate_env(python, backup=True, rollback=False, jobs=None):
+	from bench.utils.bench import migrate_env, rollback_env
+	from bench.utils.lock import bench_lock
+
+	if not rollback and not python:
+		raise click.UsageError("Missing argument 'PYTHON'.")
+
+	with bench_lock("migrate-env"):
+		if rollback:
+			return rollback_env()
+
+		migrate_env(python=python, backup=backup, jobs=jobs)
+
+
+@click.group("node-store", help="Manage the host-wide pnpm store shared by benches")
+def node_store():
+	pass
+
+
+@click.command("gc", help="Remove packages from the store that no app links to")
+def node_store_gc():
+	from bench.utils.node import prune_node_store
+
+	prune_node_store(bench_path=".")
+
+
+@click.command("path", help="Print the location of the node store")
+def node_store_path():
+	from bench.utils.node import get_pnpm_store_dir
+
+	print(get_pnpm_store_dir(bench_path="."))
+
 
-	migrate_env(python=python, backup=backup)
+node_store.add_command(node_store_gc)
+node_store.add_command(node_store_path)
@@ -78,8 +78,8 @@ def get_default_max_requests(worker_count: int):
 	return DEFAULT_MAX_REQUESTS
 
 
-def update_config_for_frappe(config, bench_path):
-	ports = make_ports(bench_path)
+def update_config_for_frappe(config, bench_path, other_bench_paths=None):
+	ports = make_ports(bench_path, other_bench_paths=other_bench_paths)
 
 	for key in ("redis_cache", "redis_queue", "redis_socketio"):
 		if key not in config:
@@ -90,10 +90,14 @@ def update_config_for_frappe(config, bench_path):
 			config[key] = ports[key]
 
 
-def make_ports(bench_path):
+def make_ports(bench_path, other_bench_paths=None):
+	"""Ports after the highest ones used by the bench's siblings, & by the siblings of
+	other_bench_paths, like the bench a new one is cloned from"""
 	from urllib.parse import urlparse
 
-	benches_path = os.path.dirname(os.path.abspath(bench_path))
+	benches_paths = {
+		os.path.dirname(os.path.abspath(path)) for path in [bench_path, *(other_bench_paths or [])]
+	}
 
 	default_ports = {
 		"webserver_port": 8000,
@@ -106,9 +110,12 @@ def make_ports(bench_path):
 
 	# collect all existing ports
 	existing_ports = {}
-	for folder in os.listdir(benches_path):
-		bench_path = os.path.join(benches_path, folder)
-		if os.path.isdir(bench_path):
+	for benches_path in benches_paths:
+		for folder in os.listdir(benches_path):
+			bench_path = os.path.join(benches_path, folder)
+			if not os.path.isdir(bench_path):
+				continue
+
 			bench_config = get_config(bench_path)
 			for key in list(default_ports.keys()):
 				value = bench_config.get(key)
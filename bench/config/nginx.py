@@ -1,8 +1,6 @@
 # imports - standard imports
 import hashlib
 import os
-import random
-import string
 
 # imports - third party imports
 import click
@@ -15,6 +13,7 @@ from bench.utils import get_bench_name
 
 
 def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
+	"""Renders config/nginx.conf, returns whether it changed"""
 	conf_path = os.path.join(bench_path, "config", "nginx.conf")
 
 	if not yes and os.path.exists(conf_path):
@@ -42,8 +41,10 @@ def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
 		"bench_name": bench_name,
 		"error_pages": get_error_pages(),
 		"allow_rate_limiting": allow_rate_limiting,
-		# for nginx map variable
-		"random_string": "".join(random.choice(string.ascii_lowercase) for i in range(7)),
+		"precompress_assets": config.get("precompress_assets"),
+		"brotli_static": config.get("precompress_assets") and has_nginx_brotli_module(),
+		# for nginx map variable; stable so that unchanged configs render the same
+		"random_string": hashlib.sha256(bench_path.encode()).hexdigest()[:7],
 	}
 
 	if logging and logging != "none":
@@ -62,9 +63,16 @@ def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
 
 	nginx_conf = template.render(**template_vars)
 
+	if os.path.exists(conf_path):
+		with open(conf_path) as f:
+			if f.read() == nginx_conf:
+				return False
+
 	with open(conf_path, "w") as f:
 		f.write(nginx_conf)
 
+	return True
+
 
 def make_bench_manager_nginx_conf(bench_path, yes=False, port=23624, domain=None):
 	from bench.config.site_config import get_site_config
@@ -293,6 +301,32 @@ def get_error_pages():
 	return {502: os.path.join(templates, "502.html")}
 
 
+def has_nginx_brotli_module():
+	"""Whether nginx was built with ngx_brotli or loads it as a dynamic module"""
+	import subprocess
+
+	from bench.utils import which
+
+	nginx = which("nginx")
+	if not nginx:
+		return False
+
+	try:
+		build_info = subprocess.check_output(
+			[nginx, "-V"], stderr=subprocess.STDOUT, universal_newlines=True
+		)
+	except (OSError, subprocess.CalledProcessError):
+		return False
+
+	if "brotli" in build_info:
+		return True
+
+	modules_path = "/etc/nginx/modules-enabled"
+	return os.path.isdir(modules_path) and any(
+		"brotli" in module for module in os.listdir(modules_path)
+	)
+
+
 def get_limit_conn_shared_memory():
 	"""Allocate 2 percent of total virtual memory as shared memory for nginx limit_conn_zone"""
 	total_vm = (os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")) / (
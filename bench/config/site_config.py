@@ -1,7 +1,9 @@
 # imports - standard imports
 import json
 import os
+import shutil
 from collections import defaultdict
+from contextlib import contextmanager
 
 
 def get_site_config(site, bench_path="."):
@@ -14,8 +16,12 @@ def get_site_config(site, bench_path="."):
 
 def put_site_config(site, config, bench_path="."):
 	config_path = os.path.join(bench_path, "sites", site, "site_config.json")
-	with open(config_path, "w") as f:
-		return json.dump(config, f, indent=1)
+	# written atomically as running processes read it on every request
+	with open(f"{config_path}.tmp", "w") as f:
+		json.dump(config, f, indent=1)
+	if os.path.exists(config_path):
+		shutil.copymode(config_path, f"{config_path}.tmp")
+	os.replace(f"{config_path}.tmp", config_path)
 
 
 def update_site_config(site, new_config, bench_path="."):
@@ -24,6 +30,35 @@ def update_site_config(site, new_config, bench_path="."):
 	put_site_config(site, config, bench_path=bench_path)
 
 
+MAINTENANCE_KEYS = ("maintenance_mode", "pause_scheduler")
+
+
+def enable_site_maintenance_mode(site, bench_path="."):
+	"""Puts the site in maintenance mode & pauses its scheduler. Returns the previous
+	values of those keys to pass to restore_site_maintenance_mode."""
+	config = get_site_config(site, bench_path=bench_path)
+	previous = {key: config[key] for key in MAINTENANCE_KEYS if key in config}
+	update_site_config(site, {key: 1 for key in MAINTENANCE_KEYS}, bench_path=bench_path)
+	return previous
+
+
+def restore_site_maintenance_mode(site, previous, bench_path="."):
+	config = get_site_config(site, bench_path=bench_path)
+	for key in MAINTENANCE_KEYS:
+		config.pop(key, None)
+	config.update(previous)
+	put_site_config(site, config, bench_path=bench_path)
+
+
+@contextmanager
+def site_maintenance_mode(site, bench_path="."):
+	previous = enable_site_maintenance_mode(site, bench_path=bench_path)
+	try:
+		yield
+	finally:
+		restore_site_maintenance_mode(site, previous, bench_path=bench_path)
+
+
 def set_nginx_port(site, port, bench_path=".", gen_config=True):
 	set_site_config_nginx_property(
 		site, {"nginx_port": port}, bench_path=bench_path, gen_config=gen_config
@@ -1,6 +1,8 @@
+import json
 import os
 import shutil
 import subprocess
+import tempfile
 import unittest
 
 from bench.app import App
@@ -9,6 +11,87 @@ from bench.exceptions import InvalidRemoteException
 from bench.utils import is_valid_frappe_branch
 
 
+class FakeS3Client:
+	"""The parts of boto3's S3 client S3BackupStore uses, backed by a dict"""
+
+	class exceptions:
+		class ClientError(Exception):
+			def __init__(self, code):
+				self.response = {"Error": {"Code": code}}
+
+	def __init__(self):
+		self.objects, self.uploads = {}, {}
+
+	@staticmethod
+	def etag(data):
+		import hashlib
+
+		return f'"{hashlib.md5(data).hexdigest()}"'
+
+	def head_object(self, Bucket, Key):
+		if Key not in self.objects:
+			raise self.exceptions.ClientError("404")
+		data, metadata = self.objects[Key]
+		return {"ContentLength": len(data), "Metadata": metadata}
+
+	def put_object(self, Bucket, Key, Body, Metadata=None):
+		self.objects[Key] = (Body if isinstance(Body, bytes) else Body.read(), Metadata or {})
+
+	def get_object(self, Bucket, Key, Range=None):
+		import io
+
+		data = self.objects[Key][0]
+		if Range:
+			start, end = Range[len("bytes=") :].split("-")
+			data = data[int(start) : int(end) + 1]
+		return {"Body": io.BytesIO(data)}
+
+	def create_multipart_upload(self, Bucket, Key, Metadata=None):
+		from datetime import datetime, timezone
+
+		upload_id = str(len(self.uploads))
+		self.uploads[upload_id] = {
+			"Key": Key,
+			"UploadId": upload_id,
+			"Initiated": datetime.now(timezone.utc),
+			"Metadata": Metadata or {},
+			"Parts": {},
+		}
+		return {"UploadId": upload_id}
+
+	def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+		self.uploads[UploadId]["Parts"][PartNumber] = Body
+		return {"ETag": self.etag(Body)}
+
+	def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+		upload = self.uploads.pop(UploadId)
+		parts = [upload["Parts"][part["PartNumber"]] for part in MultipartUpload["Parts"]]
+		self.objects[Key] = (b"".join(parts), upload["Metadata"])
+
+	def abort_multipart_upload(self, Bucket, Key, UploadId):
+		del self.uploads[UploadId]
+
+	def list_multipart_uploads(self, Bucket, Prefix):
+		return {"Uploads": [u for u in self.uploads.values() if u["Key"].startswith(Prefix)]}
+
+	def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0):
+		parts = self.uploads[UploadId]["Parts"]
+		return {
+			"Parts": [
+				{"PartNumber": n, "ETag": self.etag(data)}
+				for n, data in sorted(parts.items())
+				if n > PartNumberMarker
+			]
+		}
+
+	def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+		return {"Contents": [{"Key": key} for key in sorted(self.objects) if key.startswith(Prefix)]}
+
+	def delete_objects(self, Bucket, Delete):
+		for obj in Delete["Objects"]:
+			self.objects.pop(obj["Key"], None)
+
+
 class TestUtils(unittest.TestCase):
 	def test_app_utils(self):
 		git_url = "https://github.com/TechSparrownova/frappe"
@@ -104,3 +187,1196 @@ class TestUtils(unittest.TestCase):
 		self.assertEqual(
 			(app.use_ssh, app.org, app.repo, app.app_name), (True, "frappe", "frappe", "frappe")
 		)
+
+	def test_copy_tree(self):
+		from bench.utils.fs import copy_tree
+
+		tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_dir)
+		src, dst = os.path.join(tmp_dir, "src"), os.path.join(tmp_dir, "dst")
+		object_path = os.path.join(".git", "objects", "ab", "cdef0123")
+
+		for path, content in ((object_path, "blob"), ("hooks.py", "app_name = 'x'")):
+			os.makedirs(os.path.join(src, os.path.dirname(path)), exist_ok=True)
+			with open(os.path.join(src, path), "w") as f:
+				f.write(content)
+		os.symlink("hooks.py", os.path.join(src, "hooks_link.py"))
+
+		copy_tree(src, dst, jobs=2)
+
+		with open(os.path.join(dst, "hooks.py")) as f:
+			self.assertEqual(f.read(), "app_name = 'x'")
+		self.assertEqual(os.readlink(os.path.join(dst, "hooks_link.py")), "hooks.py")
+		self.assertTrue(
+			os.path.samefile(os.path.join(src, object_path), os.path.join(dst, object_path))
+		)
+		self.assertFalse(
+			os.path.samefile(os.path.join(src, "hooks.py"), os.path.join(dst, "hooks.py"))
+		)
+
+	def test_node_install_skipped_when_unchanged(self):
+		from bench.utils.node import (
+			get_installed_node_deps_digest,
+			get_node_deps_digest,
+			install_node_dependencies,
+			set_installed_node_deps_digest,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		app_path = os.path.join(bench_dir, "apps", "frappe")
+		os.makedirs(os.path.join(app_path, "node_modules"))
+
+		self.assertIsNone(install_node_dependencies("frappe", bench_path=bench_dir))
+
+		with open(os.path.join(app_path, "package.json"), "w") as f:
+			f.write('{"name": "frappe"}')
+		set_installed_node_deps_digest(app_path, get_node_deps_digest(app_path))
+
+		self.assertEqual(install_node_dependencies("frappe", bench_path=bench_dir), "skipped")
+
+		with open(os.path.join(app_path, "yarn.lock"), "w") as f:
+			f.write("# yarn lockfile v1")
+		self.assertNotEqual(get_node_deps_digest(app_path), get_installed_node_deps_digest(app_path))
+
+	def test_node_install_cmds(self):
+		from bench.utils.node import get_node_install_cmds
+
+		app_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, app_path)
+		subprocess.check_output("git init --quiet", shell=True, cwd=app_path)
+		exclude_file = os.path.join(app_path, ".git", "info", "exclude")
+
+		def is_excluded():
+			with open(exclude_file) as f:
+				return "pnpm-lock.yaml" in f.read().splitlines()
+
+		# the lockfile pnpm generates is kept out of `git status`, even without a yarn.lock
+		cmds = get_node_install_cmds(app_path, "pnpm", bench_path=app_path)
+		self.assertEqual(len(cmds), 1)
+		self.assertTrue(cmds[0].startswith("pnpm install"))
+		self.assertTrue(is_excluded())
+
+		with open(os.path.join(app_path, "pnpm-lock.yaml"), "w") as f:
+			f.write("lockfileVersion: 6.0\n")
+		self.assertEqual(
+			subprocess.check_output("git status --porcelain", shell=True, cwd=app_path), b""
+		)
+
+		# versions pinned by yarn.lock are imported
+		open(os.path.join(app_path, "yarn.lock"), "w").close()
+		cmds = get_node_install_cmds(app_path, "pnpm", bench_path=app_path)
+		self.assertTrue(cmds[0].startswith("pnpm import"))
+
+		# an app's own lockfile is used as is
+		with open(exclude_file, "w"):
+			pass
+		subprocess.check_output("git add -f pnpm-lock.yaml", shell=True, cwd=app_path)
+		cmds = get_node_install_cmds(app_path, "pnpm", bench_path=app_path)
+		self.assertEqual(len(cmds), 1)
+		self.assertFalse(is_excluded())
+
+		# concurrent yarn installs take turns at the shared cache
+		os.makedirs(os.path.join(app_path, "sites"))
+		with open(os.path.join(app_path, "sites", "common_site_config.json"), "w") as f:
+			json.dump({"yarn_cache_dir": os.path.join(app_path, "yarn-cache")}, f)
+		(cmd,) = get_node_install_cmds(app_path, "yarn", bench_path=app_path)
+		self.assertIn(f"--mutex file:{os.path.join(app_path, 'yarn-cache', '.yarn-mutex')}", cmd)
+
+	def test_assets_cache(self):
+		from unittest.mock import patch
+
+		from bench.utils.assets import (
+			AssetsCache,
+			build_or_restore_assets,
+			get_app_assets_digest,
+			read_manifest,
+			write_manifest,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		public_path = os.path.join(bench_dir, "apps", "erpnext", "erpnext", "public")
+		bundle = "/assets/erpnext/dist/js/erpnext.bundle.ABC.js"
+
+		os.makedirs(os.path.join(public_path, "js"))
+		os.makedirs(os.path.join(public_path, "dist", "js"))
+		with open(os.path.join(public_path, "js", "erpnext.bundle.js"), "w") as f:
+			f.write("frappe.provide('erpnext');")
+		with open(os.path.join(public_path, "dist", "js", "erpnext.bundle.ABC.js"), "w") as f:
+			f.write("built")
+		write_manifest(
+			"assets.json",
+			{"erpnext.bundle.js": bundle, "desk.bundle.js": "/assets/frappe/dist/desk.js"},
+			bench_dir,
+		)
+
+		digest = get_app_assets_digest("erpnext", bench_dir, build_tool_version="v1")
+		self.assertNotEqual(
+			digest, get_app_assets_digest("erpnext", bench_dir, build_tool_version="v2")
+		)
+
+		cache = AssetsCache(os.path.join(bench_dir, ".cache", "assets"))
+		cache.store("erpnext", digest, bench_path=bench_dir)
+		self.assertTrue(cache.has("erpnext", digest))
+
+		# built output doesn't affect the digest
+		shutil.rmtree(os.path.join(public_path, "dist"))
+		write_manifest("assets.json", {"desk.bundle.js": "/assets/frappe/dist/desk.js"}, bench_dir)
+		self.assertEqual(
+			digest, get_app_assets_digest("erpnext", bench_dir, build_tool_version="v1")
+		)
+
+		cache.restore("erpnext", digest, bench_path=bench_dir)
+		self.assertTrue(
+			os.path.exists(os.path.join(public_path, "dist", "js", "erpnext.bundle.ABC.js"))
+		)
+		self.assertEqual(
+			read_manifest("assets.json", bench_dir),
+			{"erpnext.bundle.js": bundle, "desk.bundle.js": "/assets/frappe/dist/desk.js"},
+		)
+
+		# frappe's cached assets.json is dropped even when no app had to be built
+		os.makedirs(os.path.join(bench_dir, "sites", "assets", "erpnext"))
+		with open(os.path.join(bench_dir, "sites", "common_site_config.json"), "w") as f:
+			json.dump({"assets_store": False}, f)
+		with patch("bench.utils.assets.get_build_tool_version", return_value="v1"), patch(
+			"bench.utils.assets.run_build"
+		) as run_build, patch("bench.utils.assets.clear_assets_json_cache") as clear:
+			build_or_restore_assets(bench_path=bench_dir, apps=["erpnext"])
+		run_build.assert_not_called()
+		clear.assert_called_once_with(bench_dir)
+
+	def test_assets_store(self):
+		import tarfile
+		from io import BytesIO
+
+		from bench.exceptions import ValidationError
+		from bench.utils.assets import AssetsStore, read_manifest, write_manifest
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		dist_path = os.path.join(bench_dir, "apps", "erpnext", "erpnext", "public", "dist")
+		manifest = {"erpnext.bundle.js": "/assets/erpnext/dist/js/erpnext.bundle.ABC.js"}
+
+		os.makedirs(dist_path)
+		with open(os.path.join(dist_path, "erpnext.bundle.ABC.js"), "w") as f:
+			f.write("built" * 1000)
+		write_manifest("assets.json", manifest, bench_dir)
+
+		store = AssetsStore(os.path.join(bench_dir, "store"))
+		for commit in ("a1", "b2"):
+			key = store.get_key("erpnext", commit, "v1")
+			store.publish(key, "erpnext", bench_path=bench_dir, commit=commit)
+
+		# identical builds share one object
+		self.assertEqual(len(os.listdir(store.objects_path)), 1)
+
+		tarball = os.path.join(bench_dir, "assets.tar.gz")
+		store.export(tarball)
+		store.evict(max_size=0)
+		self.assertFalse(store.has(store.get_key("erpnext", "a1", "v1")))
+		self.assertEqual(os.listdir(store.objects_path), [])
+
+		# an evicted build is a miss
+		self.assertFalse(
+			store.restore(store.get_key("erpnext", "a1", "v1"), "erpnext", bench_path=bench_dir)
+		)
+		self.assertTrue(os.path.exists(os.path.join(dist_path, "erpnext.bundle.ABC.js")))
+
+		store.import_(tarball)
+		shutil.rmtree(dist_path)
+		write_manifest("assets.json", {}, bench_dir)
+		self.assertTrue(
+			store.restore(store.get_key("erpnext", "b2", "v1"), "erpnext", bench_path=bench_dir)
+		)
+
+		self.assertTrue(os.path.exists(os.path.join(dist_path, "erpnext.bundle.ABC.js")))
+		self.assertEqual(read_manifest("assets.json", bench_dir), manifest)
+
+		# objects that don't match their digest aren't imported
+		tampered = os.path.join(bench_dir, "tampered.tar.gz")
+		with tarfile.open(tarball) as source, tarfile.open(tampered, "w:gz") as tar:
+			for member in source.getmembers():
+				data = source.extractfile(member).read()
+				if member.name.startswith("objects/"):
+					data = data.replace(b"built", b"bUilt")
+				member.size = len(data)
+				tar.addfile(member, BytesIO(data))
+		store.evict(max_size=0)
+		self.assertRaises(ValidationError, store.import_, tampered)
+		self.assertEqual(os.listdir(store.objects_path), [])
+
+		# nor are entries whose object isn't a digest
+		traversing = os.path.join(bench_dir, "traversing.tar.gz")
+		with tarfile.open(traversing, "w:gz") as tar:
+			data = json.dumps({"key": {"object": "../../escaped"}}).encode()
+			member = tarfile.TarInfo("index.json")
+			member.size = len(data)
+			tar.addfile(member, BytesIO(data))
+		self.assertRaises(ValidationError, store.import_, traversing)
+
+		# members extractall would write outside the path or link anywhere are rejected
+		from bench.utils.assets import check_tar_members
+
+		for name, type in (("../escaped", tarfile.REGTYPE), ("dist/link", tarfile.SYMTYPE)):
+			unsafe = os.path.join(bench_dir, "unsafe.tar")
+			with tarfile.open(unsafe, "w") as tar:
+				member = tarfile.TarInfo(name)
+				member.type = type
+				member.linkname = "/etc/passwd" if type == tarfile.SYMTYPE else ""
+				tar.addfile(member, BytesIO(b""))
+			with tarfile.open(unsafe) as tar:
+				self.assertRaises(ValidationError, check_tar_members, tar)
+
+	def test_memory_gate(self):
+		import threading
+		import time
+
+		from bench.utils.parallel import MemoryGate, run_in_parallel
+
+		running, peak, lock = [0], [0], threading.Lock()
+
+		def job(_):
+			with gate.admit():
+				with lock:
+					running[0] += 1
+					peak[0] = max(peak[0], running[0])
+				time.sleep(0.05)
+				with lock:
+					running[0] -= 1
+
+		# no host has this much memory, so jobs are admitted one at a time
+		gate = MemoryGate(memory_per_job=1 << 40, poll_interval=0.01)
+		run_in_parallel(job, range(4), jobs=4)
+		self.assertEqual(peak[0], 1)
+
+		gate = MemoryGate(memory_per_job=0)
+		run_in_parallel(job, range(4), jobs=4)
+		self.assertGreater(peak[0], 1)
+
+	def test_build_jobs(self):
+		from unittest.mock import patch
+
+		from bench.config.common_site_config import put_config
+		from bench.utils.assets import get_build_jobs
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "sites"))
+
+		# concurrent builds are opt-in, & limited by memory
+		with patch("bench.utils.parallel.get_available_memory", return_value=3 * 1024):
+			self.assertEqual(get_build_jobs(bench_path=bench_dir), 1)
+			self.assertEqual(get_build_jobs(2, bench_path=bench_dir), 2)
+			put_config({"build_jobs": 8}, bench_dir)
+			self.assertEqual(get_build_jobs(bench_path=bench_dir), 3)
+
+	def test_compress_assets(self):
+		import gzip
+
+		from bench.utils.assets import compress_assets
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		dist_path = os.path.join(bench_dir, "sites", "assets", "erpnext", "dist", "js")
+		bundle = os.path.join(dist_path, "erpnext.bundle.ABCD1234.js")
+
+		os.makedirs(dist_path)
+		with open(bundle, "w") as f:
+			f.write("frappe.provide('erpnext');" * 100)
+		with open(os.path.join(dist_path, "tiny.js"), "w") as f:
+			f.write("1;")
+		with open(os.path.join(dist_path, "removed.js.gz"), "wb") as f:
+			f.write(gzip.compress(b""))
+
+		compress_assets(bench_path=bench_dir, apps=["erpnext"])
+		with gzip.open(f"{bundle}.gz") as f, open(bundle, "rb") as g:
+			self.assertEqual(f.read(), g.read())
+		self.assertEqual(os.stat(f"{bundle}.gz").st_mtime, os.stat(bundle).st_mtime)
+		self.assertFalse(os.path.exists(os.path.join(dist_path, "tiny.js.gz")))
+		self.assertFalse(os.path.exists(os.path.join(dist_path, "removed.js.gz")))
+
+		# unchanged files aren't compressed again
+		compressed_at = os.stat(f"{bundle}.gz").st_ctime_ns
+		compress_assets(bench_path=bench_dir, apps=["erpnext"])
+		self.assertEqual(os.stat(f"{bundle}.gz").st_ctime_ns, compressed_at)
+
+	def test_interleave_by_db_host(self):
+		from bench.utils.migrate import interleave_by_db_host
+
+		db_hosts = {"a1": "db-a", "a2": "db-a", "a3": "db-a", "b1": "db-b", "c1": "db-c"}
+		self.assertEqual(
+			interleave_by_db_host(list(db_hosts), db_hosts), ["a1", "b1", "c1", "a2", "a3"]
+		)
+
+	def test_migrate_sites_in_workers(self):
+		import sys
+		from unittest.mock import patch
+
+		from bench.utils.migrate import get_migrated_record, migrate_sites
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		frappe_path = os.path.join(bench_dir, "lib", "frappe")
+		os.makedirs(os.path.join(frappe_path, "utils"))
+		os.makedirs(os.path.join(bench_dir, "env", "bin"))
+		os.makedirs(os.path.join(bench_dir, "sites"))
+		os.symlink(sys.executable, os.path.join(bench_dir, "env", "bin", "python"))
+
+		# a stand-in for frappe's CLI where migrating "broken.local" & "exits.local" fails
+		# and "crash.local" kills the interpreter
+		with open(os.path.join(frappe_path, "__init__.py"), "w") as f:
+			f.write("def destroy():\n\tpass\n")
+		open(os.path.join(frappe_path, "utils", "__init__.py"), "w").close()
+		with open(os.path.join(frappe_path, "utils", "bench_helper.py"), "w") as f:
+			f.write(
+				"import os, sys, click\n"
+				"@click.group()\n"
+				"@click.option('--site')\n"
+				"@click.pass_context\n"
+				"def frappe(ctx, site):\n\tctx.obj = site\n"
+				"@frappe.command()\n"
+				"@click.pass_obj\n"
+				"def migrate(site):\n"
+				"\tprint(f'migrating {site} in {os.getpid()}')\n"
+				"\tif site == 'broken.local':\n\t\tsys.exit(1)\n"
+				"\tif site == 'exits.local':\n\t\tclick.get_current_context().exit(2)\n"
+				"\tif site == 'crash.local':\n\t\tsys.stdout.flush()\n\t\tos._exit(3)\n"
+				"def get_app_groups():\n\treturn {'frappe': frappe}\n"
+				"if __name__ == '__main__':\n"
+				"\tclick.Group(commands=get_app_groups())(prog_name='bench')\n"
+			)
+
+		sites = ["a.local", "broken.local", "b.local", "c.local", "exits.local", "crash.local"]
+		pythonpath = os.pathsep.join([os.path.join(bench_dir, "lib"), *sys.path])
+		# a.local hasn't changed since its last migration, but it's forced
+		os.makedirs(os.path.join(bench_dir, "sites", "a.local"))
+		unchanged = ({"a.local": {"frappe": "c0ffee"}}, ["a.local"])
+		with patch.dict(os.environ, {"PYTHONPATH": pythonpath}), patch(
+			"bench.utils.migrate.get_unchanged_sites", return_value=unchanged
+		):
+			results = migrate_sites(
+				bench_path=bench_dir, sites=sites, jobs=1, fail_fast=False, force=True
+			)
+
+		self.assertEqual(
+			{site: result["status"] for site, result in results.items()},
+			{
+				"a.local": "success",
+				"broken.local": "failed",
+				"b.local": "success",
+				"c.local": "success",
+				"exits.local": "failed",
+				"crash.local": "failed",
+			},
+		)
+
+		def get_log(site):
+			with open(os.path.join(bench_dir, "logs", "migrate", f"{site}.log")) as f:
+				return f.read()
+
+		# one interpreter migrates sites until one fails; only sites whose interpreter
+		# died are retried alone
+		pid = get_log("a.local").split()[-1]
+		self.assertEqual(get_log("broken.local").count("migrating broken.local"), 1)
+		self.assertNotEqual(get_log("b.local").split()[-1], pid)
+		self.assertEqual(get_log("c.local").split()[-1], get_log("b.local").split()[-1])
+		self.assertEqual(get_log("exits.local").count("migrating exits.local"), 1)
+		self.assertEqual(get_log("crash.local").count("migrating crash.local"), 2)
+		self.assertEqual(get_migrated_record("a.local", bench_dir)["apps"], {"frappe": "c0ffee"})
+
+	def test_migrate_inputs(self):
+		from unittest.mock import patch
+
+		from bench.utils.migrate import (
+			get_migrated_record,
+			get_site_migrate_inputs,
+			set_migrated_record,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "sites", "a.local"))
+		revisions = {"frappe": "c0ffee", "erpnext": None}
+
+		with patch("bench.utils.migrate.get_site_installed_apps", return_value=None):
+			# erpnext has local changes, so the site can't be considered unchanged
+			self.assertIsNone(get_site_migrate_inputs("a.local", revisions, bench_dir))
+
+		with patch("bench.utils.migrate.get_site_installed_apps", return_value=["frappe"]):
+			inputs = get_site_migrate_inputs("a.local", revisions, bench_dir)
+		self.assertEqual(inputs, {"frappe": "c0ffee"})
+
+		self.assertEqual(get_migrated_record("a.local", bench_dir), {})
+		set_migrated_record("a.local", inputs, bench_path=bench_dir)
+		self.assertEqual(get_migrated_record("a.local", bench_dir)["apps"], inputs)
+
+	def test_site_maintenance_mode(self):
+		from bench.config.site_config import (
+			get_site_config,
+			put_site_config,
+			site_maintenance_mode,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "sites", "a.local"))
+		put_site_config("a.local", {"db_name": "a", "pause_scheduler": 1}, bench_path=bench_dir)
+
+		with site_maintenance_mode("a.local", bench_path=bench_dir):
+			config = get_site_config("a.local", bench_path=bench_dir)
+			self.assertEqual((config["maintenance_mode"], config["pause_scheduler"]), (1, 1))
+
+		self.assertEqual(
+			get_site_config("a.local", bench_path=bench_dir), {"db_name": "a", "pause_scheduler": 1}
+		)
+
+	def test_prepare_update_target(self):
+		from bench.utils.update import get_update_target, stage_app_sources
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		upstream = os.path.join(bench_dir, "remote-repo")
+		app_path = os.path.join(bench_dir, "apps", "myapp")
+
+		def git(*args, cwd=upstream):
+			subprocess.check_output(
+				["git", "-c", "user.name=b", "-c", "user.email=b@b", *args], cwd=cwd
+			)
+
+		os.makedirs(upstream)
+		git("init", "-q", "-b", "develop")
+		with open(os.path.join(upstream, "hooks.py"), "w") as f:
+			f.write("v = 1\n")
+		git("add", ".")
+		git("commit", "-q", "-m", "init")
+		git("clone", "-q", upstream, app_path, cwd=bench_dir)
+
+		with open(os.path.join(upstream, "hooks.py"), "w") as f:
+			f.write("v = 2\n")
+		git("commit", "-q", "-am", "bump")
+
+		target = get_update_target("myapp", bench_path=bench_dir)
+		self.assertNotEqual(target["head"], target["target"])
+		self.assertEqual((target["remote"], target["branch"]), ("origin", "develop"))
+
+		# the live tree isn't touched, the target is staged separately
+		stage_app_sources("myapp", target["target"], os.path.join(bench_dir, ".staging"), bench_dir)
+		with open(os.path.join(app_path, "hooks.py")) as f:
+			self.assertEqual(f.read(), "v = 1\n")
+		with open(os.path.join(bench_dir, ".staging", "apps", "myapp", "hooks.py")) as f:
+			self.assertEqual(f.read(), "v = 2\n")
+
+	def test_releases(self):
+		from bench.utils.release import (
+			convert_to_releases,
+			get_active_release,
+			get_releases,
+			link,
+			prune_releases,
+			write_release,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		for path in ("apps/frappe/frappe", "env/bin", "sites/assets", "config"):
+			os.makedirs(os.path.join(bench_dir, path))
+		for name in ("hooks.py", "modules.txt", "patches.txt"):
+			open(os.path.join(bench_dir, "apps", "frappe", "frappe", name), "w").close()
+		with open(os.path.join(bench_dir, "sites", "apps.txt"), "w") as f:
+			f.write("frappe")
+		with open(os.path.join(bench_dir, "env", "bin", "frappe"), "w") as f:
+			f.write(f"#!{bench_dir}/env/bin/python\n")
+		os.symlink(
+			os.path.join(bench_dir, "apps", "frappe", "frappe", "public"),
+			os.path.join(bench_dir, "sites", "assets", "frappe"),
+		)
+
+		initial = convert_to_releases(bench_dir)
+		initial_path = os.path.join(bench_dir, "releases", initial)
+		self.assertEqual(get_active_release(bench_dir), initial)
+		self.assertTrue(os.path.isdir(os.path.join(bench_dir, "apps", "frappe")))
+		with open(os.path.join(initial_path, "env", "bin", "frappe")) as f:
+			self.assertEqual(f.read(), f"#!{initial_path}/env/bin/python\n")
+		self.assertEqual(
+			os.readlink(os.path.join(initial_path, "sites", "assets", "frappe")),
+			os.path.join("..", "..", "apps", "frappe", "frappe", "public"),
+		)
+
+		for release_id in ("30000101-000000", "30000102-000000", "30000103-000000"):
+			for path in ("apps", "env", "sites/assets"):
+				os.makedirs(os.path.join(bench_dir, "releases", release_id, path))
+			write_release({"id": release_id, "apps": {}}, bench_path=bench_dir)
+
+		link(
+			os.path.join(bench_dir, "releases", "30000102-000000", "apps"),
+			os.path.join(bench_dir, "apps"),
+		)
+		self.assertEqual(get_active_release(bench_dir), "30000102-000000")
+
+		# the active release is kept even when it's past the retention limit
+		self.assertEqual(prune_releases(bench_path=bench_dir, keep=1), [initial, "30000101-000000"])
+		self.assertEqual(
+			[r["id"] for r in get_releases(bench_dir)], ["30000102-000000", "30000103-000000"]
+		)
+
+	def test_build_release_from_release_env(self):
+		import sys
+		from unittest.mock import patch
+
+		from bench.utils.release import build_release, convert_to_releases, get_base_python
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		for path in ("apps/frappe/frappe", "sites/assets", "config"):
+			os.makedirs(os.path.join(bench_dir, path))
+		for name in ("hooks.py", "modules.txt", "patches.txt"):
+			open(os.path.join(bench_dir, "apps", "frappe", "frappe", name), "w").close()
+		subprocess.check_call(
+			[sys.executable, "-m", "venv", "--without-pip", os.path.join(bench_dir, "env")]
+		)
+
+		# the bench's env is now a link to its first release's
+		convert_to_releases(bench_dir)
+		self.assertTrue(os.path.islink(os.path.join(bench_dir, "env")))
+
+		with patch("bench.utils.release.build_release_env") as build_release_env, patch(
+			"bench.utils.update.get_update_target", return_value=None
+		), patch("bench.utils.node.install_node_packages"), patch(
+			"bench.utils.assets.build_assets"
+		):
+			build_release(bench_dir, jobs=1)
+
+		python = build_release_env.call_args[0][2]
+		self.assertFalse(os.path.realpath(python).startswith(os.path.realpath(bench_dir)))
+		self.assertEqual(os.path.realpath(python), os.path.realpath(sys.executable))
+
+		# envs made before Python 3.11 only record the interpreter's directory
+		pyvenv_cfg = os.path.join(bench_dir, "env", "pyvenv.cfg")
+		with open(pyvenv_cfg) as f:
+			lines = [line for line in f if line.startswith(("home", "version"))]
+		with open(pyvenv_cfg, "w") as f:
+			f.writelines(lines)
+		self.assertEqual(
+			os.path.realpath(get_base_python(os.path.join(bench_dir, "env"))),
+			os.path.realpath(sys.executable),
+		)
+
+	def test_activate_release_on_plain_bench(self):
+		from bench.utils.release import activate_release, get_active_release, write_release
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		release_id = "30000101-000000"
+		release_dir = os.path.join(bench_dir, "releases", release_id)
+		for path in ("apps/frappe/frappe", "env/bin", "sites/assets", "config", "logs"):
+			os.makedirs(os.path.join(bench_dir, path))
+			os.makedirs(os.path.join(release_dir, path))
+		for name in ("hooks.py", "modules.txt", "patches.txt"):
+			open(os.path.join(bench_dir, "apps", "frappe", "frappe", name), "w").close()
+			open(os.path.join(release_dir, "apps", "frappe", "frappe", name), "w").close()
+
+		write_release({"id": release_id, "apps": {}}, bench_path=bench_dir)
+
+		self.assertIsNone(get_active_release(bench_dir))
+		activate_release(release_id, bench_path=bench_dir)
+		self.assertEqual(get_active_release(bench_dir), release_id)
+
+		# the bench's own apps were kept as a release
+		previous = [
+			name for name in os.listdir(os.path.join(bench_dir, "releases")) if name != release_id
+		]
+		self.assertEqual(len(previous), 1)
+		self.assertTrue(
+			os.path.isdir(os.path.join(bench_dir, "releases", previous[0], "apps", "frappe"))
+		)
+
+	def test_backup_sites(self):
+		import hashlib
+		import sys
+		from unittest.mock import patch
+
+		from bench.utils.backup import backup_sites
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		frappe_path = os.path.join(bench_dir, "lib", "frappe")
+		os.makedirs(os.path.join(frappe_path, "utils"))
+		os.makedirs(os.path.join(bench_dir, "env", "bin"))
+		os.symlink(sys.executable, os.path.join(bench_dir, "env", "bin", "python"))
+		for site in ("a.local", "broken.local"):
+			os.makedirs(os.path.join(bench_dir, "sites", site))
+
+		# a stand-in for frappe's backup command, failing for "broken.local"
+		open(os.path.join(frappe_path, "__init__.py"), "w").close()
+		open(os.path.join(frappe_path, "utils", "__init__.py"), "w").close()
+		with open(os.path.join(frappe_path, "utils", "bench_helper.py"), "w") as f:
+			f.write(
+				"import os, sys\n"
+				"site = sys.argv[3]\n"
+				"if site == 'broken.local':\n\tsys.exit(1)\n"
+				"path = os.path.join(site, 'private', 'backups')\n"
+				"os.makedirs(path)\n"
+				"with open(os.path.join(path, f'{site}-database.sql.gz'), 'w') as f:\n"
+				"\tf.write('dump')\n"
+			)
+
+		pythonpath = os.pathsep.join([os.path.join(bench_dir, "lib"), *sys.path])
+		# results are reported as sites are backed up, before the run's manifest is written
+		recorded = {}
+		manifests_path = os.path.join(bench_dir, "backups", "manifests")
+
+		def on_result(site, result):
+			recorded[site] = (result["status"], os.path.exists(manifests_path))
+
+		with patch.dict(os.environ, {"PYTHONPATH": pythonpath}):
+			manifest = backup_sites(
+				bench_path=bench_dir, sites=["a.local", "broken.local"], jobs=2, on_result=on_result
+			)
+
+		self.assertEqual(recorded, {"a.local": ("success", False), "broken.local": ("failed", False)})
+		self.assertEqual(manifest["sites"]["broken.local"]["status"], "failed")
+		result = manifest["sites"]["a.local"]
+		self.assertEqual(result["status"], "success")
+		self.assertEqual(
+			[(os.path.basename(f["path"]), f["size"], f["sha256"]) for f in result["files"]],
+			[("a.local-database.sql.gz", 4, hashlib.sha256(b"dump").hexdigest())],
+		)
+
+		with open(os.path.join(bench_dir, "backups", "manifests", f"{manifest['id']}.json")) as f:
+			self.assertEqual(json.load(f)["sites"]["a.local"]["files"], result["files"])
+
+	@unittest.skipUnless(shutil.which("zstd"), "zstd isn't installed")
+	def test_recompress_backups(self):
+		import gzip
+
+		from bench.utils.backup import prune_recompressed, recompress
+
+		backups_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, backups_path)
+		dump = os.path.join(backups_path, "a.local-database.sql.gz")
+		with gzip.open(dump, "wb") as f:
+			f.write(b"dump")
+
+		# frappe's backup stays, for its retention & restore
+		target = recompress(dump)
+		self.assertEqual(target, os.path.join(backups_path, "a.local-database.sql.zst"))
+		self.assertTrue(os.path.exists(dump))
+		self.assertEqual(subprocess.check_output(["zstd", "-dc", target]), b"dump")
+
+		self.assertEqual(prune_recompressed(backups_path), [])
+		os.remove(dump)
+		self.assertEqual(prune_recompressed(backups_path), [target])
+		self.assertEqual(os.listdir(backups_path), [])
+
+	def test_file_backup_repository(self):
+		from bench.utils.file_backup import FileBackupRepository
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		repository = FileBackupRepository(os.path.join(bench_dir, "backups", "files"))
+
+		def write(site, path, contents):
+			path = os.path.join(bench_dir, "sites", site, path)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w") as f:
+				f.write(contents)
+
+		write("a.local", "public/files/logo.png", "logo")
+		write("a.local", "private/files/invoice.pdf", "invoice")
+		write("b.local", "public/files/logo.png", "logo")
+
+		first = repository.create_snapshot(["a.local", "b.local"], bench_path=bench_dir)
+		self.assertEqual(first["stats"]["changed_files"], 3)
+		# the same logo on both sites is stored once
+		self.assertEqual(len(repository.get_referenced_chunks()), 2)
+
+		write("a.local", "private/files/invoice.pdf", "amended invoice")
+		second = repository.create_snapshot(["a.local", "b.local"], bench_path=bench_dir)
+		self.assertEqual((second["stats"]["files"], second["stats"]["changed_files"]), (3, 1))
+
+		target = os.path.join(bench_dir, "restored")
+		self.assertEqual(repository.restore_snapshot(first["id"], target, sites=["a.local"]), 2)
+		with open(os.path.join(target, "a.local", "private", "files", "invoice.pdf")) as f:
+			self.assertEqual(f.read(), "invoice")
+
+		self.assertEqual(repository.verify(), {})
+		invoice_chunk = first["sites"]["a.local"]["private/files/invoice.pdf"]["chunks"][0]
+		with open(repository.chunk_path(invoice_chunk), "w") as f:
+			f.write("bitrot")
+		self.assertEqual(list(repository.verify()), [invoice_chunk])
+
+		self.assertEqual(repository.prune(keep=1), [first["id"]])
+		self.assertFalse(os.path.exists(repository.chunk_path(invoice_chunk)))
+		self.assertEqual(repository.verify(), {})
+
+	def test_backup_schedule(self):
+		from bench.utils.backup import (
+			get_backup_history,
+			get_backup_offset,
+			get_backup_slot,
+			record_backup,
+		)
+		from bench.utils.lock import acquire_bench_lock, bench_lock
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "config"))
+		interval = 6 * 60 * 60
+
+		# sites are spread over the interval, the same way every time
+		sites = [f"{i}.local" for i in range(20)]
+		offsets = [get_backup_offset(site, interval, bench_dir) for site in sites]
+		self.assertEqual(offsets, [get_backup_offset(site, interval, bench_dir) for site in sites])
+		self.assertGreater(max(offsets) - min(offsets), interval / 2)
+
+		now = 1_700_000_000
+		slot = get_backup_slot("a.local", now, interval, bench_dir)
+		self.assertTrue(now - interval < slot <= now)
+		self.assertEqual(slot % interval, get_backup_offset("a.local", interval, bench_dir))
+		self.assertEqual(get_backup_slot("a.local", slot + interval - 1, interval, bench_dir), slot)
+
+		result = {"started_at": "2023-11-14T22:13:20", "status": "success", "duration": 3.0}
+		record_backup("a.local", slot, result, bench_path=bench_dir)
+		history = get_backup_history("a.local", bench_path=bench_dir)
+		self.assertEqual((history["last_slot"], history["runs"][0]["duration"]), (slot, 3.0))
+
+		# backups defer to operations holding the bench lock, which nest
+		fd = acquire_bench_lock("update", bench_path=bench_dir)
+		with bench_lock("backup", bench_path=bench_dir, shared=True, wait=False) as acquired:
+			self.assertFalse(acquired)
+		os.close(fd)
+
+		with bench_lock("update", bench_path=bench_dir):
+			with bench_lock("backup", bench_path=bench_dir, shared=True, wait=False) as acquired:
+				self.assertTrue(acquired)
+		with bench_lock("backup", bench_path=bench_dir, shared=True, wait=False) as acquired:
+			self.assertTrue(acquired)
+
+	def test_offload_backups(self):
+		from unittest.mock import patch
+
+		from bench.utils.backup import get_file_checksum, write_backup_manifest
+		from bench.utils.offload import (
+			S3BackupStore,
+			get_pushed_runs,
+			pull_backups,
+			push_after_backup,
+			push_backups,
+		)
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		backups_dir = os.path.join(bench_dir, "sites", "a.local", "private", "backups")
+		os.makedirs(backups_dir)
+		os.makedirs(os.path.join(bench_dir, "config"))
+		with open(os.path.join(bench_dir, "sites", "common_site_config.json"), "w") as f:
+			json.dump({"backup_s3": {"bucket": "backups", "keep": 1, "auto_push": True}}, f)
+
+		def backup(run_id, size):
+			path = os.path.join(backups_dir, f"{run_id}-database.sql.gz")
+			with open(path, "wb") as f:
+				f.write(os.urandom(size))
+			file = {"path": path, "size": size, "sha256": get_file_checksum(path)}
+			manifest = {"id": run_id, "sites": {"a.local": {"status": "success", "files": [file]}}}
+			write_backup_manifest(manifest, bench_path=bench_dir)
+			return path, manifest
+
+		client = FakeS3Client()
+		store = S3BackupStore(client, "backups", prefix="bench", part_size=5, jobs=4)
+
+		# a multipart upload, & a small one; only the latest run is kept in the bucket
+		backup("20240101-000000", 12 * 1024 * 1024)
+		path, _ = backup("20240102-000000", 1024)
+		self.assertEqual(len(push_backups(bench_path=bench_dir, store=store)), 2)
+		self.assertEqual(store.get_run_ids(), ["20240102-000000"])
+		self.assertEqual(push_backups(bench_path=bench_dir, store=store), [])
+
+		target = os.path.join(bench_dir, "pulled")
+		(pulled,) = pull_backups(bench_path=bench_dir, target=target, store=store)
+		self.assertEqual(get_file_checksum(pulled), get_file_checksum(path))
+
+		# runs whose backups are gone or changed are skipped for good, later ones are
+		# still pushed
+		gone, _ = backup("20240103-000000", 1024)
+		os.remove(gone)
+		changed, _ = backup("20240104-000000", 1024)
+		with open(changed, "ab") as f:
+			f.write(b"changed")
+		_, manifest = backup("20240105-000000", 1024)
+		with patch("bench.utils.offload.get_backup_store", return_value=store):
+			push_after_backup(manifest, bench_path=bench_dir)
+		self.assertEqual(store.get_run_ids(), ["20240105-000000"])
+		self.assertIsNone(get_pushed_runs(bench_dir)["20240103-000000"])
+		self.assertIsNone(get_pushed_runs(bench_dir)["20240104-000000"])
+
+	def test_split_dump(self):
+		import gzip
+
+		from bench.utils.restore import get_index_statements, read_split_manifest, split_dump
+
+		dump_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, dump_dir)
+		dump_path = os.path.join(dump_dir, "20240101_000000-site-database.sql.gz")
+		with gzip.open(dump_path, "wt") as f:
+			f.write(
+				"/*!40101 SET NAMES utf8mb4 */;\n"
+				"--\n-- Table structure for table `tabNote`\n--\n\n"
+				"DROP TABLE IF EXISTS `tabNote`;\n"
+				"CREATE TABLE `tabNote` (\n"
+				"  `name` varchar(140) NOT NULL,\n"
+				"  `title` varchar(140) DEFAULT NULL,\n"
+				"  `content` longtext DEFAULT NULL,\n"
+				"  PRIMARY KEY (`name`),\n"
+				"  KEY `modified` (`title`),\n"
+				"  FULLTEXT KEY `content` (`content`)\n"
+				") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;\n"
+				"LOCK TABLES `tabNote` WRITE;\n"
+				"INSERT INTO `tabNote` VALUES ('a','A','x'),('b','B','y');\n"
+				"INSERT INTO `tabNote` VALUES ('c','C','z');\n"
+				"UNLOCK TABLES;\n"
+				"CREATE TABLE `tabSeries` (\n"
+				"  `name` varchar(100) NOT NULL,\n"
+				"  PRIMARY KEY (`name`)\n"
+				") ENGINE=InnoDB;\n"
+				"/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;\n"
+			)
+
+		split_path = split_dump(dump_path)
+		self.assertEqual(split_path, os.path.join(dump_dir, "20240101_000000-site-database.split"))
+
+		tables = read_split_manifest(split_path)["tables"]
+		self.assertEqual(list(tables), ["tabNote", "tabSeries"])
+		self.assertEqual(tables["tabNote"]["keys"], ["KEY `modified` (`title`)", "FULLTEXT KEY `content` (`content`)"])
+		with gzip.open(os.path.join(split_path, tables["tabNote"]["file"]), "rt") as f:
+			self.assertEqual(f.read().count("INSERT INTO"), 2)
+
+		with open(os.path.join(split_path, "schema.sql")) as f:
+			schema = f.read()
+		self.assertIn("  PRIMARY KEY (`name`)\n) ENGINE=InnoDB DEFAULT", schema)
+		self.assertNotIn("KEY `modified`", schema)
+		for part, content in (("header", "SET NAMES"), ("post", "@OLD_SQL_MODE")):
+			with open(os.path.join(split_path, f"{part}.sql")) as f:
+				self.assertEqual(f.read().count(content), 1)
+
+		# FULLTEXT indexes are added one ALTER at a time
+		self.assertEqual(get_index_statements("tabNote", tables["tabNote"]["keys"]).count(b"ALTER TABLE"), 2)
+
+	def test_site_template_sanitization(self):
+		import gzip
+
+		from bench.exceptions import ValidationError
+		from bench.utils.restore import read_split_manifest, split_dump
+		from bench.utils.site_template import get_site_template_path, sanitize_split_backup
+
+		dump_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, dump_dir)
+		dump_path = os.path.join(dump_dir, "database.sql")
+		with open(dump_path, "w") as f:
+			for table in ("__Auth", "tabUser"):
+				f.write(
+					f"CREATE TABLE `{table}` (\n  `name` varchar(140) NOT NULL,\n  PRIMARY KEY (`name`)\n) ENGINE=InnoDB;\n"
+					f"INSERT INTO `{table}` VALUES ('Administrator');\n"
+				)
+
+		split_path = split_dump(dump_path)
+		sanitize_split_backup(split_path)
+		tables = read_split_manifest(split_path)["tables"]
+		self.assertEqual((tables["__Auth"]["size"], tables["tabUser"]["size"] > 0), (0, True))
+		with gzip.open(os.path.join(split_path, tables["__Auth"]["file"])) as f:
+			self.assertEqual(f.read(), b"")
+
+		self.assertRaises(ValidationError, get_site_template_path, "../sites")
+
+	def test_clone_site(self):
+		from contextlib import contextmanager
+		from unittest.mock import patch
+
+		from bench.config.site_config import get_site_config, put_site_config
+		from bench.utils.site import clone_site, new_site
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "sites", "a.local", "public", "files"))
+		with open(os.path.join(bench_dir, "sites", "a.local", "public", "files", "logo.png"), "w") as f:
+			f.write("logo")
+		put_site_config(
+			"a.local",
+			{
+				"db_name": "_a",
+				"db_password": "secret",
+				"encryption_key": "key",
+				"host_name": "https://a.example.com",
+				"maintenance_mode": 1,
+				"limits": {"users": 5},
+			},
+			bench_path=bench_dir,
+		)
+
+		# no database server needed: clients are `true` & statements are collected
+		@contextmanager
+		def mysql_client(credentials, programs=None):
+			yield ["true"]
+
+		statements = []
+
+		def load_sql(client, chunks, description):
+			statements.extend(chunks)
+
+		with patch("bench.utils.restore.mysql_client", mysql_client), patch(
+			"bench.utils.restore.load_sql", load_sql
+		), patch("bench.utils.restore.get_db_credentials", return_value={}):
+			clone_site("a.local", "staging.local", bench_path=bench_dir)
+			clone_site("a.local", "copy.local", bench_path=bench_dir, as_is=True)
+
+			with self.assertRaises(RuntimeError), new_site("broken.local", {}, bench_path=bench_dir):
+				raise RuntimeError
+			self.assertFalse(os.path.exists(os.path.join(bench_dir, "sites", "broken.local")))
+			self.assertIn(b"DROP DATABASE IF EXISTS", statements[-1])
+
+		config = get_site_config("staging.local", bench_path=bench_dir)
+		self.assertNotIn("host_name", config)
+		self.assertNotIn("maintenance_mode", config)
+		self.assertNotEqual((config["db_name"], config["db_password"]), ("_a", "secret"))
+		self.assertEqual((config["encryption_key"], config["limits"]), ("key", {"users": 5}))
+		self.assertEqual((config["mute_emails"], config["pause_scheduler"]), (1, 1))
+		self.assertTrue(
+			os.path.exists(os.path.join(bench_dir, "sites", "staging.local", "public", "files", "logo.png"))
+		)
+
+		config = get_site_config("copy.local", bench_path=bench_dir)
+		self.assertNotIn("mute_emails", config)
+		self.assertNotIn("pause_scheduler", config)
+		self.assertEqual(config["encryption_key"], "key")
+
+	def test_clone_bench(self):
+		from bench.config.common_site_config import get_config, put_config
+		from bench.exceptions import ValidationError
+		from bench.utils.bench import clone_bench
+
+		benches_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, benches_dir)
+		bench_dir = os.path.join(benches_dir, "source")
+		site_packages = os.path.join(bench_dir, "env", "lib", "python3.10", "site-packages")
+		for path in ("apps/frappe/frappe/public", "env/bin", "sites/assets", "config/pids", "logs"):
+			os.makedirs(os.path.join(bench_dir, path))
+		os.makedirs(site_packages)
+		with open(os.path.join(bench_dir, "env", "bin", "frappe"), "w") as f:
+			f.write(f"#!{bench_dir}/env/bin/python\n")
+		with open(os.path.join(site_packages, "__editable__.frappe.pth"), "w") as f:
+			f.write(f"{bench_dir}/apps/frappe\n")
+		os.symlink(
+			os.path.join(bench_dir, "apps", "frappe", "frappe", "public"),
+			os.path.join(bench_dir, "sites", "assets", "frappe"),
+		)
+		put_config(
+			{"webserver_port": 8000, "redis_cache": "redis://127.0.0.1:13000", "developer_mode": 1},
+			bench_dir,
+		)
+		other_dir = os.path.join(benches_dir, "other")
+		os.makedirs(os.path.join(other_dir, "sites"))
+		put_config({"webserver_port": 8004, "redis_cache": "redis://127.0.0.1:13004"}, other_dir)
+
+		# cloned elsewhere, the clone mustn't take ports of the bench or its siblings
+		clone_dir = os.path.join(benches_dir, "elsewhere", "clone")
+		clone_bench(clone_dir, bench_path=bench_dir)
+
+		with open(os.path.join(clone_dir, "env", "bin", "frappe")) as f:
+			self.assertEqual(f.read(), f"#!{clone_dir}/env/bin/python\n")
+		with open(os.path.join(clone_dir, site_packages[len(bench_dir) + 1 :], "__editable__.frappe.pth")) as f:
+			self.assertEqual(f.read(), f"{clone_dir}/apps/frappe\n")
+		self.assertEqual(
+			os.path.realpath(os.path.join(clone_dir, "sites", "assets", "frappe")),
+			os.path.join(clone_dir, "apps", "frappe", "frappe", "public"),
+		)
+
+		# the clone gets its own ports, the rest of the config carries over
+		config = get_config(clone_dir)
+		self.assertEqual((config["webserver_port"], config["developer_mode"]), (8005, 1))
+		self.assertEqual(config["redis_cache"], "redis://127.0.0.1:13005")
+
+		self.assertRaises(ValidationError, clone_bench, clone_dir, bench_path=bench_dir)
+
+	def test_snapshot_rollback(self):
+		from bench.config.common_site_config import get_config, put_config
+		from bench.utils.snapshot import create_snapshot, get_snapshots, prune_snapshots, rollback
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		app_dir = os.path.join(bench_dir, "apps", "frappe")
+		for path in ("apps/frappe/frappe", "env/bin", "sites/assets", "config/pids", "logs"):
+			os.makedirs(os.path.join(bench_dir, path))
+		for name in ("frappe/hooks.py", "frappe/modules.txt", "frappe/patches.txt"):
+			open(os.path.join(app_dir, name), "w").close()
+		with open(os.path.join(bench_dir, "env", "bin", "python"), "w") as f:
+			f.write("before")
+		put_config({}, bench_dir)
+
+		git = "git -c user.name=bench -c user.email=bench@example.com"
+		for cmd in ("git init --quiet", f"{git} commit --quiet --allow-empty -m one", "git add .", f"{git} commit --quiet -m two"):
+			subprocess.check_output(cmd, shell=True, cwd=app_dir)
+		commit = subprocess.check_output("git rev-parse HEAD", shell=True, cwd=app_dir, text=True).strip()
+
+		snapshot = create_snapshot(bench_path=bench_dir, backup=False)
+		self.assertEqual(snapshot["apps"]["frappe"]["commit"], commit)
+		self.assertEqual([s["id"] for s in get_snapshots(bench_dir)], [snapshot["id"]])
+
+		# a failed update: the app moved on & the env changed
+		subprocess.check_output("git reset --quiet --hard HEAD~1", shell=True, cwd=app_dir)
+		with open(os.path.join(bench_dir, "env", "bin", "python"), "w") as f:
+			f.write("after")
+
+		rollback(bench_path=bench_dir, code_only=True)
+		self.assertEqual(
+			subprocess.check_output("git rev-parse HEAD", shell=True, cwd=app_dir, text=True).strip(),
+			commit,
+		)
+		with open(os.path.join(bench_dir, "env", "bin", "python")) as f:
+			self.assertEqual(f.read(), "before")
+		self.assertEqual(get_config(bench_dir)["maintenance_mode"], 0)
+
+		# the snapshot is still there for another rollback, until it's pruned
+		self.assertEqual(prune_snapshots(bench_path=bench_dir, keep=1), [])
+
+	def test_update_journal(self):
+		from bench.exceptions import ValidationError
+		from bench.utils.journal import UpdateJournal
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		self.assertRaises(ValidationError, UpdateJournal.resume, bench_dir)
+
+		journal = UpdateJournal.start({"force": True}, bench_path=bench_dir)
+		with journal.phase("pull"):
+			for app in ("frappe", "erpnext"):
+				with journal.unit("pull", app) as unit:
+					unit["commit"] = app
+		with self.assertRaises(RuntimeError), journal.phase("patch"):
+			for site in ("a.localhost", "b.localhost", "c.localhost"):
+				if site == "b.localhost":
+					raise RuntimeError("migration failed")
+				journal.set_unit("patch", site, "success", log_file=f"{site}.log")
+
+		journal = UpdateJournal.resume(bench_dir)
+		self.assertEqual(journal.options, {"force": True})
+		self.assertTrue(journal.is_done("pull"))
+		self.assertFalse(journal.is_done("patch"))
+		self.assertEqual(journal.data["phases"]["patch"]["error"], "migration failed")
+		self.assertEqual(
+			journal.pending("patch", ["a.localhost", "b.localhost", "c.localhost"]),
+			["b.localhost", "c.localhost"],
+		)
+
+		journal.finish()
+		self.assertRaises(ValidationError, UpdateJournal.resume, bench_dir)
+
+	def test_run_task_graph(self):
+		import threading
+		import time
+
+		from bench.utils.parallel import get_critical_path, run_task_graph
+
+		running, peak, lock = [], [0], threading.Lock()
+
+		def task(name, duration, fail=False):
+			def run():
+				with lock:
+					running.append(name)
+					peak[0] = max(peak[0], len(running))
+				time.sleep(duration)
+				with lock:
+					running.remove(name)
+				if fail:
+					raise RuntimeError(name)
+
+			return run
+
+		tasks = {
+			"backup": (task("backup", 0.2), []),
+			"fetch": (task("fetch", 0.05), []),
+			"pull": (task("pull", 0.05), ["fetch", "backup"]),
+			"node": (task("node", 0.05), ["pull"]),
+			"python": (task("python", 0.1), ["pull"]),
+			"migrate": (task("migrate", 0.05), ["python"]),
+		}
+		results = run_task_graph(tasks, jobs=2)
+		deps = {name: task_deps for name, (_, task_deps) in tasks.items()}
+
+		self.assertEqual({result["status"] for result in results.values()}, {"success"})
+		self.assertLessEqual(peak[0], 2)
+		self.assertGreaterEqual(results["pull"]["started"], results["backup"]["finished"])
+		self.assertEqual(get_critical_path(results, deps), ["backup", "pull", "python", "migrate"])
+
+		# dependents of a failed task aren't started
+		tasks["python"] = (task("python", 0, fail=True), ["pull"])
+		results = run_task_graph(tasks, jobs=2, fail_fast=False)
+		self.assertEqual(results["python"]["status"], "failed")
+		self.assertEqual(results["migrate"]["status"], "not started")
+		self.assertRaises(RuntimeError, run_task_graph, tasks, jobs=2)
+
+		tasks["fetch"] = (task("fetch", 0), ["node"])
+		self.assertRaises(ValueError, run_task_graph, tasks)
+
+	def test_update_tasks(self):
+		from bench.utils.journal import UpdateJournal
+		from bench.utils.update import get_update_tasks
+
+		bench_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_dir)
+		os.makedirs(os.path.join(bench_dir, "sites"))
+		for app in ("frappe", "erpnext"):
+			os.makedirs(os.path.join(bench_dir, "apps", app, app))
+			for name in ("hooks.py", "modules.txt", "patches.txt"):
+				open(os.path.join(bench_dir, "apps", app, app, name), "w").close()
+
+		options = {
+			"pull": True,
+			"apps": [],
+			"patch": True,
+			"build": True,
+			"requirements": True,
+			"backup": True,
+			"force": False,
+			"reset": False,
+			"site_maintenance": False,
+			"apply": False,
+			"snapshot": False,
+			"version_upgrade": [False, 15, 15],
+		}
+		journal = UpdateJournal.start(options, bench_path=bench_dir)
+		deps = {
+			name: set(task_deps)
+			for name, (_, task_deps) in get_update_tasks(journal, bench_path=bench_dir).items()
+		}
+
+		# no app is pulled before all of them are checked for local changes
+		self.assertEqual(deps["check"], set())
+		for app in ("frappe", "erpnext"):
+			self.assertLessEqual({"check", "backup", f"fetch:{app}"}, deps[f"pull:{app}"])
+		self.assertIn("python:frappe", deps["python:erpnext"])
+		self.assertLessEqual({"python:frappe", "python:erpnext"}, deps["patch"])
+		self.assertLessEqual(
+			{"python:frappe", "python:erpnext", "node:frappe", "node:erpnext"}, deps["build"]
+		)
+
+		# a dirty app stops the update before any app is pulled
+		from unittest.mock import patch
+
+		from bench.utils.parallel import run_task_graph
+
+		options.update({"patch": False, "build": False, "requirements": False, "backup": False})
+		journal = UpdateJournal.start(options, bench_path=bench_dir)
+		checked = []
+
+		def check_local_changes(apps, bench_path):
+			checked.extend(apps)
+			raise SystemExit(1)
+
+		with patch("bench.app.check_local_changes", check_local_changes), patch(
+			"bench.app.pull_apps"
+		) as pull_apps:
+			tasks = get_update_tasks(journal, bench_path=bench_dir)
+			self.assertRaises(SystemExit, run_task_graph, tasks)
+		self.assertEqual(sorted(checked), ["erpnext", "frappe"])
+		pull_apps.assert_not_called()
@@ -252,6 +252,10 @@ def run_frappe_cmd(*args, **kwargs):
 
 	return_code = print_output(p) if is_async else p.wait()
 	if return_code > 0:
+		if kwargs.get("_raise"):
+			raise CommandFailedError(
+				f"{' '.join(args)} failed with exit code {return_code}", return_code
+			)
 		sys.exit(return_code)
 
 
@@ -0,0 +1,835 @@
+# imports - standard imports
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, List
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.exceptions import ValidationError
+from bench.utils import exec_cmd, get_cmd_output, log
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# asset manifests written by frappe's build into sites/assets
+MANIFEST_FILES = ("assets.json", "assets-rtl.json")
+# files in an app's root that affect how its assets are built
+APP_BUILD_FILES = ("package.json", "yarn.lock", "pnpm-lock.yaml")
+# directories skipped while computing digests of an app's sources
+IGNORED_DIRS = ("dist", "node_modules", ".git", "__pycache__")
+DEFAULT_CACHE_KEEP = 3
+DEFAULT_STORE_MAX_SIZE = 5 * 1024  # in MB
+# apps are built in a single `bench build`, as before, unless more jobs are asked for
+DEFAULT_BUILD_JOBS = 1
+# peak memory of a single `bench build --app` process, roughly
+DEFAULT_BUILD_MEMORY_PER_JOB = 1024  # in MB
+# built files worth serving precompressed, & the size below which nginx won't gzip
+COMPRESSIBLE_EXTENSIONS = (".js", ".css", ".map", ".json", ".svg", ".html", ".txt", ".xml")
+COMPRESS_MIN_SIZE = 256
+
+
+def get_assets_path(bench_path=".") -> str:
+	return os.path.join(bench_path, "sites", "assets")
+
+
+def get_app_public_path(app: str, bench_path=".") -> str:
+	return os.path.join(bench_path, "apps", app, app, "public")
+
+
+def get_assets_cache_path(bench_path=".") -> str:
+	return os.path.join(bench_path, ".cache", "assets")
+
+
+def get_build_jobs(jobs: int = None, bench_path=".") -> int:
+	"""Number of apps to build concurrently: `jobs`, `build_jobs` from
+	common_site_config.json or 1, limited by the memory available for
+	`build_memory_per_job` (MB) per build"""
+	from bench.utils.parallel import get_available_memory, get_jobs
+
+	config = get_config(bench_path)
+	jobs = get_jobs(jobs or config.get("build_jobs") or DEFAULT_BUILD_JOBS)
+	available_memory = get_available_memory()
+
+	if available_memory:
+		jobs = min(jobs, max(1, available_memory // get_build_memory_per_job(bench_path)))
+
+	return jobs
+
+
+def get_build_memory_per_job(bench_path=".") -> int:
+	return get_config(bench_path).get("build_memory_per_job") or DEFAULT_BUILD_MEMORY_PER_JOB
+
+
+def is_precompress_assets_enabled(bench_path=".") -> bool:
+	return bool(get_config(bench_path).get("precompress_assets"))
+
+
+def is_assets_cache_enabled(bench_path=".") -> bool:
+	"""Caching can be turned off by setting `assets_cache` to false in
+	common_site_config.json"""
+	return get_config(bench_path).get("assets_cache", True)
+
+
+def update_digest_with_tree(digest, path: str):
+	"""Feeds the relative paths & contents of all files under path into digest"""
+	for root, dirs, files in os.walk(path):
+		dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+
+		for name in sorted(files):
+			file_path = os.path.join(root, name)
+			digest.update(os.path.relpath(file_path, path).encode())
+
+			if os.path.islink(file_path):
+				digest.update(os.readlink(file_path).encode())
+				continue
+
+			with open(file_path, "rb") as f:
+				for chunk in iter(lambda: f.read(1 << 20), b""):
+					digest.update(chunk)
+
+
+def update_digest_with_files(digest, paths: List[str]):
+	for path in paths:
+		if os.path.isfile(path):
+			digest.update(os.path.basename(path).encode())
+			with open(path, "rb") as f:
+				digest.update(f.read())
+
+
+def get_build_tool_version(bench_path=".") -> str:
+	"""Identifies frappe's asset build tooling: the frappe version along with its
+	esbuild scripts & node dependencies. Assets built by different tooling are never
+	reused."""
+	from bench.utils.app import get_current_version
+
+	frappe_path = os.path.join(bench_path, "apps", "frappe")
+	digest = hashlib.sha256()
+	digest.update(str(get_current_version("frappe", bench_path=bench_path)).encode())
+	update_digest_with_files(digest, [os.path.join(frappe_path, f) for f in APP_BUILD_FILES])
+
+	esbuild_path = os.path.join(frappe_path, "esbuild")
+	if os.path.isdir(esbuild_path):
+		update_digest_with_tree(digest, esbuild_path)
+
+	return digest.hexdigest()[:16]
+
+
+def get_app_assets_digest(app: str, bench_path=".", build_tool_version: str = None) -> str:
+	"""Digest over everything that goes into building an app's assets: its public
+	sources, frontend sources, lockfiles and the build tool version"""
+	app_path = os.path.join(bench_path, "apps", app)
+	digest = hashlib.sha256()
+	digest.update(
+		(build_tool_version or get_build_tool_version(bench_path=bench_path)).encode()
+	)
+	update_digest_with_files(digest, [os.path.join(app_path, f) for f in APP_BUILD_FILES])
+
+	for source in (get_app_public_path(app, bench_path), os.path.join(app_path, "frontend")):
+		if os.path.isdir(source):
+			digest.update(os.path.basename(source).encode())
+			update_digest_with_tree(digest, source)
+
+	return digest.hexdigest()
+
+
+def is_app_cacheable(app: str, bench_path=".") -> bool:
+	"""Only apps whose entire build output ends up in public/dist can be restored from
+	cache. Apps that run their own build script may write elsewhere too."""
+	if app == "frappe":
+		return True
+
+	package_json = os.path.join(bench_path, "apps", app, "package.json")
+	try:
+		with open(package_json) as f:
+			return "build" not in json.load(f).get("scripts", {})
+	except (OSError, ValueError):
+		return True
+
+
+def read_manifest(name: str, bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(get_assets_path(bench_path), name)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def write_manifest(name: str, manifest: Dict, bench_path="."):
+	os.makedirs(get_assets_path(bench_path), exist_ok=True)
+	with open(os.path.join(get_assets_path(bench_path), name), "w") as f:
+		json.dump(manifest, f, indent=4)
+
+
+def get_app_manifest(app: str, bench_path=".") -> Dict:
+	"""Entries of sites/assets manifests that point to the app's bundles"""
+	prefix = f"/assets/{app}/"
+	return {
+		name: {
+			k: v
+			for k, v in read_manifest(name, bench_path).items()
+			if isinstance(v, str) and v.startswith(prefix)
+		}
+		for name in MANIFEST_FILES
+	}
+
+
+def set_app_manifest(app: str, app_manifest: Dict, bench_path="."):
+	"""Replaces the app's entries in sites/assets manifests with app_manifest"""
+	prefix = f"/assets/{app}/"
+
+	for name in MANIFEST_FILES:
+		manifest = {
+			k: v
+			for k, v in read_manifest(name, bench_path).items()
+			if not (isinstance(v, str) and v.startswith(prefix))
+		}
+		manifest.update(app_manifest.get(name, {}))
+		write_manifest(name, manifest, bench_path)
+
+
+class AssetsCache:
+	"""Directory of built assets, one entry per app & key:
+
+	<path>/<app>/<key>/dist/...		the app's built public/dist folder
+	<path>/<app>/<key>/manifest.json	the app's entries in sites/assets/*.json
+	"""
+
+	def __init__(self, path: str, keep: int = DEFAULT_CACHE_KEEP):
+		self.path = os.path.abspath(path)
+		self.keep = keep
+
+	def entry_path(self, app: str, key: str) -> str:
+		return os.path.join(self.path, app, key)
+
+	def has(self, app: str, key: str) -> bool:
+		return os.path.exists(os.path.join(self.entry_path(app, key), "manifest.json"))
+
+	def restore(self, app: str, key: str, bench_path="."):
+		"""Puts the cached build of app in place of its current public/dist"""
+		from bench.utils.fs import copy_tree
+
+		entry = self.entry_path(app, key)
+		dist_path = os.path.join(get_app_public_path(app, bench_path), "dist")
+
+		if os.path.exists(dist_path):
+			shutil.rmtree(dist_path)
+		copy_tree(os.path.join(entry, "dist"), dist_path)
+
+		with open(os.path.join(entry, "manifest.json")) as f:
+			set_app_manifest(app, json.load(f), bench_path=bench_path)
+
+		# mark as recently used
+		os.utime(entry)
+
+	def store(self, app: str, key: str, bench_path="."):
+		"""Saves the app's current public/dist & manifest entries under key"""
+		from bench.utils.fs import copy_tree
+
+		dist_path = os.path.join(get_app_public_path(app, bench_path), "dist")
+		if not os.path.isdir(dist_path):
+			return
+
+		entry = self.entry_path(app, key)
+		tmp_entry = f"{entry}.tmp"
+		shutil.rmtree(tmp_entry, ignore_errors=True)
+
+		copy_tree(dist_path, os.path.join(tmp_entry, "dist"))
+		with open(os.path.join(tmp_entry, "manifest.json"), "w") as f:
+			json.dump(get_app_manifest(app, bench_path=bench_path), f)
+
+		shutil.rmtree(entry, ignore_errors=True)
+		os.rename(tmp_entry, entry)
+		self.prune(app)
+
+	def prune(self, app: str):
+		"""Keeps only the most recently used `keep` entries of the app"""
+		app_path = os.path.join(self.path, app)
+		entries = sorted(
+			(os.path.join(app_path, key) for key in os.listdir(app_path)),
+			key=os.path.getmtime,
+			reverse=True,
+		)
+
+		for entry in entries[self.keep :]:
+			shutil.rmtree(entry, ignore_errors=True)
+
+
+def get_assets_store(bench_path=".") -> "AssetsStore":
+	"""Host-wide assets store, unless `assets_store` is set to false in
+	common_site_config.json. Its location & size limit (in MB) can be set via
+	`assets_store_path` and `assets_store_max_size`."""
+	config = get_config(bench_path)
+
+	if not config.get("assets_store", True):
+		return None
+
+	path = config.get("assets_store_path") or os.path.join("~", ".cache", "bench", "assets")
+	return AssetsStore(
+		os.path.expanduser(path),
+		max_size=config.get("assets_store_max_size") or DEFAULT_STORE_MAX_SIZE,
+	)
+
+
+def get_app_commit(app: str, bench_path=".") -> str:
+	"""Commit the app's assets are built from, or None if the app isn't a git repo or
+	has local changes to its asset sources"""
+	app_path = os.path.join(bench_path, "apps", app)
+	sources = [f"{app}/public", "frontend", *APP_BUILD_FILES]
+
+	try:
+		commit = get_cmd_output("git rev-parse HEAD", cwd=app_path)
+		changes = get_cmd_output(
+			f"git status --porcelain -- {' '.join(sources)}", cwd=app_path
+		)
+	except Exception:
+		return None
+
+	return None if changes else commit
+
+
+class AssetsStore:
+	"""Content-addressed store of built assets shared by all benches on a host (and
+	across hosts via export/import). Builds are keyed by app, commit & build tool
+	version; identical builds are stored once.
+
+	<path>/objects/<sha256>.tar	an app's dist folder & manifest entries
+	<path>/index.json		key → object, size & last use, for LRU eviction
+	"""
+
+	def __init__(self, path: str, max_size: int = DEFAULT_STORE_MAX_SIZE):
+		self.path = os.path.abspath(path)
+		self.objects_path = os.path.join(self.path, "objects")
+		self.index_path = os.path.join(self.path, "index.json")
+		self.max_size = max_size * 1024 * 1024
+
+	@staticmethod
+	def get_key(app: str, commit: str, build_tool_version: str) -> str:
+		return f"{app}@{commit}:{build_tool_version}"
+
+	@contextmanager
+	def lock(self):
+		"""Serializes index updates between benches sharing the store"""
+		import fcntl
+
+		os.makedirs(self.objects_path, exist_ok=True)
+		with open(os.path.join(self.path, ".lock"), "w") as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+	def read_index(self) -> Dict:
+		try:
+			with open(self.index_path) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def write_index(self, index: Dict):
+		tmp_path = f"{self.index_path}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(index, f, indent=1, sort_keys=True)
+		os.rename(tmp_path, self.index_path)
+
+	def object_path(self, sha: str) -> str:
+		return os.path.join(self.objects_path, f"{sha}.tar")
+
+	def has(self, key: str) -> bool:
+		entry = self.read_index().get(key)
+		return bool(entry) and os.path.exists(self.object_path(entry["object"]))
+
+	def restore(self, key: str, app: str, bench_path=".") -> bool:
+		"""Extracts the stored build into the app's public/dist. Returns False if it
+		isn't in the store (anymore), leaving public/dist as it was."""
+		public_path = get_app_public_path(app, bench_path)
+		tmp_path = os.path.join(public_path, ".dist.tmp")
+		dist_path = os.path.join(public_path, "dist")
+		shutil.rmtree(tmp_path, ignore_errors=True)
+
+		# so that the build isn't evicted while it's being extracted
+		with self.lock():
+			index = self.read_index()
+			if key not in index or not os.path.exists(self.object_path(index[key]["object"])):
+				return False
+
+			index[key]["last_used"] = time.time()
+			self.write_index(index)
+
+			with tarfile.open(self.object_path(index[key]["object"])) as tar:
+				if hasattr(tarfile, "data_filter"):
+					tar.extractall(tmp_path, filter="data")
+				else:
+					check_tar_members(tar)
+					tar.extractall(tmp_path)
+
+		with open(os.path.join(tmp_path, "manifest.json")) as f:
+			app_manifest = json.load(f)
+
+		shutil.rmtree(dist_path, ignore_errors=True)
+		os.rename(os.path.join(tmp_path, "dist"), dist_path)
+		shutil.rmtree(tmp_path)
+		set_app_manifest(app, app_manifest, bench_path=bench_path)
+		return True
+
+	def publish(self, key: str, app: str, bench_path=".", **meta):
+		"""Adds the app's current public/dist & manifest entries to the store"""
+		dist_path = os.path.join(get_app_public_path(app, bench_path), "dist")
+		if not os.path.isdir(dist_path):
+			return
+
+		os.makedirs(self.objects_path, exist_ok=True)
+		tmp_path = os.path.join(self.objects_path, f".{app}.{os.getpid()}.tmp")
+		manifest = json.dumps(get_app_manifest(app, bench_path=bench_path)).encode()
+
+		with tarfile.open(tmp_path, "w") as tar:
+			tar.add(dist_path, arcname="dist")
+			info = tarfile.TarInfo("manifest.json")
+			info.size = len(manifest)
+			tar.addfile(info, BytesIO(manifest))
+
+		digest = hashlib.sha256()
+		with open(tmp_path, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				digest.update(chunk)
+		sha = digest.hexdigest()
+
+		with self.lock():
+			os.rename(tmp_path, self.object_path(sha))
+			index = self.read_index()
+			index[key] = {
+				"app": app,
+				"object": sha,
+				"size": os.path.getsize(self.object_path(sha)),
+				"created": time.time(),
+				"last_used": time.time(),
+				**meta,
+			}
+			self.write_index(index)
+
+		self.evict()
+
+	def remove(self, keys: List[str]):
+		with self.lock():
+			index = self.read_index()
+			for key in keys:
+				index.pop(key, None)
+			self.write_index(index)
+			self.remove_unreferenced_objects(index)
+
+	def remove_unreferenced_objects(self, index: Dict):
+		referenced = {entry["object"] for entry in index.values()}
+		for name in os.listdir(self.objects_path):
+			if name.endswith(".tar") and name[: -len(".tar")] not in referenced:
+				os.remove(os.path.join(self.objects_path, name))
+
+	def size(self, index: Dict = None) -> int:
+		index = self.read_index() if index is None else index
+		objects = {entry["object"]: entry["size"] for entry in index.values()}
+		return sum(objects.values())
+
+	def evict(self, max_size: int = None) -> List[str]:
+		"""Removes least recently used builds until the store fits in max_size bytes.
+		Returns the evicted keys."""
+		max_size = self.max_size if max_size is None else max_size
+		evicted = []
+
+		with self.lock():
+			index = self.read_index()
+			by_last_use = sorted(index, key=lambda key: index[key]["last_used"])
+
+			while by_last_use and self.size(index) > max_size:
+				key = by_last_use.pop(0)
+				del index[key]
+				evicted.append(key)
+
+			if evicted:
+				self.write_index(index)
+				self.remove_unreferenced_objects(index)
+
+		return evicted
+
+	def export(self, path: str, apps: List[str] = None) -> List[str]:
+		"""Writes the stored builds (of the given apps) to a gzipped tarball that can be
+		imported into another store. Returns the exported keys."""
+		index = {
+			key: entry
+			for key, entry in self.read_index().items()
+			if not apps or entry["app"] in apps
+		}
+		data = json.dumps(index).encode()
+
+		with tarfile.open(path, "w:gz") as tar:
+			info = tarfile.TarInfo("index.json")
+			info.size = len(data)
+			tar.addfile(info, BytesIO(data))
+			for sha in {entry["object"] for entry in index.values()}:
+				tar.add(self.object_path(sha), arcname=f"objects/{sha}.tar")
+
+		return list(index)
+
+	def import_(self, path: str) -> List[str]:
+		"""Adds builds from a tarball created by `export` to the store, after checking
+		each object against the digest it's named by. Returns the imported keys."""
+		with tarfile.open(path, "r:gz") as tar:
+			imported = json.load(tar.extractfile("index.json"))
+
+			for key, entry in imported.items():
+				if not is_sha256(entry.get("object") or ""):
+					raise ValidationError(f"{key} in {path} doesn't point to a sha256 digest")
+
+			with self.lock():
+				for member in tar.getmembers():
+					if not member.name.startswith("objects/") or not member.isfile():
+						continue
+					sha = os.path.basename(member.name)[: -len(".tar")]
+					if not is_sha256(sha):
+						raise ValidationError(f"{member.name} in {path} isn't named by a sha256 digest")
+					if os.path.exists(self.object_path(sha)):
+						continue
+
+					source = tar.extractfile(member)
+					tmp_path = f"{self.object_path(sha)}.tmp"
+					digest = hashlib.sha256()
+					with open(tmp_path, "wb") as f:
+						for chunk in iter(lambda: source.read(1 << 20), b""):
+							digest.update(chunk)
+							f.write(chunk)
+
+					if digest.hexdigest() != sha:
+						os.remove(tmp_path)
+						raise ValidationError(f"{member.name} in {path} doesn't match its digest")
+					os.rename(tmp_path, self.object_path(sha))
+
+				imported = {
+					key: entry
+					for key, entry in imported.items()
+					if os.path.exists(self.object_path(entry["object"]))
+				}
+				index = self.read_index()
+				for entry in imported.values():
+					entry["last_used"] = time.time()
+				index.update(imported)
+				self.write_index(index)
+
+		self.evict()
+		return list(imported)
+
+
+def is_sha256(value: str) -> bool:
+	return bool(re.fullmatch(r"[0-9a-f]{64}", value))
+
+
+def check_tar_members(tar: tarfile.TarFile):
+	"""Does what tarfile's "data" filter would on Pythons that don't have it: rejects
+	absolute paths, members outside the extraction path & links"""
+	for member in tar.getmembers():
+		if (
+			os.path.isabs(member.name)
+			or ".." in member.name.split("/")
+			or not (member.isfile() or member.isdir())
+		):
+			raise ValidationError(f"{tar.name} has an unsafe member {member.name}")
+
+
+def build_assets(bench_path=".", app=None, force=False, jobs=None):
+	"""Builds assets of the given app (or all apps), then precompresses them if
+	precompress_assets is set in common_site_config.json"""
+	from bench.bench import Bench
+
+	apps = [app] if app else None
+	jobs = get_build_jobs(jobs, bench_path=bench_path)
+
+	if force or not is_assets_cache_enabled(bench_path):
+		run_build(bench_path=bench_path, apps=apps, jobs=jobs)
+	else:
+		apps = apps or list(Bench(bench_path).apps)
+		build_or_restore_assets(bench_path=bench_path, apps=apps, jobs=jobs)
+
+	if is_precompress_assets_enabled(bench_path):
+		compress_assets(bench_path=bench_path, apps=apps, jobs=jobs)
+
+
+def build_or_restore_assets(bench_path=".", apps=None, jobs=1):
+	"""Builds assets of the given apps. Builds are restored from the bench's assets
+	cache when nothing that goes into them has changed, or from the host-wide assets
+	store when the same commit was built by another bench."""
+	from bench.utils.parallel import run_in_parallel
+
+	cache = AssetsCache(get_assets_cache_path(bench_path))
+	store = get_assets_store(bench_path)
+	build_tool_version = get_build_tool_version(bench_path=bench_path)
+	digests = run_in_parallel(
+		lambda app: get_app_assets_digest(app, bench_path, build_tool_version), apps
+	)
+	commits, store_keys = {}, {}
+
+	to_build, restored = [], []
+	for app in apps:
+		linked = os.path.exists(os.path.join(get_assets_path(bench_path), app))
+
+		if not (linked and is_app_cacheable(app, bench_path)):
+			to_build.append(app)
+			continue
+
+		if cache.has(app, digests[app]):
+			cache.restore(app, digests[app], bench_path=bench_path)
+			log(f"Restored assets for {app} from cache", no_log=True)
+			restored.append(app)
+			continue
+
+		commits[app] = store and get_app_commit(app, bench_path=bench_path)
+		if commits[app]:
+			store_keys[app] = store.get_key(app, commits[app], build_tool_version)
+
+		if app in store_keys and store.restore(store_keys[app], app, bench_path=bench_path):
+			cache.store(app, digests[app], bench_path=bench_path)
+			log(f"Restored assets for {app} from assets store", no_log=True)
+			restored.append(app)
+			continue
+
+		to_build.append(app)
+
+	if restored:
+		# frappe's build clears it, restored builds would be served stale otherwise
+		clear_assets_json_cache(bench_path)
+
+	if not to_build:
+		return
+
+	# without concurrency, a single full build is cheaper than building apps separately
+	full_build = jobs == 1 and to_build == apps and len(apps) > 1
+	run_build(bench_path=bench_path, apps=None if full_build else to_build, jobs=jobs)
+
+	if is_precompress_assets_enabled(bench_path):
+		# so that compressed files are cached & published along with the builds
+		compress_assets(bench_path=bench_path, apps=to_build, jobs=jobs)
+
+	for app in to_build:
+		if not is_app_cacheable(app, bench_path):
+			continue
+
+		cache.store(app, digests[app], bench_path=bench_path)
+
+		if app in store_keys:
+			store.publish(
+				store_keys[app],
+				app,
+				bench_path=bench_path,
+				commit=commits[app],
+				build_tool_version=build_tool_version,
+			)
+
+
+def clear_assets_json_cache(bench_path="."):
+	"""Drops the copy of sites/assets/assets.json frappe keeps in redis, so that sites
+	serve the bundles now in place"""
+	from bench.utils import which
+
+	redis_cache = get_config(bench_path).get("redis_cache")
+	if not (redis_cache and which("redis-cli")):
+		return
+
+	try:
+		get_cmd_output(f"{which('redis-cli')} -u {redis_cache} DEL assets_json")
+	except Exception:
+		logger.warning("Couldn't clear assets_json from Redis, is it running?")
+
+
+def run_build(bench_path=".", apps=None, jobs=1):
+	"""Runs `bench build`, for the whole bench if apps isn't passed. Apps are built
+	by concurrent `bench build --app` processes if more than one job is allowed."""
+	from bench.bench import Bench
+
+	command = "bench build"
+	env = {"BENCH_DEVELOPER": "1"}
+
+	if jobs > 1:
+		apps = apps or list(Bench(bench_path).apps)
+		if len(apps) > 1:
+			return run_parallel_build(bench_path=bench_path, apps=apps, jobs=jobs)
+
+	if not apps:
+		return exec_cmd(command, cwd=bench_path, env=env)
+
+	for app in apps:
+		exec_cmd(f"{command} --app {app}", cwd=bench_path, env=env)
+
+
+def run_parallel_build(bench_path=".", apps=None, jobs=None):
+	"""Builds apps as concurrent `bench build --app` processes. A build is started only
+	while there's memory left for it, and its output is echoed prefixed by the app's
+	name and kept in logs/build/<app>.log.
+
+	Each build rewrites the sites/assets manifests, so builds finishing together may
+	drop each other's entries. Every app's entries are captured as soon as its build
+	is done and merged back into the manifests once all of them are."""
+	from bench.utils.parallel import MemoryGate, capture_cmd, run_in_parallel
+
+	env = {"BENCH_DEVELOPER": "1"}
+	gate = MemoryGate(get_build_memory_per_job(bench_path))
+	manifests, manifests_lock = {}, threading.Lock()
+
+	def build(app):
+		log_file = os.path.join(bench_path, "logs", "build", f"{app}.log")
+
+		with gate.admit():
+			return_code, _ = capture_cmd(
+				f"bench build --app {app}", cwd=bench_path, env=env, log_file=log_file, prefix=app
+			)
+
+		if not return_code:
+			with manifests_lock:
+				manifests[app] = get_app_manifest(app, bench_path)
+
+		return return_code
+
+	log(f"Building assets for {len(apps)} apps, {jobs} at a time", no_log=True)
+	results = run_in_parallel(build, apps, jobs=jobs)
+
+	# builds may also fail on races between them, like both (re)creating the symlinks
+	# in sites/assets; so retry failed ones & ones that lost their manifest entries alone
+	for app in apps:
+		lost_manifest = app in manifests and not any(manifests[app].values())
+		if results[app] or (lost_manifest and has_built_assets(app, bench_path)):
+			exec_cmd(f"bench build --app {app}", cwd=bench_path, env=env)
+			manifests[app] = get_app_manifest(app, bench_path)
+
+	for app, app_manifest in manifests.items():
+		set_app_manifest(app, app_manifest, bench_path)
+
+
+def has_built_assets(app: str, bench_path=".") -> bool:
+	dist_path = os.path.join(get_app_public_path(app, bench_path), "dist")
+	return os.path.isdir(dist_path) and bool(os.listdir(dist_path))
+
+
+def get_brotli_compressor():
+	"""Returns a function compressing bytes with brotli using the `brotli` python
+	package or CLI, whichever is available, or None if neither is"""
+	from bench.utils import which
+
+	try:
+		import brotli
+
+		return lambda data: brotli.compress(data, quality=11)
+	except ImportError:
+		pass
+
+	brotli_cli = which("brotli")
+	if brotli_cli:
+		import subprocess
+
+		return lambda data: subprocess.run(
+			[brotli_cli, "--best", "--stdout", "-"], input=data, stdout=subprocess.PIPE, check=True
+		).stdout
+
+	return None
+
+
+def get_compressible_files(bench_path=".", apps=None) -> List[str]:
+	"""Built files under sites/assets/<app>/dist that are worth precompressing. Only
+	dist is considered as the rest of sites/assets links into the apps' sources."""
+	files = []
+
+	for app in apps:
+		dist_path = os.path.join(get_assets_path(bench_path), app, "dist")
+
+		for root, _, filenames in os.walk(dist_path, followlinks=True):
+			for filename in filenames:
+				path = os.path.join(root, filename)
+				if filename.endswith(COMPRESSIBLE_EXTENSIONS) and (
+					os.path.getsize(path) >= COMPRESS_MIN_SIZE
+				):
+					files.append(path)
+
+	return files
+
+
+def gzip_compress(data: bytes) -> bytes:
+	"""Gzips data without a timestamp, so that unchanged files compress the same;
+	gzip.compress only takes mtime from Python 3.8"""
+	import gzip
+
+	buffer = BytesIO()
+	with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+		f.write(data)
+	return buffer.getvalue()
+
+
+def write_compressed(path: str, extension: str, compress) -> bool:
+	"""Writes the compressed sibling of path, unless it's already up to date. Siblings
+	carry the mtime of the file they were compressed from to tell."""
+	target = f"{path}{extension}"
+	mtime = os.stat(path).st_mtime
+
+	try:
+		if os.stat(target).st_mtime == mtime:
+			return False
+	except FileNotFoundError:
+		pass
+
+	with open(path, "rb") as f:
+		data = compress(f.read())
+
+	with open(f"{target}.tmp", "wb") as f:
+		f.write(data)
+	os.utime(f"{target}.tmp", (mtime, mtime))
+	os.replace(f"{target}.tmp", target)
+
+	return True
+
+
+def remove_stale_compressed(bench_path=".", apps=None):
+	"""Removes .gz & .br files whose source doesn't exist anymore"""
+	for app in apps:
+		dist_path = os.path.join(get_assets_path(bench_path), app, "dist")
+
+		for root, _, filenames in os.walk(dist_path, followlinks=True):
+			for filename in filenames:
+				source, extension = os.path.splitext(filename)
+				if extension in (".gz", ".br") and source not in filenames:
+					os.remove(os.path.join(root, filename))
+
+
+def compress_assets(bench_path=".", apps=None, jobs=None):
+	"""Writes .gz (and .br, if a brotli encoder is available) siblings of built assets
+	for nginx's gzip_static & brotli_static to serve, so that nginx doesn't compress
+	the same bundles on every request. Only files changed since the last run are
+	compressed."""
+	from bench.bench import Bench
+	from bench.utils.parallel import run_in_parallel
+
+	apps = apps or list(Bench(bench_path).apps)
+	compressors = {".gz": gzip_compress}
+
+	brotli_compressor = get_brotli_compressor()
+	if brotli_compressor:
+		compressors[".br"] = brotli_compressor
+	else:
+		log("No brotli encoder found, only gzipping assets", level=3)
+
+	remove_stale_compressed(bench_path=bench_path, apps=apps)
+	tasks = [
+		(path, extension)
+		for path in get_compressible_files(bench_path=bench_path, apps=apps)
+		for extension in compressors
+	]
+	results = run_in_parallel(
+		lambda task: write_compressed(*task, compressors[task[1]]), tasks, jobs=jobs
+	)
+
+	compressed = sum(results.values())
+	log(
+		f"Precompressed {compressed} asset files, {len(results) - compressed} were up to date",
+		no_log=True,
+	)
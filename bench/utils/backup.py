@@ -0,0 +1,489 @@
+# imports - standard imports
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.exceptions import CommandFailedError, ValidationError
+from bench.utils import log, which
+from bench.utils.offload import push_after_backup
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# backups are IO bound; a couple at a time keeps the disks usable for sites
+DEFAULT_BACKUP_JOBS = 2
+BACKUP_COMPRESSIONS = ("zstd",)
+BACKUPS_DIR = "backups"
+# scheduled backups: every site is backed up once per interval (in minutes), at an
+# offset into it derived from the bench & site, with at most backup_host_jobs
+# running on the host across benches
+DEFAULT_BACKUP_INTERVAL = 6 * 60
+DEFAULT_BACKUP_HOST_JOBS = 2
+BACKUP_HISTORY_KEEP = 30
+# extensions of frappe's backups & what they're renamed to when recompressed
+RECOMPRESSED_EXTENSIONS = {".sql.gz": ".sql.zst", ".tar": ".tar.zst", ".tgz": ".tar.zst"}
+
+
+def get_backups_path(bench_path=".") -> str:
+	return os.path.join(os.path.abspath(bench_path), BACKUPS_DIR)
+
+
+def get_site_backups_path(site: str, bench_path=".") -> str:
+	return os.path.join(bench_path, "sites", site, "private", "backups")
+
+
+def get_backup_log_file(site: str, bench_path=".") -> str:
+	return os.path.join(bench_path, "logs", "backup", f"{site}.log")
+
+
+def get_backup_compression(compress: str = None, bench_path=".") -> str:
+	"""`compress`, or backup_compression from common_site_config.json"""
+	compress = compress or get_config(bench_path).get("backup_compression")
+
+	if compress and compress not in BACKUP_COMPRESSIONS:
+		raise ValidationError(
+			f"Unsupported backup compression {compress}. Use one of"
+			f" {', '.join(BACKUP_COMPRESSIONS)}"
+		)
+	if compress and not which(compress):
+		raise ValidationError(f"{compress} isn't installed, it's needed to compress backups")
+
+	return compress
+
+
+def get_low_priority_cmd(idle_io: bool = False) -> List[str]:
+	"""A command prefix running processes at a low CPU & IO priority. With `idle_io`,
+	they only get disk time when nothing else wants it."""
+	prefix = []
+
+	if which("ionice"):
+		prefix += ["ionice", "-c", "3"] if idle_io else ["ionice", "-c", "2", "-n", "7"]
+	if which("nice"):
+		prefix += ["nice", "-n", "10"]
+
+	return prefix
+
+
+def get_file_checksum(path: str) -> str:
+	sha256 = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b""):
+			sha256.update(chunk)
+	return sha256.hexdigest()
+
+
+def recompress(path: str, threads: int = 1, prefix: List[str] = None) -> str:
+	"""Recompresses one of frappe's backups with multi-threaded zstd, next to it. The
+	original is kept so that frappe's retention & `bench --site <site> restore` keep
+	working with it. Returns the new file's path, or path if its format isn't
+	recompressed."""
+	for extension, new_extension in RECOMPRESSED_EXTENSIONS.items():
+		if path.endswith(extension):
+			break
+	else:
+		return path
+
+	target = path[: -len(extension)] + new_extension
+	cmd = [*(prefix or []), "zstd", f"-T{threads}", "-q", "-f", "-o", f"{target}.tmp"]
+	opener = gzip.open if extension in (".sql.gz", ".tgz") else open
+
+	with opener(path, "rb") as source:
+		p = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+		try:
+			shutil.copyfileobj(source, p.stdin, 1024 * 1024)
+		finally:
+			p.stdin.close()
+
+	if p.wait():
+		with contextlib.suppress(OSError):
+			os.remove(f"{target}.tmp")
+		raise CommandFailedError(f"Compressing {path} with zstd failed")
+
+	shutil.copystat(path, f"{target}.tmp")
+	os.replace(f"{target}.tmp", target)
+	return target
+
+
+def prune_recompressed(backups_path: str) -> List[str]:
+	"""Removes zstd copies whose originals frappe's retention has removed, so that they
+	don't outlive them. Returns the removed paths."""
+	removed = []
+
+	for name in os.listdir(backups_path) if os.path.isdir(backups_path) else []:
+		originals = [
+			name[: -len(new_extension)] + extension
+			for extension, new_extension in RECOMPRESSED_EXTENSIONS.items()
+			if name.endswith(new_extension)
+		]
+		if originals and not any(
+			os.path.exists(os.path.join(backups_path, original)) for original in originals
+		):
+			os.remove(os.path.join(backups_path, name))
+			removed.append(os.path.join(backups_path, name))
+
+	return removed
+
+
+def run_site_backup(
+	site: str,
+	bench_path=".",
+	with_files: bool = False,
+	compress: str = None,
+	threads: int = 1,
+	idle_io: bool = False,
+) -> Dict:
+	"""Runs `bench --site <site> backup` at a low priority, recompresses what it
+	produced if `compress` is set & checksums it. Output goes to
+	logs/backup/<site>.log, echoed prefixed by the site's name in verbose mode."""
+	import bench.cli
+	from bench.utils.bench import get_env_cmd
+	from bench.utils.parallel import capture_cmd
+
+	prefix = get_low_priority_cmd(idle_io)
+	python = get_env_cmd("python", bench_path=bench_path)
+	backups_path = get_site_backups_path(site, bench_path=bench_path)
+	log_file = os.path.abspath(get_backup_log_file(site, bench_path=bench_path))
+	existing = set(os.listdir(backups_path)) if os.path.isdir(backups_path) else set()
+
+	click.secho(f"Backing up {site}", fg="yellow")
+	start = time.monotonic()
+	return_code, _ = capture_cmd(
+		" ".join([*prefix, python])
+		+ f" -m frappe.utils.bench_helper frappe --site {site} backup"
+		+ (" --with-files" if with_files else ""),
+		cwd=os.path.join(bench_path, "sites"),
+		log_file=log_file,
+		prefix=site if bench.cli.verbose else None,
+	)
+
+	files = sorted(
+		os.path.join(backups_path, name)
+		for name in set(os.listdir(backups_path) if os.path.isdir(backups_path) else []) - existing
+	)
+	result = {"status": "failed" if return_code else "success", "log_file": log_file}
+
+	if not return_code and compress:
+		try:
+			files = [recompress(path, threads=threads, prefix=prefix) for path in files]
+		except (OSError, CommandFailedError):
+			logger.exception(f"Recompressing backups of {site} failed")
+			result["status"] = "failed"
+
+	prune_recompressed(backups_path)
+
+	result["files"] = [
+		{"path": path, "size": os.path.getsize(path), "sha256": get_file_checksum(path)}
+		for path in files
+		if os.path.exists(path)
+	]
+	result["duration"] = time.monotonic() - start
+
+	if result["status"] == "failed":
+		click.secho(
+			f"Backing up {site} failed after {result['duration']:.1f}s, see {log_file}", fg="red"
+		)
+	else:
+		click.secho(f"Backed up {site} in {result['duration']:.1f}s", fg="green")
+
+	return result
+
+
+def backup_sites(
+	bench_path=".",
+	sites: List[str] = None,
+	jobs: int = None,
+	with_files: bool = False,
+	compress: str = None,
+	idle_io: bool = False,
+	maintenance: bool = False,
+	on_result: Callable = None,
+) -> Dict:
+	"""Backs up sites concurrently, at most `jobs` (backup_jobs in
+	common_site_config.json, or 2) at once. Backups run under nice & ionice, and are
+	recompressed with zstd if `compress` (or backup_compression) is "zstd". zstd
+	copies are kept next to frappe's backups, which `bench --site <site> restore`
+	reads, & removed along with them.
+
+	If `maintenance` is set, each site is in maintenance mode only while it's being
+	backed up.
+
+	`on_result` is called with each site & its result as soon as it's backed up,
+	from the thread that backed it up.
+
+	A manifest of the run with sizes, durations & checksums of the backups is written
+	to backups/manifests/<run id>.json, and returned.
+	"""
+	from bench.bench import Bench
+	from bench.config.site_config import site_maintenance_mode
+	from bench.utils.lock import bench_lock
+	from bench.utils.parallel import get_jobs, run_in_parallel
+
+	config = get_config(bench_path)
+	sites = list(Bench(bench_path).sites) if sites is None else sites
+	jobs = get_jobs(jobs or config.get("backup_jobs") or DEFAULT_BACKUP_JOBS)
+	compress = get_backup_compression(compress, bench_path=bench_path)
+	threads = config.get("backup_compression_threads") or max(
+		1, (os.cpu_count() or 1) // jobs
+	)
+	started_at = datetime.now()
+
+	def backup(site):
+		context = (
+			site_maintenance_mode(site, bench_path=bench_path)
+			if maintenance
+			else contextlib.nullcontext()
+		)
+		with context:
+			result = run_site_backup(
+				site,
+				bench_path=bench_path,
+				with_files=with_files,
+				compress=compress,
+				threads=threads,
+				idle_io=idle_io,
+			)
+
+		if on_result:
+			on_result(site, result)
+
+		return result
+
+	log(f"Backing up {len(sites)} sites, {jobs} at a time", no_log=True)
+	with bench_lock("backup", bench_path=bench_path, shared=True):
+		results = run_in_parallel(backup, sites, jobs=jobs, fail_fast=False)
+
+	for site, result in results.items():
+		if isinstance(result, Exception):
+			logger.exception(result)
+			results[site] = {"status": "failed", "duration": 0, "log_file": None, "files": []}
+			if on_result:
+				on_result(site, results[site])
+
+	manifest = {
+		"id": started_at.strftime("%Y%m%d-%H%M%S"),
+		"started_at": started_at.isoformat(),
+		"finished_at": datetime.now().isoformat(),
+		"jobs": jobs,
+		"with_files": with_files,
+		"compression": compress or "gzip",
+		"sites": {site: results[site] for site in sites},
+	}
+	write_backup_manifest(manifest, bench_path=bench_path)
+	push_after_backup(manifest, bench_path=bench_path)
+	return manifest
+
+
+def write_backup_manifest(manifest: Dict, bench_path="."):
+	manifests_path = os.path.join(get_backups_path(bench_path), "manifests")
+	os.makedirs(manifests_path, exist_ok=True)
+	manifest_file = os.path.join(manifests_path, f"{manifest['id']}.json")
+
+	with open(f"{manifest_file}.tmp", "w") as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(f"{manifest_file}.tmp", manifest_file)
+
+
+def print_backup_summary(manifest: Dict):
+	colors = {"success": "green", "failed": "red"}
+	results = manifest["sites"]
+	if not results:
+		return
+
+	width = max(len(site) for site in results)
+
+	click.secho("\nBackup summary", bold=True)
+	for site, result in sorted(results.items(), key=lambda x: -x[1]["duration"]):
+		size = sum(f["size"] for f in result["files"]) / (1024 * 1024)
+		click.echo(
+			f"{site:<{width}}  "
+			+ click.style(f"{result['status']:<7}", fg=colors[result["status"]])
+			+ f"  {result['duration']:>7.1f}s  {size:>9.1f} MB"
+			+ (f"  {result['log_file']}" if result["status"] == "failed" else "")
+		)
+
+	counts = defaultdict(int)
+	for result in results.values():
+		counts[result["status"]] += 1
+	click.echo(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+
+def get_backup_interval(bench_path=".") -> int:
+	"""Seconds between scheduled backups of a site"""
+	return int(get_config(bench_path).get("backup_interval") or DEFAULT_BACKUP_INTERVAL) * 60
+
+
+def get_backup_offset(site: str, interval: int, bench_path=".") -> int:
+	"""Seconds into each interval at which the site's backup is due. It's derived from
+	the bench & site, so that backups are spread over the interval the same way on
+	every run."""
+	key = f"{os.path.abspath(bench_path)}:{site}".encode()
+	return int(hashlib.sha256(key).hexdigest(), 16) % interval
+
+
+def get_backup_slot(site: str, now: float, interval: int, bench_path=".") -> float:
+	"""Start of the site's latest backup slot at or before now"""
+	offset = get_backup_offset(site, interval, bench_path=bench_path)
+	return now - (now - offset) % interval
+
+
+def get_backup_history_file(site: str, bench_path=".") -> str:
+	return os.path.join(get_backups_path(bench_path), "history", f"{site}.json")
+
+
+def get_backup_history(site: str, bench_path=".") -> Dict:
+	try:
+		with open(get_backup_history_file(site, bench_path=bench_path)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {"last_slot": None, "runs": []}
+
+
+def record_backup(site: str, slot: float, result: Dict, bench_path="."):
+	"""Adds the backup to the site's history, keeping its last BACKUP_HISTORY_KEEP runs"""
+	history = get_backup_history(site, bench_path=bench_path)
+	history["last_slot"] = slot
+	history["runs"] = history["runs"][-(BACKUP_HISTORY_KEEP - 1) :] + [
+		{
+			"started_at": result["started_at"],
+			"status": result["status"],
+			"duration": result["duration"],
+			"size": sum(f["size"] for f in result.get("files", [])),
+		}
+	]
+
+	history_file = get_backup_history_file(site, bench_path=bench_path)
+	os.makedirs(os.path.dirname(history_file), exist_ok=True)
+	with open(f"{history_file}.tmp", "w") as f:
+		json.dump(history, f, indent=1)
+	os.replace(f"{history_file}.tmp", history_file)
+
+
+def get_due_sites(bench_path=".", now: float = None) -> Dict[str, float]:
+	"""Sites whose current backup slot hasn't been backed up yet, with their slot
+	starts, longest waiting first"""
+	from bench.bench import Bench
+
+	now = now or time.time()
+	interval = get_backup_interval(bench_path)
+	due = {}
+
+	for site in Bench(bench_path).sites:
+		slot = get_backup_slot(site, now, interval, bench_path=bench_path)
+		last_slot = get_backup_history(site, bench_path=bench_path)["last_slot"]
+		if last_slot is None or last_slot < slot:
+			due[site] = slot
+
+	return dict(sorted(due.items(), key=lambda x: x[1]))
+
+
+@contextlib.contextmanager
+def host_backup_slot(bench_path=".", poll_interval: float = 5):
+	"""Waits for one of backup_host_jobs slots shared by all benches on the host. The
+	slots are lock files in backup_host_slots_path, or the temp directory."""
+	import fcntl
+	import tempfile
+
+	config = get_config(bench_path)
+	jobs = int(config.get("backup_host_jobs") or DEFAULT_BACKUP_HOST_JOBS)
+	slots_path = config.get("backup_host_slots_path") or os.path.join(
+		tempfile.gettempdir(), "bench-backup-slots"
+	)
+	os.makedirs(slots_path, exist_ok=True)
+
+	waiting = False
+	while True:
+		for i in range(jobs):
+			fd = os.open(os.path.join(slots_path, f"slot-{i}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				os.close(fd)
+				continue
+
+			try:
+				yield
+			finally:
+				fcntl.flock(fd, fcntl.LOCK_UN)
+				os.close(fd)
+			return
+
+		if not waiting:
+			log(f"All {jobs} backup slots on this host are taken, waiting", no_log=True)
+			waiting = True
+		time.sleep(poll_interval)
+
+
+def run_scheduled_backups(bench_path=".", now: float = None) -> Dict:
+	"""Backs up sites that are due, one at a time & within the host-wide limit. Run
+	every few minutes from cron. Backups are deferred to the next run while an
+	update, migration or restore holds the bench lock. Returns the sites backed up."""
+	import fcntl
+
+	from bench.utils.lock import bench_lock
+
+	config = get_config(bench_path)
+	os.makedirs(get_backups_path(bench_path), exist_ok=True)
+
+	with open(os.path.join(get_backups_path(bench_path), ".scheduler.lock"), "w") as f:
+		try:
+			fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			log("Scheduled backups are already running", no_log=True)
+			return {}
+
+		due = get_due_sites(bench_path=bench_path, now=now)
+		started_at = datetime.now()
+		results = {}
+
+		for site, slot in due.items():
+			with bench_lock("backup", bench_path=bench_path, shared=True, wait=False) as acquired:
+				if not acquired:
+					log(
+						f"Deferring backups of {len(due) - len(results)} sites while the bench is"
+						" locked",
+						level=3,
+					)
+					break
+
+				with host_backup_slot(bench_path=bench_path):
+					site_started_at = datetime.now().isoformat()
+					result = run_site_backup(
+						site,
+						bench_path=bench_path,
+						with_files=bool(config.get("backup_with_files")),
+						compress=get_backup_compression(bench_path=bench_path),
+						idle_io=bool(config.get("backup_idle_io")),
+					)
+
+			result["started_at"] = site_started_at
+			record_backup(site, slot, result, bench_path=bench_path)
+			results[site] = result
+
+	if results:
+		manifest = {
+			"id": started_at.strftime("%Y%m%d-%H%M%S"),
+			"started_at": started_at.isoformat(),
+			"finished_at": datetime.now().isoformat(),
+			"jobs": 1,
+			"with_files": bool(config.get("backup_with_files")),
+			"compression": get_backup_compression(bench_path=bench_path) or "gzip",
+			"sites": results,
+		}
+		write_backup_manifest(manifest, bench_path=bench_path)
+		push_after_backup(manifest, bench_path=bench_path)
+
+	return results
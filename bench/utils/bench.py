@@ -4,6 +4,7 @@ import json
 import logging
 import os
 import re
+import shutil
 import subprocess
 import sys
 from functools import lru_cache
@@ -20,6 +21,17 @@ from bench.utils import exec_cmd, get_bench_name, get_cmd_output, log, which
 
 logger = logging.getLogger(bench.PROJECT_NAME)
 
+# keys of common_site_config.json that clones of a bench get their own values for
+BENCH_SPECIFIC_KEYS = (
+	"webserver_port",
+	"socketio_port",
+	"file_watcher_port",
+	"redis_cache",
+	"redis_queue",
+	"redis_socketio",
+	"release_bench",
+)
+
 
 @lru_cache(maxsize=None)
 def get_env_cmd(cmd: str, bench_path: str = ".") -> str:
@@ -110,24 +122,21 @@ def _generate_dev_deps_pattern(pyproject_path):
 	return requirements_pattern
 
 
-def update_yarn_packages(bench_path=".", apps=None):
+def update_yarn_packages(bench_path=".", apps=None, jobs=None, force=False):
 	from bench.bench import Bench
+	from bench.utils.node import get_node_package_manager, install_node_packages
 
 	bench = Bench(bench_path)
 	apps = apps or bench.apps
-	apps_dir = os.path.join(bench.name, "apps")
+	package_manager = get_node_package_manager(bench_path)
 
 	# TODO: Check for stuff like this early on only??
-	if not which("yarn"):
-		print("Please install yarn using below command and try again.")
-		print("`npm install -g yarn`")
+	if not which(package_manager):
+		print(f"Please install {package_manager} using below command and try again.")
+		print(f"`npm install -g {package_manager}`")
 		return
 
-	for app in apps:
-		app_path = os.path.join(apps_dir, app)
-		if os.path.exists(os.path.join(app_path, "package.json")):
-			click.secho(f"\nInstalling node dependencies for {app}", fg="yellow")
-			bench.run("yarn install", cwd=app_path)
+	install_node_packages(bench_path=bench_path, apps=apps, jobs=jobs, force=force)
 
 
 def update_npm_packages(bench_path=".", apps=None):
@@ -165,19 +174,24 @@ def update_npm_packages(bench_path=".", apps=None):
 	exec_cmd("npm install", cwd=bench_path)
 
 
-def migrate_env(python, backup=False):
+def migrate_env(python, backup=False, jobs=None):
+	"""Builds a new virtual environment for the given python alongside the live one in
+	`env.new`, verifies it and swaps it in atomically. The previous env is kept at
+	`env.old` for `bench migrate-env --rollback`; with `backup` set, the env it
+	replaces there is archived instead of being deleted."""
 	import shutil
-	from urllib.parse import urlparse
 
 	from bench.bench import Bench
+	from bench.utils.fs import exchange_paths
 
 	bench = Bench(".")
-	nvenv = "env"
 	path = os.getcwd()
 	python = which(python)
-	pvenv = os.path.join(path, nvenv)
+	live_env = os.path.join(path, "env")
+	new_env = os.path.join(path, "env.new")
+	old_env = os.path.join(path, "env.old")
 
-	if python.startswith(pvenv):
+	if python.startswith(live_env):
 		# The supplied python version is in active virtualenv which we are about to nuke.
 		click.secho(
 			"Python version supplied is present in currently sourced virtual environment.\n"
@@ -186,55 +200,133 @@ def migrate_env(python, backup=False):
 		)
 		sys.exit(1)
 
-	# Clear Cache before Bench Dies.
+	if os.path.exists(new_env):
+		shutil.rmtree(new_env)
+
 	try:
-		config = bench.conf
-		rredis = urlparse(config["redis_cache"])
-		redis = f"{which('redis-cli')} -p {rredis.port}"
+		logger.log(f"Setting up a New Virtual {python} Environment")
+		exec_cmd(f"{python} -m venv {new_env}")
+		exec_cmd(f"{new_env}/bin/python -m pip install --quiet --upgrade pip wheel")
 
-		logger.log("Clearing Redis Cache...")
-		exec_cmd(f"{redis} FLUSHALL")
-		logger.log("Clearing Redis DataBase...")
-		exec_cmd(f"{redis} FLUSHDB")
+		# one resolve for all apps, frappe first
+		apps = ["frappe"] + [str(app) for app in bench.apps if str(app) != "frappe"]
+		app_paths = " ".join(f"-e {os.path.join('apps', app)}" for app in apps)
+		exec_cmd(f"{new_env}/bin/python -m pip install --upgrade {app_paths}")
+
+		validate_env_imports(new_env, apps, jobs=jobs)
+		relocate_env(new_env, live_env)
 	except Exception:
-		logger.warning("Please ensure Redis Connections are running or Daemonized.")
+		logger.warning("Python env migration Error", exc_info=True)
+		shutil.rmtree(new_env, ignore_errors=True)
+		raise
 
-	# Backup venv: restore using `virtualenv --relocatable` if needed
-	if backup:
-		from datetime import datetime
+	if os.path.exists(old_env):
+		if backup:
+			archive_env(old_env)
+		else:
+			shutil.rmtree(old_env)
 
-		parch = os.path.join(path, "archived", "envs")
-		os.makedirs(parch, exist_ok=True)
+	# env.new takes the place of env, the live env moves to env.old
+	exchange_paths(new_env, live_env)
+	os.rename(new_env, old_env)
+	get_env_cmd.cache_clear()
 
-		source = os.path.join(path, "env")
-		target = parch
+	clear_redis_cache(bench)
+	bench.reload(_raise=False)
 
-		logger.log("Backing up Virtual Environment")
-		stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-		dest = os.path.join(path, str(stamp))
+	logger.log(f"Migration Successful to {python}")
+	log(f"Migrated env to {python}. Run `bench migrate-env --rollback` to revert", level=1)
 
-		os.rename(source, dest)
-		shutil.move(dest, target)
 
-	# Create virtualenv using specified python
-	def _install_app(app):
-		app_path = f"-e {os.path.join('apps', app)}"
-		exec_cmd(f"{pvenv}/bin/python -m pip install --upgrade {app_path}")
+def rollback_env():
+	"""Swaps the live env with the one preserved at `env.old` by the last migrate-env"""
+	from bench.bench import Bench
+	from bench.utils.fs import exchange_paths
 
-	try:
-		logger.log(f"Setting up a New Virtual {python} Environment")
-		exec_cmd(f"{python} -m venv {pvenv}")
+	path = os.getcwd()
+	live_env = os.path.join(path, "env")
+	old_env = os.path.join(path, "env.old")
+
+	if not os.path.exists(old_env):
+		log("No previous env found to rollback to", level=2)
+		sys.exit(1)
+
+	exchange_paths(old_env, live_env)
+	get_env_cmd.cache_clear()
+
+	bench = Bench(".")
+	clear_redis_cache(bench)
+	bench.reload(_raise=False)
+	log("Rolled back to the previous env", level=1)
+
+
+def validate_env_imports(env_path, apps, jobs=None):
+	"""Checks that frappe & every app can be imported in the env at env_path"""
+	from bench.utils.parallel import capture_cmd, run_in_parallel
+
+	python = os.path.join(env_path, "bin", "python")
+	results = run_in_parallel(
+		lambda app: capture_cmd(f"{python} -c 'import {app}'", cwd="sites"),
+		apps,
+		jobs=jobs,
+	)
+	failed = {app: output for app, (return_code, output) in results.items() if return_code}
 
-		# Install frappe first
-		_install_app("frappe")
-		for app in bench.apps:
-			if str(app) != "frappe":
-				_install_app(app)
+	if failed:
+		for app, output in failed.items():
+			log(f"Importing {app} failed in {env_path}:\n{output}", level=2)
+		raise ValidationError(f"Apps failed to import in new env: {', '.join(failed)}")
 
-		logger.log(f"Migration Successful to {python}")
+
+def relocate_env(env_path, target_path, source_path=None):
+	"""A venv hardcodes its own location in script shebangs and activate scripts.
+	Rewrite these so that the env at env_path works once it is moved to target_path.
+	For copies of an env, source_path is the location the copy still refers to."""
+	bin_path = os.path.join(env_path, "bin")
+	source = os.fsencode(os.path.abspath(source_path or env_path))
+	target = os.fsencode(os.path.abspath(target_path))
+
+	for name in os.listdir(bin_path):
+		file_path = os.path.join(bin_path, name)
+		if os.path.islink(file_path) or not os.path.isfile(file_path):
+			continue
+
+		with open(file_path, "rb") as f:
+			contents = f.read()
+
+		# skip binaries, only shebang scripts & activate scripts are text
+		if b"\0" in contents[:1024] or source not in contents:
+			continue
+
+		with open(file_path, "wb") as f:
+			f.write(re.sub(re.escape(source) + rb"(?=[/\s\"'])", target, contents))
+
+
+def archive_env(env_path):
+	import shutil
+	from datetime import datetime
+
+	parch = os.path.join(os.path.dirname(env_path), "archived", "envs")
+	os.makedirs(parch, exist_ok=True)
+
+	logger.log("Backing up Virtual Environment")
+	stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+	shutil.move(env_path, os.path.join(parch, stamp))
+
+
+def clear_redis_cache(bench):
+	from urllib.parse import urlparse
+
+	try:
+		rredis = urlparse(bench.conf["redis_cache"])
+		redis = f"{which('redis-cli')} -p {rredis.port}"
+
+		logger.log("Clearing Redis Cache...")
+		exec_cmd(f"{redis} FLUSHALL")
+		logger.log("Clearing Redis DataBase...")
+		exec_cmd(f"{redis} FLUSHDB")
 	except Exception:
-		logger.warning("Python env migration Error", exc_info=True)
-		raise
+		logger.warning("Please ensure Redis Connections are running or Daemonized.")
 
 
 def validate_upgrade(from_ver, to_ver, bench_path="."):
@@ -263,17 +355,43 @@ def post_upgrade(from_ver, to_ver, bench_path="."):
 		)
 
 
-def patch_sites(bench_path="."):
-	from bench.bench import Bench
-	from bench.utils.system import migrate_site
+def patch_sites(
+	bench_path=".",
+	jobs=None,
+	continue_on_error=False,
+	force=False,
+	site_maintenance=False,
+	code_path=None,
+	sites=None,
+	on_result=None,
+):
+	"""Migrates all sites of the bench (or `sites`) concurrently, skipping sites whose
+	apps haven't changed since their last migration unless `force` is set. Unless
+	`continue_on_error` is set, no more migrations are started after the first
+	failure. With `site_maintenance`, each site is in maintenance mode only while
+	it's migrated. Sites are migrated with the apps & env of `code_path` if set."""
+	from bench.utils.migrate import migrate_sites, print_migrate_summary
+
+	results = migrate_sites(
+		bench_path=bench_path,
+		sites=sites,
+		jobs=jobs,
+		fail_fast=not continue_on_error,
+		force=force,
+		maintenance=site_maintenance,
+		code_path=code_path,
+		on_result=on_result,
+	)
+	if not results:
+		return
 
-	bench = Bench(bench_path)
+	print_migrate_summary(results)
 
-	for site in bench.sites:
-		try:
-			migrate_site(site, bench_path=bench_path)
-		except subprocess.CalledProcessError:
-			raise PatchError
+	failed = [
+		site for site, result in results.items() if result["status"] not in ("success", "skipped")
+	]
+	if failed:
+		raise PatchError(f"Migrations failed or didn't run for {', '.join(failed)}")
 
 
 def restart_supervisor_processes(bench_path=".", web_workers=False, _raise=False):
@@ -344,11 +462,10 @@ def restart_process_manager(bench_path=".", web_workers=False):
 		exec_cmd(f"overmind restart {worker}", cwd=bench_path)
 
 
-def build_assets(bench_path=".", app=None):
-	command = "bench build"
-	if app:
-		command += f" --app {app}"
-	exec_cmd(command, cwd=bench_path, env={"BENCH_DEVELOPER": "1"})
+def build_assets(bench_path=".", app=None, force=False, jobs=None):
+	from bench.utils.assets import build_assets
+
+	build_assets(bench_path=bench_path, app=app, force=force, jobs=jobs)
 
 
 def handle_version_upgrade(version_upgrade, bench_path, force, reset, conf):
@@ -397,17 +514,50 @@ def update(
 	reset: bool = False,
 	restart_supervisor: bool = False,
 	restart_systemd: bool = False,
+	jobs: int = None,
+	continue_on_error: bool = False,
+	site_maintenance: bool = False,
+	apply: bool = False,
+	snapshot: bool = False,
+	resume: bool = False,
 ):
-	"""command: bench update"""
+	"""command: bench update
+
+	By default every site is in maintenance mode for the whole update. With
+	`site_maintenance`, sites stay up and each one is put in maintenance mode only
+	while it's backed up & migrated.
+
+	With `apply`, the update staged by `bench update --prepare` is applied: apps are
+	fast-forwarded to the prepared commits, installed from the prepared wheels and
+	their assets are restored from prepared builds.
+
+	With `snapshot`, apps' commits, the env, assets & sites' backups are captured
+	before anything changes, so that `bench rollback` can undo a failed update.
+
+	The update runs as a graph of tasks (see bench.utils.update.get_update_tasks),
+	with independent ones like fetches & backups or pip & node installs overlapping,
+	at most `jobs` at once. The chain of tasks the update waited on is reported at
+	the end.
+
+	Progress is recorded in logs/update.json: each phase, app & site with its status
+	and output. With `resume`, a failed update is continued with the options it was
+	started with, skipping what's already done."""
 	import re
 
 	from bench import patches
-	from bench.app import pull_apps
 	from bench.bench import Bench
 	from bench.config.common_site_config import update_config
 	from bench.exceptions import CannotUpdateReleaseBench
 	from bench.utils.app import is_version_upgrade
-	from bench.utils.system import backup_all_sites
+	from bench.utils.journal import UpdateJournal
+	from bench.utils.parallel import run_task_graph
+	from bench.utils.update import (
+		clear_prepared_update,
+		get_update_tasks,
+		print_critical_path,
+		read_prepared_update,
+		validate_prepared_update,
+	)
 
 	bench_path = os.path.abspath(".")
 	bench = Bench(bench_path)
@@ -417,49 +567,87 @@ def update(
 	if conf.get("release_bench"):
 		raise CannotUpdateReleaseBench("Release bench detected, cannot update!")
 
-	if not (pull or patch or build or requirements):
-		pull, patch, build, requirements = True, True, True, True
-
-	if apps and pull:
-		apps = [app.strip() for app in re.split(",| ", apps) if app]
-	else:
-		apps = []
-
-	validate_branch()
-
-	version_upgrade = is_version_upgrade()
-	handle_version_upgrade(version_upgrade, bench_path, force, reset, conf)
-
-	conf.update({"maintenance_mode": 1, "pause_scheduler": 1})
-	update_config(conf, bench_path=bench_path)
+	journal = UpdateJournal.resume(bench_path) if resume else None
+	if journal:
+		# carry on with what the update was started with
+		apply, site_maintenance = journal.options["apply"], journal.options["site_maintenance"]
 
-	if backup:
-		print("Backing up sites...")
-		backup_all_sites(bench_path=bench_path)
+	prepared = None
+	if apply:
+		prepared = read_prepared_update(bench_path)
+		if not prepared:
+			raise ValidationError("No prepared update found, run `bench update --prepare` first")
+		validate_prepared_update(prepared, bench_path=bench_path)
 
-	if pull:
-		print("Updating apps source...")
-		pull_apps(apps=apps, bench_path=bench_path, reset=reset)
+	if not journal:
+		if apply or not (pull or patch or build or requirements):
+			pull, patch, build, requirements = True, True, True, True
 
-	if requirements:
-		print("Setting up requirements...")
-		bench.setup.requirements()
+		if apps and pull:
+			apps = [app.strip() for app in re.split(",| ", apps) if app]
+		else:
+			apps = []
+
+		validate_branch()
+
+		version_upgrade = is_version_upgrade()
+		handle_version_upgrade(version_upgrade, bench_path, force, reset, conf)
+
+		journal = UpdateJournal.start(
+			{
+				"pull": pull,
+				"apps": apps,
+				"patch": patch,
+				"build": build,
+				"requirements": requirements,
+				"backup": backup,
+				"force": force,
+				"reset": reset,
+				"site_maintenance": site_maintenance,
+				"apply": apply,
+				"snapshot": snapshot,
+				"version_upgrade": version_upgrade,
+			},
+			bench_path=bench_path,
+		)
 
-	if patch:
-		print("Patching sites...")
-		patch_sites(bench_path=bench_path)
+	if not site_maintenance:
+		conf.update({"maintenance_mode": 1, "pause_scheduler": 1})
+		update_config(conf, bench_path=bench_path)
+
+	tasks = get_update_tasks(
+		journal,
+		bench_path=bench_path,
+		prepared=prepared,
+		jobs=jobs,
+		continue_on_error=continue_on_error,
+		restart_supervisor=restart_supervisor,
+		restart_systemd=restart_systemd,
+	)
+	try:
+		results = run_task_graph(tasks, jobs=jobs)
+	except BaseException:
+		log(
+			"Update failed, `bench update --resume` continues it from where it stopped"
+			+ (
+				f", `bench rollback` restores snapshot {journal.data['snapshot']}"
+				if journal.data.get("snapshot")
+				else ""
+			),
+			level=2,
+		)
+		raise
 
-	if build:
-		print("Building assets...")
-		bench.build()
+	print_critical_path(results, tasks)
 
-	if version_upgrade[0] or (not version_upgrade[0] and force):
-		post_upgrade(version_upgrade[1], version_upgrade[2], bench_path=bench_path)
+	if not site_maintenance:
+		conf.update({"maintenance_mode": 0, "pause_scheduler": 0})
+		update_config(conf, bench_path=bench_path)
 
-	bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+	if prepared:
+		clear_prepared_update(bench_path)
 
-	conf.update({"maintenance_mode": 0, "pause_scheduler": 0})
-	update_config(conf, bench_path=bench_path)
+	journal.finish()
 
 	print(
 		"_" * 80 + "\nBench: Deployment tool for Frappe and Frappe Applications"
@@ -469,44 +657,166 @@ def update(
 	)
 
 
-def clone_apps_from(bench_path, clone_from, update_app=True):
-	from bench.app import install_app
+def clone_apps_from(bench_path, clone_from, update_app=True, jobs=None):
+	"""Copies apps (and node_modules) from an existing bench and installs them. Files are
+	reflinked or hardlinked where possible; per-app git updates and node installs run
+	concurrently, while python packages are installed with a single pip resolve."""
+	import bench.cli as bench_cli
+	from bench.bench import Bench
+	from bench.utils.fs import copy_tree, is_immutable_git_object
+	from bench.utils.node import is_store_linked
+	from bench.utils.parallel import run_in_parallel
+
+	def link(path):
+		return is_immutable_git_object(path) or is_store_linked(path)
 
 	print(f"Copying apps from {clone_from}...")
-	subprocess.check_output(["cp", "-R", os.path.join(clone_from, "apps"), bench_path])
+	copy_tree(
+		os.path.join(clone_from, "apps"), os.path.join(bench_path, "apps"), jobs=jobs, link=link
+	)
 
 	node_modules_path = os.path.join(clone_from, "node_modules")
 	if os.path.exists(node_modules_path):
 		print(f"Copying node_modules from {clone_from}...")
-		subprocess.check_output(["cp", "-R", node_modules_path, bench_path])
+		copy_tree(
+			node_modules_path, os.path.join(bench_path, "node_modules"), jobs=jobs, link=link
+		)
 
-	def setup_app(app):
-		# run git reset --hard in each branch, pull latest updates and install_app
+	def update_app_repo(app):
+		# run git reset --hard in each branch & pull latest updates
 		app_path = os.path.join(bench_path, "apps", app)
 
 		# remove .egg-ino
 		subprocess.check_output(["rm", "-rf", app + ".egg-info"], cwd=app_path)
 
 		if update_app and os.path.exists(os.path.join(app_path, ".git")):
-			remotes = subprocess.check_output(["git", "remote"], cwd=app_path).strip().split()
+			remotes = (
+				subprocess.check_output(["git", "remote"], cwd=app_path).decode().strip().split()
+			)
 			if "upstream" in remotes:
 				remote = "upstream"
 			else:
 				remote = remotes[0]
 			print(f"Cleaning up {app}")
-			branch = subprocess.check_output(
-				["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=app_path
-			).strip()
+			branch = (
+				subprocess.check_output(
+					["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=app_path
+				)
+				.decode()
+				.strip()
+			)
 			subprocess.check_output(["git", "reset", "--hard"], cwd=app_path)
-			subprocess.check_output(["git", "pull", "--rebase", remote, branch], cwd=app_path)
-
-		install_app(app, bench_path, restart_bench=False)
+			subprocess.check_output(
+				["git", "pull", "--rebase", remote, branch],
+				cwd=app_path,
+				stderr=subprocess.STDOUT,
+			)
 
 	with open(os.path.join(clone_from, "sites", "apps.txt")) as f:
 		apps = f.read().splitlines()
 
+	run_in_parallel(update_app_repo, apps, jobs=jobs)
+
+	bench = Bench(bench_path)
+	quiet_flag = "" if bench_cli.verbose else "--quiet"
+	app_paths = " ".join(
+		f"-e {os.path.realpath(os.path.join(bench_path, 'apps', app))}" for app in apps
+	)
+	bench.run(f"{bench.python} -m pip install {quiet_flag} --upgrade {app_paths}")
+
+	if bench.conf.get("developer_mode"):
+		install_python_dev_dependencies(apps=apps, bench_path=bench_path)
+
+	update_yarn_packages(bench_path=bench_path, apps=apps, jobs=jobs)
+
 	for app in apps:
-		setup_app(app)
+		bench.apps.sync(app_name=app)
+
+
+def clone_bench(target_path, bench_path=".", jobs=None):
+	"""Copies the bench's apps, env, assets & config into a new bench at target_path,
+	without reinstalling anything. Git objects & pnpm store files are hardlinked and
+	the rest reflinked where the filesystem supports it. Paths into the bench in the
+	env & assets are rewritten, the new bench gets ports no bench beside it or the
+	bench itself uses (see make_ports) & its Procfile, redis, supervisor & nginx
+	configs are generated afresh.
+
+	Release benches are cloned from their active release into a plain bench."""
+	from bench.config.common_site_config import get_config, put_config, update_config_for_frappe
+	from bench.utils import paths_in_bench
+	from bench.utils.fs import copy_tree, is_immutable_git_object
+	from bench.utils.node import is_store_linked
+	from bench.utils.release import repoint_paths
+
+	bench_path = os.path.abspath(bench_path)
+	target_path = os.path.abspath(target_path)
+	if os.path.exists(target_path):
+		raise ValidationError(f"{target_path} already exists")
+
+	def link(path):
+		return is_immutable_git_object(path) or is_store_linked(path)
+
+	for name in paths_in_bench:
+		os.makedirs(os.path.join(target_path, name))
+
+	try:
+		for name in ("apps", "env", os.path.join("sites", "assets"), "node_modules"):
+			# release benches link these into their active release
+			source = os.path.realpath(os.path.join(bench_path, name))
+			if os.path.isdir(source):
+				click.secho(f"Copying {name}", fg="yellow")
+				copy_tree(source, os.path.join(target_path, name), jobs=jobs, link=link)
+
+		for name in ("patches.txt", os.path.join("sites", "apps.txt"), os.path.join("sites", "apps.json")):
+			if os.path.exists(os.path.join(bench_path, name)):
+				shutil.copy2(os.path.join(bench_path, name), os.path.join(target_path, name))
+
+		relocate_env(
+			os.path.join(target_path, "env"),
+			os.path.join(target_path, "env"),
+			source_path=os.path.realpath(os.path.join(bench_path, "env")),
+		)
+		repoint_paths(
+			target_path,
+			os.path.realpath(os.path.join(bench_path, "apps")),
+			os.path.join(target_path, "apps"),
+		)
+
+		config = {
+			key: value
+			for key, value in get_config(bench_path).items()
+			if key not in BENCH_SPECIFIC_KEYS
+		}
+		# the clone may be put beside other benches than the bench's own
+		update_config_for_frappe(config, target_path, other_bench_paths=[bench_path])
+		put_config(config, target_path)
+		setup_bench_configs(target_path, like=bench_path)
+	except BaseException:
+		shutil.rmtree(target_path, ignore_errors=True)
+		raise
+
+	log(f"Cloned {bench_path} into {target_path}", level=1)
+
+
+def setup_bench_configs(bench_path, like=None):
+	"""(Re)generates the redis configs, Procfile, supervisor & nginx configs the bench
+	at `like` (bench_path by default) has"""
+	from bench.config.nginx import make_nginx_conf
+	from bench.config.procfile import setup_procfile
+	from bench.config.redis import generate_config
+	from bench.config.supervisor import generate_supervisor_config
+
+	like = like or bench_path
+	has_redis = os.path.exists(os.path.join(like, "config", "redis_queue.conf"))
+
+	if has_redis:
+		generate_config(bench_path)
+	if os.path.exists(os.path.join(like, "Procfile")):
+		setup_procfile(bench_path, yes=True, skip_redis=not has_redis)
+	if os.path.exists(os.path.join(like, "config", "supervisor.conf")):
+		generate_supervisor_config(bench_path, yes=True)
+	if os.path.exists(os.path.join(like, "config", "nginx.conf")):
+		make_nginx_conf(bench_path, yes=True)
 
 
 def remove_backups_crontab(bench_path="."):
@@ -520,10 +830,14 @@ def remove_backups_crontab(bench_path="."):
 	user = Bench(bench_dir).conf.get("frappe_user")
 	logfile = os.path.join(bench_dir, "logs", "backup.log")
 	system_crontab = CronTab(user=user)
-	backup_command = f"cd {bench_dir} && {sys.argv[0]} --verbose --site all backup"
-	job_command = f"{backup_command} >> {logfile} 2>&1"
-
-	system_crontab.remove_all(command=job_command)
+	for backup_command in (
+		"backups run-scheduled",
+		"backup-all-sites",
+		"--site all backup",
+		"file-backup create",
+	):
+		job_command = f"cd {bench_dir} && {sys.argv[0]} --verbose {backup_command}"
+		system_crontab.remove_all(command=f"{job_command} >> {logfile} 2>&1")
 
 
 def set_mariadb_host(host, bench_path="."):
@@ -0,0 +1,364 @@
+# imports - standard imports
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.exceptions import ValidationError
+from bench.utils import log
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# attachments are mostly written once & never modified, so fixed size chunks
+# dedupe them as well as content defined ones would, for much less hashing
+CHUNK_SIZE = 4 * 1024 * 1024
+# directories of a site that are backed up, relative to it
+FILE_DIRS = (os.path.join("public", "files"), os.path.join("private", "files"))
+DEFAULT_FILE_BACKUP_KEEP = 28
+
+
+def get_file_backup_repository(bench_path=".") -> "FileBackupRepository":
+	"""The repository at file_backup_repository from common_site_config.json, or
+	backups/files in the bench"""
+	from bench.utils.backup import get_backups_path
+
+	path = get_config(bench_path).get("file_backup_repository") or os.path.join(
+		get_backups_path(bench_path), "files"
+	)
+	return FileBackupRepository(path)
+
+
+def get_site_files(site: str, bench_path=".") -> List[str]:
+	"""Paths of the site's public & private files, relative to the site"""
+	site_path = os.path.join(bench_path, "sites", site)
+	files = []
+
+	for files_dir in FILE_DIRS:
+		for root, _, filenames in os.walk(os.path.join(site_path, files_dir)):
+			for name in filenames:
+				path = os.path.join(root, name)
+				if not os.path.islink(path):
+					files.append(os.path.relpath(path, site_path))
+
+	return files
+
+
+class FileBackupRepository:
+	"""Snapshots of sites' files, stored as content-addressed chunks deduplicated
+	across sites & snapshots. A snapshot only reads files whose size or mtime changed
+	since the last snapshot of their site; the rest reuse the chunks recorded then.
+
+	<path>/chunks/<sha256[:2]>/<sha256>	chunks of up to CHUNK_SIZE bytes
+	<path>/snapshots/<id>.json		site → file → size, mtime, mode & chunks
+	"""
+
+	def __init__(self, path: str):
+		self.path = os.path.abspath(path)
+		self.chunks_path = os.path.join(self.path, "chunks")
+		self.snapshots_path = os.path.join(self.path, "snapshots")
+
+	@contextmanager
+	def lock(self, shared=False):
+		"""Snapshots & restores share the repository, pruning needs it to itself"""
+		import fcntl
+
+		os.makedirs(self.snapshots_path, exist_ok=True)
+		with open(os.path.join(self.path, ".lock"), "w") as f:
+			fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+	def chunk_path(self, sha: str) -> str:
+		return os.path.join(self.chunks_path, sha[:2], sha)
+
+	def write_chunk(self, data: bytes) -> str:
+		"""Stores the chunk unless it's already there; returns its hash"""
+		sha = hashlib.sha256(data).hexdigest()
+		path = self.chunk_path(sha)
+
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+			with open(tmp_path, "wb") as f:
+				f.write(data)
+			os.replace(tmp_path, path)
+
+		return sha
+
+	def read_chunk(self, sha: str) -> bytes:
+		"""Reads the chunk, making sure it's intact"""
+		with open(self.chunk_path(sha), "rb") as f:
+			data = f.read()
+
+		if hashlib.sha256(data).hexdigest() != sha:
+			raise ValidationError(f"Chunk {sha} is corrupt")
+
+		return data
+
+	def store_file(self, path: str) -> List[str]:
+		with open(path, "rb") as f:
+			return [self.write_chunk(data) for data in iter(lambda: f.read(CHUNK_SIZE), b"")]
+
+	def get_snapshot_ids(self) -> List[str]:
+		if not os.path.isdir(self.snapshots_path):
+			return []
+
+		return sorted(
+			name[: -len(".json")] for name in os.listdir(self.snapshots_path) if name.endswith(".json")
+		)
+
+	def read_snapshot(self, snapshot_id: str) -> Dict:
+		try:
+			with open(os.path.join(self.snapshots_path, f"{snapshot_id}.json")) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			raise ValidationError(f"Snapshot {snapshot_id} not found in {self.path}")
+
+	def write_snapshot(self, snapshot: Dict):
+		snapshot_file = os.path.join(self.snapshots_path, f"{snapshot['id']}.json")
+
+		with open(f"{snapshot_file}.tmp", "w") as f:
+			json.dump(snapshot, f)
+		os.replace(f"{snapshot_file}.tmp", snapshot_file)
+
+	def get_latest_files(self, sites: List[str]) -> Dict[str, Dict]:
+		"""Files of each site as of the latest snapshot that has it"""
+		latest = {}
+
+		for snapshot_id in reversed(self.get_snapshot_ids()):
+			if len(latest) == len(sites):
+				break
+
+			snapshot = self.read_snapshot(snapshot_id)
+			for site in sites:
+				if site not in latest and site in snapshot["sites"]:
+					latest[site] = snapshot["sites"][site]
+
+		return latest
+
+	def create_snapshot(self, sites: List[str], bench_path=".", jobs: int = None) -> Dict:
+		"""Snapshots the files of the given sites; returns the snapshot"""
+		from bench.utils.parallel import run_in_parallel
+
+		with self.lock(shared=True):
+			latest = self.get_latest_files(sites)
+			files = [(site, path) for site in sites for path in get_site_files(site, bench_path)]
+
+			def backup(item):
+				site, path = item
+				try:
+					st = os.stat(os.path.join(bench_path, "sites", site, path))
+				except FileNotFoundError:
+					return None
+
+				entry = {
+					"size": st.st_size,
+					"mtime_ns": st.st_mtime_ns,
+					"mode": stat.S_IMODE(st.st_mode),
+				}
+				previous = latest.get(site, {}).get(path)
+
+				if previous and (previous["size"], previous["mtime_ns"]) == (
+					entry["size"],
+					entry["mtime_ns"],
+				):
+					entry["chunks"] = previous["chunks"]
+					return entry, False
+
+				try:
+					entry["chunks"] = self.store_file(os.path.join(bench_path, "sites", site, path))
+				except FileNotFoundError:
+					return None
+				return entry, True
+
+			results = run_in_parallel(backup, files, jobs=jobs)
+
+			snapshot = {
+				"id": self.new_snapshot_id(),
+				"created_at": datetime.now().isoformat(),
+				"sites": {site: {} for site in sites},
+				"stats": {"files": 0, "changed_files": 0, "changed_bytes": 0},
+			}
+			for (site, path), result in results.items():
+				if not result:
+					continue
+				entry, changed = result
+				snapshot["sites"][site][path] = entry
+				snapshot["stats"]["files"] += 1
+				if changed:
+					snapshot["stats"]["changed_files"] += 1
+					snapshot["stats"]["changed_bytes"] += entry["size"]
+
+			self.write_snapshot(snapshot)
+
+		return snapshot
+
+	def new_snapshot_id(self) -> str:
+		snapshot_id = base_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+		suffix = 0
+		while os.path.exists(os.path.join(self.snapshots_path, f"{snapshot_id}.json")):
+			suffix += 1
+			snapshot_id = f"{base_id}-{suffix}"
+
+		return snapshot_id
+
+	def restore_snapshot(
+		self, snapshot_id: str, sites_path: str, sites: List[str] = None, jobs: int = None
+	) -> int:
+		"""Restores files of the snapshot's sites (or the given ones) into sites_path.
+		Files that are already there with the same size & mtime are left alone.
+		Returns the number of files written."""
+		from bench.utils.parallel import run_in_parallel
+
+		with self.lock(shared=True):
+			snapshot = self.read_snapshot(snapshot_id)
+			missing = set(sites or []) - set(snapshot["sites"])
+			if missing:
+				raise ValidationError(f"Snapshot {snapshot_id} has no files of {', '.join(missing)}")
+
+			files = [
+				(site, path)
+				for site, site_files in snapshot["sites"].items()
+				if not sites or site in sites
+				for path in site_files
+			]
+
+			def restore(item):
+				site, path = item
+				entry = snapshot["sites"][site][path]
+				target = os.path.join(sites_path, site, path)
+
+				try:
+					st = os.stat(target)
+					if (st.st_size, st.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+						return False
+				except FileNotFoundError:
+					pass
+
+				os.makedirs(os.path.dirname(target), exist_ok=True)
+				tmp_path = f"{target}.restore.tmp"
+				with open(tmp_path, "wb") as f:
+					for sha in entry["chunks"]:
+						f.write(self.read_chunk(sha))
+				os.chmod(tmp_path, entry["mode"])
+				os.utime(tmp_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+				os.replace(tmp_path, target)
+				return True
+
+			results = run_in_parallel(restore, files, jobs=jobs)
+
+		return sum(results.values())
+
+	def verify(self, snapshot_ids: List[str] = None, jobs: int = None) -> Dict[str, str]:
+		"""Reads back every chunk referenced by the given snapshots (or all of them)
+		& checks its hash. Returns a dict of damaged chunk → error."""
+		from bench.utils.parallel import run_in_parallel
+
+		def check(sha):
+			try:
+				self.read_chunk(sha)
+			except FileNotFoundError:
+				return "missing"
+			except (OSError, ValidationError) as e:
+				return str(e)
+
+		with self.lock(shared=True):
+			chunks = self.get_referenced_chunks(snapshot_ids)
+			results = run_in_parallel(check, chunks, jobs=jobs)
+
+		return {sha: error for sha, error in results.items() if error}
+
+	def get_referenced_chunks(self, snapshot_ids: List[str] = None) -> set:
+		chunks = set()
+
+		for snapshot_id in self.get_snapshot_ids() if snapshot_ids is None else snapshot_ids:
+			for site_files in self.read_snapshot(snapshot_id)["sites"].values():
+				for entry in site_files.values():
+					chunks.update(entry["chunks"])
+
+		return chunks
+
+	def get_damaged_files(self, damaged: Dict[str, str], snapshot_ids: List[str] = None) -> Dict:
+		"""Snapshot → files that can't be restored because of the damaged chunks"""
+		files = {}
+
+		for snapshot_id in self.get_snapshot_ids() if snapshot_ids is None else snapshot_ids:
+			for site, site_files in self.read_snapshot(snapshot_id)["sites"].items():
+				for path, entry in site_files.items():
+					if any(sha in damaged for sha in entry["chunks"]):
+						files.setdefault(snapshot_id, []).append(os.path.join(site, path))
+
+		return files
+
+	def prune(self, keep: int) -> List[str]:
+		"""Removes all but the latest `keep` snapshots & chunks only they referenced"""
+		with self.lock():
+			snapshot_ids = self.get_snapshot_ids()
+			removed = snapshot_ids[:-keep] if keep else snapshot_ids
+
+			for snapshot_id in removed:
+				os.remove(os.path.join(self.snapshots_path, f"{snapshot_id}.json"))
+
+			referenced = self.get_referenced_chunks(snapshot_ids[len(removed) :])
+			for root, _, filenames in os.walk(self.chunks_path):
+				for name in filenames:
+					if name not in referenced:
+						os.remove(os.path.join(root, name))
+
+		return removed
+
+
+def backup_site_files(bench_path=".", sites: List[str] = None, jobs: int = None) -> Dict:
+	"""Snapshots files of the given sites (or all) into the bench's file backup
+	repository, then prunes it to file_backup_keep (or 28) snapshots"""
+	from bench.bench import Bench
+
+	config = get_config(bench_path)
+	repository = get_file_backup_repository(bench_path)
+	sites = list(Bench(bench_path).sites) if sites is None else sites
+
+	log(f"Backing up files of {len(sites)} sites to {repository.path}", no_log=True)
+	snapshot = repository.create_snapshot(sites, bench_path=bench_path, jobs=jobs)
+	stats = snapshot["stats"]
+	log(
+		f"Created snapshot {snapshot['id']}: {stats['files']} files,"
+		f" {stats['changed_files']} new or changed"
+		f" ({stats['changed_bytes'] / (1024 * 1024):.1f} MB read)",
+		level=1,
+	)
+
+	removed = repository.prune(config.get("file_backup_keep") or DEFAULT_FILE_BACKUP_KEEP)
+	if removed:
+		log(f"Pruned {len(removed)} old snapshots", no_log=True)
+
+	return snapshot
+
+
+def verify_file_backups(bench_path=".", snapshot_ids: List[str] = None, jobs: int = None):
+	repository = get_file_backup_repository(bench_path)
+	damaged = repository.verify(snapshot_ids, jobs=jobs)
+
+	if not damaged:
+		log("All chunks are intact", level=1)
+		return
+
+	for snapshot_id, files in repository.get_damaged_files(damaged, snapshot_ids).items():
+		click.secho(f"Snapshot {snapshot_id}: {len(files)} files can't be restored", fg="red")
+		for path in files:
+			click.echo(f"  {path}")
+
+	raise ValidationError(f"{len(damaged)} chunks are missing or corrupt")
@@ -0,0 +1,148 @@
+# imports - standard imports
+import errno
+import os
+import shutil
+from typing import Callable
+
+# imports - module imports
+from bench.utils.parallel import run_in_parallel
+
+# ioctl request number for FICLONE on Linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# filesystems (by st_dev) on which reflinks were found to be unsupported
+_no_reflink_devices = set()
+_no_hardlink_devices = set()
+
+
+def is_immutable_git_object(path: str) -> bool:
+	"""Loose objects & packs under .git/objects are never modified in place by git,
+	which makes them safe to share between repositories as hardlinks"""
+	parts = path.split(os.sep)
+
+	try:
+		idx = len(parts) - 1 - parts[::-1].index("objects")
+	except ValueError:
+		return False
+
+	if idx == 0 or parts[idx - 1] != ".git" or idx + 2 != len(parts) - 1:
+		return False
+
+	return parts[idx + 1] == "pack" or len(parts[idx + 1]) == 2
+
+
+def reflink(src: str, dst: str) -> bool:
+	"""Creates a copy-on-write clone of src at dst. Returns False if the filesystem
+	doesn't support it, in which case dst is left untouched"""
+	import fcntl
+
+	device = os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+	if device in _no_reflink_devices:
+		return False
+
+	try:
+		with open(src, "rb") as s, open(dst, "wb") as d:
+			fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+	except OSError as e:
+		if os.path.exists(dst):
+			os.remove(dst)
+		if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+			_no_reflink_devices.add(device)
+		return False
+
+	shutil.copystat(src, dst)
+	return True
+
+
+def hardlink(src: str, dst: str) -> bool:
+	device = os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+	if device in _no_hardlink_devices:
+		return False
+
+	try:
+		os.link(src, dst)
+	except OSError as e:
+		if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+			_no_hardlink_devices.add(device)
+		return False
+
+	return True
+
+
+def copy_file(src: str, dst: str, link: bool = False) -> str:
+	"""Copies a single file using the cheapest available method: a hardlink (only if
+	`link` is set), a reflink or a plain copy. Returns the method used."""
+	if link and hardlink(src, dst):
+		return "hardlink"
+
+	if reflink(src, dst):
+		return "reflink"
+
+	shutil.copy2(src, dst, follow_symlinks=False)
+	return "copy"
+
+
+def copy_tree(
+	src: str, dst: str, jobs: int = None, link: Callable = is_immutable_git_object
+) -> dict:
+	"""Copies the directory tree at src to dst. Files for which `link(path)` is true
+	are hardlinked, the rest are reflinked where the filesystem supports it. Plain
+	copies are done in parallel when neither is possible.
+
+	Returns the count of files copied per method.
+	"""
+	files = []
+
+	for root, dirs, filenames in os.walk(src):
+		target_root = os.path.join(dst, os.path.relpath(root, src))
+		os.makedirs(target_root, exist_ok=True)
+
+		for name in dirs + filenames:
+			path = os.path.join(root, name)
+			target = os.path.join(target_root, name)
+
+			if os.path.islink(path):
+				os.symlink(os.readlink(path), target)
+				if name in dirs:
+					dirs.remove(name)
+			elif name in filenames:
+				files.append((path, target))
+
+	results = run_in_parallel(
+		lambda f: copy_file(*f, link=bool(link and link(f[0]))), files, jobs=jobs
+	)
+
+	# directory timestamps & modes are copied last as creating files changes them
+	for root, dirs, _ in os.walk(src, topdown=False):
+		shutil.copystat(root, os.path.join(dst, os.path.relpath(root, src)))
+
+	stats = {}
+	for method in results.values():
+		stats[method] = stats.get(method, 0) + 1
+
+	return stats
+
+
+def exchange_paths(a: str, b: str) -> bool:
+	"""Swaps the paths a & b. This is atomic where renameat2(RENAME_EXCHANGE) is
+	available (Linux 3.15+); otherwise three renames are done in quick succession.
+	Returns whether the swap was atomic."""
+	import ctypes
+
+	AT_FDCWD, RENAME_EXCHANGE = -100, 2
+
+	try:
+		renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+	except (AttributeError, OSError):
+		renameat2 = None
+
+	if renameat2 and not renameat2(
+		AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE
+	):
+		return True
+
+	tmp = f"{b}.swap"
+	os.rename(a, tmp)
+	os.rename(b, a)
+	os.rename(tmp, b)
+	return False
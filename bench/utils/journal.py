@@ -0,0 +1,140 @@
+# imports - standard imports
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+# imports - module imports
+from bench.exceptions import ValidationError
+from bench.utils import log
+
+# `bench update` records its progress in logs/update.json, so that
+# `bench update --resume` can continue a failed update where it stopped
+#
+# 	options		what the update was started with, reused when resuming
+# 	phases		phase → status, times, error & units: apps pulled & installed,
+# 				sites backed up & migrated, each with its status & output
+UPDATE_JOURNAL_FILE = "update.json"
+DONE_STATUSES = ("success", "skipped")
+
+
+def get_update_journal_path(bench_path=".") -> str:
+	return os.path.join(bench_path, "logs", UPDATE_JOURNAL_FILE)
+
+
+class UpdateJournal:
+	"""The journal of an update. Phases & units are marked running when they start,
+	and success or failed when they end; a resumed update skips those that are
+	done. Units may be recorded from several threads at once."""
+
+	def __init__(self, data: Dict, bench_path="."):
+		self.data = data
+		self.path = get_update_journal_path(bench_path)
+		self.lock = threading.Lock()
+
+	@classmethod
+	def start(cls, options: Dict, bench_path=".") -> "UpdateJournal":
+		now = datetime.now()
+		journal = cls(
+			{
+				"id": now.strftime("%Y%m%d-%H%M%S"),
+				"started_at": now.isoformat(),
+				"status": "running",
+				"options": options,
+				"phases": {},
+			},
+			bench_path=bench_path,
+		)
+		journal.save()
+		return journal
+
+	@classmethod
+	def resume(cls, bench_path=".") -> "UpdateJournal":
+		try:
+			with open(get_update_journal_path(bench_path)) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			raise ValidationError("No update to resume")
+
+		if data["status"] == "success":
+			raise ValidationError(f"Update {data['id']} finished, there's nothing to resume")
+
+		journal = cls(data, bench_path=bench_path)
+		done = [name for name in data["phases"] if journal.is_done(name)]
+		log(
+			f"Resuming update {data['id']}"
+			+ (f", skipping {', '.join(done)}" if done else ""),
+			no_log=True,
+		)
+		journal.data["status"] = "running"
+		journal.save()
+		return journal
+
+	@property
+	def options(self) -> Dict:
+		return self.data["options"]
+
+	def save(self):
+		with self.lock:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			with open(f"{self.path}.tmp", "w") as f:
+				json.dump(self.data, f, indent=1)
+			os.replace(f"{self.path}.tmp", self.path)
+
+	def is_done(self, phase: str) -> bool:
+		return self.data["phases"].get(phase, {}).get("status") in DONE_STATUSES
+
+	def pending(self, phase: str, units: List[str]) -> List[str]:
+		"""The units of the phase that haven't been done yet, in the given order"""
+		done = self.data["phases"].get(phase, {}).get("units", {})
+		return [unit for unit in units if done.get(unit, {}).get("status") not in DONE_STATUSES]
+
+	def set_unit(self, phase: str, unit: str, status: str, **details):
+		with self.lock:
+			units = self.data["phases"].setdefault(phase, {}).setdefault("units", {})
+			units[unit] = {**units.get(unit, {}), **details, "status": status}
+		self.save()
+
+	@contextmanager
+	def phase(self, name: str):
+		with self.lock:
+			phase = self.data["phases"].setdefault(name, {})
+			phase.update(
+				{"status": "running", "started_at": datetime.now().isoformat(), "error": None}
+			)
+		self.save()
+
+		try:
+			yield
+		except BaseException as e:
+			with self.lock:
+				phase.update({"status": "failed", "error": str(e) or type(e).__name__})
+				self.data["status"] = "failed"
+			raise
+		else:
+			with self.lock:
+				phase["status"] = "success"
+		finally:
+			with self.lock:
+				phase["finished_at"] = datetime.now().isoformat()
+			self.save()
+
+	@contextmanager
+	def unit(self, phase: str, name: str):
+		"""Records a unit of the phase; details set on the yielded dict are kept"""
+		details = {"started_at": datetime.now().isoformat()}
+		self.set_unit(phase, name, "running", **details)
+
+		try:
+			yield details
+		except BaseException as e:
+			self.set_unit(phase, name, "failed", **details, error=str(e) or type(e).__name__)
+			raise
+		else:
+			self.set_unit(phase, name, "success", **details)
+
+	def finish(self):
+		self.data.update({"status": "success", "finished_at": datetime.now().isoformat()})
+		self.save()
@@ -0,0 +1,112 @@
+# imports - standard imports
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+
+# imports - module imports
+from bench.utils import log
+
+# held by operations that change apps, envs or sites' schemas & data; scheduled
+# backups defer to them
+BENCH_LOCK_FILE = os.path.join("config", "bench.lock")
+# frappe commands that take the bench lock, see bench.cli.frappe_cmd
+LOCKED_FRAPPE_COMMANDS = (
+	"migrate",
+	"restore",
+	"partial-restore",
+	"reinstall",
+	"install-app",
+	"uninstall-app",
+)
+
+_held = {}
+_held_lock = threading.Lock()
+
+
+def get_bench_lock_path(bench_path=".") -> str:
+	return os.path.join(os.path.abspath(bench_path), BENCH_LOCK_FILE)
+
+
+def get_bench_lock_holder(bench_path=".") -> str:
+	"""What the last exclusive holder of the lock said it was doing"""
+	try:
+		with open(get_bench_lock_path(bench_path)) as f:
+			return f.read().strip() or None
+	except OSError:
+		return None
+
+
+@contextmanager
+def bench_lock(operation: str, bench_path=".", shared=False, wait=True):
+	"""Holds the bench's operation lock for the duration of `operation`. Operations
+	like update, migrate & restore hold it exclusively; backups share it so that they
+	can run alongside each other, but not during those.
+
+	Yields whether the lock was acquired, which is always the case if `wait` is set.
+	The lock is reentrant within a process, so operations can nest.
+	"""
+	path = get_bench_lock_path(bench_path)
+
+	with _held_lock:
+		reentered = path in _held
+		if reentered:
+			_held[path]["count"] += 1
+
+	if not reentered:
+		fd = acquire_bench_lock(operation, bench_path, shared=shared, wait=wait)
+		if fd is None:
+			yield False
+			return
+
+		with _held_lock:
+			_held[path] = {"fd": fd, "count": 1, "shared": shared}
+
+	try:
+		yield True
+	finally:
+		release_bench_lock(path)
+
+
+def acquire_bench_lock(operation: str, bench_path=".", shared=False, wait=True) -> int:
+	"""Locks the bench lock file; returns its descriptor, or None if it's held
+	elsewhere & `wait` isn't set"""
+	path = get_bench_lock_path(bench_path)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+	mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+	try:
+		fcntl.flock(fd, mode | fcntl.LOCK_NB)
+	except BlockingIOError:
+		if not wait:
+			os.close(fd)
+			return None
+
+		log(f"Waiting for {get_bench_lock_holder(bench_path) or 'backups'} to finish", level=3)
+		fcntl.flock(fd, mode)
+
+	if not shared:
+		os.ftruncate(fd, 0)
+		os.write(fd, f"{operation} (pid {os.getpid()})\n".encode())
+
+	return fd
+
+
+def release_bench_lock(path: str):
+	with _held_lock:
+		_held[path]["count"] -= 1
+		if _held[path]["count"]:
+			return
+		held = _held.pop(path)
+
+	if not held["shared"]:
+		os.ftruncate(held["fd"], 0)
+	fcntl.flock(held["fd"], fcntl.LOCK_UN)
+	os.close(held["fd"])
+
+
+def hold_bench_lock_across_exec(operation: str, bench_path="."):
+	"""Takes the bench lock for a process about to exec into another, which keeps
+	holding it until it exits"""
+	os.set_inheritable(acquire_bench_lock(operation, bench_path), True)
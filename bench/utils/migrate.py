@@ -0,0 +1,469 @@
+# imports - standard imports
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import chain, zip_longest
+from typing import Callable, Dict, List, Tuple
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.config.site_config import (
+	enable_site_maintenance_mode,
+	get_site_config,
+	restore_site_maintenance_mode,
+)
+from bench.exceptions import ValidationError
+from bench.utils import get_cmd_output, log, which
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# sites are migrated one at a time, as before, unless more jobs are asked for
+DEFAULT_MIGRATE_JOBS = 1
+# migrations are mostly database bound; more than a few at a time per server only
+# make them contend for locks & IO
+DEFAULT_MIGRATE_JOBS_PER_DB_HOST = 4
+# "pool": long-lived interpreters migrating many sites each, "process": one per site
+MIGRATE_RUNNERS = ("pool", "process")
+# commits of the site's apps as of its last successful migration through bench
+MIGRATED_RECORD_FILE = ".bench_migrated.json"
+
+
+def get_site_db_host(site: str, bench_path=".") -> str:
+	"""Database server of the site, as frappe would resolve it"""
+	return (
+		get_site_config(site, bench_path=bench_path).get("db_host")
+		or get_config(bench_path).get("db_host")
+		or "localhost"
+	)
+
+
+def get_migrate_runner(bench_path=".") -> str:
+	"""`pool` unless `migrate_runner` is set to `process` in common_site_config.json"""
+	runner = get_config(bench_path).get("migrate_runner") or "pool"
+
+	if runner not in MIGRATE_RUNNERS:
+		raise ValidationError(
+			f"Unsupported migrate_runner {runner}. Use one of {', '.join(MIGRATE_RUNNERS)}"
+		)
+
+	return runner
+
+
+def get_migrate_log_file(site: str, bench_path=".") -> str:
+	return os.path.join(bench_path, "logs", "migrate", f"{site}.log")
+
+
+def get_app_revision(app: str, bench_path=".") -> str:
+	"""HEAD of the app's repo, or None if it isn't a git repo or has local changes"""
+	app_path = os.path.join(bench_path, "apps", app)
+
+	try:
+		commit = get_cmd_output("git rev-parse HEAD", cwd=app_path)
+		changes = get_cmd_output("git status --porcelain --untracked-files=no", cwd=app_path)
+	except Exception:
+		return None
+
+	return None if changes else commit
+
+
+def get_site_installed_apps(site: str, bench_path=".") -> List[str]:
+	"""Apps installed on the site as recorded in its database, queried with the
+	mariadb client. Returns None if they can't be read."""
+	config = {**get_config(bench_path), **get_site_config(site, bench_path=bench_path)}
+	client = which("mariadb") or which("mysql")
+
+	if config.get("db_type", "mariadb") != "mariadb" or not client or not config.get("db_name"):
+		return None
+
+	query = (
+		"select defvalue from tabDefaultValue"
+		" where parent = '__global' and defkey = 'installed_apps'"
+	)
+	cmd = [
+		client,
+		"--batch",
+		"--skip-column-names",
+		f"--host={config.get('db_host') or 'localhost'}",
+		f"--user={config.get('db_user') or config['db_name']}",
+		f"--execute={query}",
+		config["db_name"],
+	]
+	if config.get("db_port"):
+		cmd.insert(-1, f"--port={config['db_port']}")
+
+	try:
+		output = subprocess.run(
+			cmd,
+			env={**os.environ, "MYSQL_PWD": config.get("db_password") or ""},
+			stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL,
+			universal_newlines=True,
+			timeout=30,
+			check=True,
+		).stdout
+		return json.loads(output)
+	except (OSError, ValueError, subprocess.SubprocessError):
+		return None
+
+
+def get_site_migrate_inputs(site: str, revisions: Dict[str, str], bench_path=".") -> Dict:
+	"""Revisions of the apps installed on the site (all of the bench's apps, if those
+	can't be read), or None if any of them isn't at a known commit"""
+	apps = get_site_installed_apps(site, bench_path=bench_path)
+	inputs = {app: revisions.get(app) for app in (revisions if apps is None else apps)}
+
+	return None if None in inputs.values() else inputs
+
+
+def get_migrated_record(site: str, bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(bench_path, "sites", site, MIGRATED_RECORD_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def set_migrated_record(site: str, inputs: Dict, bench_path="."):
+	record_path = os.path.join(bench_path, "sites", site, MIGRATED_RECORD_FILE)
+
+	with open(f"{record_path}.tmp", "w") as f:
+		json.dump({"apps": inputs, "migrated_at": datetime.now().isoformat()}, f, indent=1)
+	os.replace(f"{record_path}.tmp", record_path)
+
+
+def get_unchanged_sites(
+	sites: List[str], bench_path=".", jobs: int = None, code_path: str = None
+) -> Tuple:
+	"""Returns a dict of site → migrate inputs, and the sites whose inputs are the
+	same as when they were last migrated. Revisions are read from the apps of
+	`code_path` (a release directory), defaulting to the bench's."""
+	from bench.bench import Bench
+	from bench.utils.parallel import run_in_parallel
+
+	code_path = code_path or bench_path
+	apps = list(Bench(code_path).apps)
+	revisions = run_in_parallel(lambda app: get_app_revision(app, code_path), apps, jobs=jobs)
+	inputs = run_in_parallel(
+		lambda site: get_site_migrate_inputs(site, revisions, bench_path=bench_path),
+		sites,
+		jobs=jobs,
+	)
+	unchanged = [
+		site
+		for site in sites
+		if inputs[site] and inputs[site] == get_migrated_record(site, bench_path).get("apps")
+	]
+
+	return inputs, unchanged
+
+
+def interleave_by_db_host(sites: List[str], db_hosts: Dict[str, str]) -> List[str]:
+	"""Orders sites round-robin over their database servers, so that workers waiting
+	on one server's limit don't hold up sites on the others"""
+	by_host = defaultdict(list)
+	for site in sites:
+		by_host[db_hosts[site]].append(site)
+
+	return [
+		site for site in chain.from_iterable(zip_longest(*by_host.values())) if site
+	]
+
+
+def migrate_sites(
+	bench_path=".",
+	sites: List[str] = None,
+	jobs: int = None,
+	jobs_per_db_host: int = None,
+	fail_fast: bool = True,
+	force: bool = False,
+	maintenance: bool = False,
+	code_path: str = None,
+	on_result: Callable = None,
+) -> Dict[str, Dict]:
+	"""Migrates sites concurrently, at most `jobs` at once & at most `jobs_per_db_host`
+	on the same database server. These default to migrate_jobs (or 1) &
+	migrate_jobs_per_db_host (or 4) in common_site_config.json. Output of each
+	migration is written to logs/migrate/<site>.log.
+
+	Each concurrent job keeps a worker interpreter that migrates its sites one after
+	another, unless migrate_runner is set to "process". A site whose worker dies
+	before reporting a result is migrated again in a process of its own, to rule out
+	state left behind by sites migrated before it; a worker is replaced after a
+	failed migration. Sites are migrated in processes of their own if workers can't
+	be started at all.
+
+	If `fail_fast` is set, no more migrations are started once one fails; running
+	ones are left to finish as interrupting a migration is worse than completing it.
+
+	Unless `force` is set, sites are skipped if the commits of apps installed on them
+	are the same as at their last successful migration, recorded in
+	sites/<site>/.bench_migrated.json whether forced or not.
+
+	If `maintenance` is set, each site is put in maintenance mode for the duration of
+	its migration. Sites whose migration fails are left in maintenance mode.
+
+	`code_path` is a directory with its own apps & env to migrate with, like a
+	release built by `bench release build`; it defaults to the bench itself.
+
+	`on_result` is called with each site & its result as soon as it's migrated or
+	skipped, from the thread that migrated it.
+
+	Returns a dict of site → {"status", "duration", "log_file"} where status is one
+	of "success", "failed", "skipped" or "not started".
+	"""
+	from bench.bench import Bench
+	from bench.utils.parallel import get_jobs, run_in_parallel
+
+	config = get_config(bench_path)
+	sites = list(Bench(bench_path).sites) if sites is None else sites
+	jobs = get_jobs(jobs or config.get("migrate_jobs") or DEFAULT_MIGRATE_JOBS)
+	jobs_per_db_host = (
+		jobs_per_db_host
+		or config.get("migrate_jobs_per_db_host")
+		or DEFAULT_MIGRATE_JOBS_PER_DB_HOST
+	)
+
+	# forced migrations are recorded too, so that the next update can skip them
+	inputs, unchanged = get_unchanged_sites(sites, bench_path, jobs, code_path=code_path)
+	if force:
+		unchanged = []
+	skipped = {site: {"status": "skipped", "duration": 0, "log_file": None} for site in unchanged}
+	if skipped:
+		log(f"Skipping {len(skipped)} sites whose apps haven't changed", no_log=True)
+	for site, result in skipped.items():
+		if on_result:
+			on_result(site, result)
+	to_migrate = [site for site in sites if site not in skipped]
+
+	db_hosts = {site: get_site_db_host(site, bench_path=bench_path) for site in to_migrate}
+	db_host_slots = {
+		db_host: threading.BoundedSemaphore(jobs_per_db_host)
+		for db_host in set(db_hosts.values())
+	}
+	stop = threading.Event()
+	use_workers = threading.Event()
+	workers, local = [], threading.local()
+
+	if get_migrate_runner(bench_path) == "pool":
+		use_workers.set()
+
+	def get_worker():
+		worker = getattr(local, "worker", None)
+		if worker and worker.alive:
+			return worker
+
+		worker = local.worker = MigrateWorker(bench_path=bench_path, code_path=code_path)
+		workers.append(worker)
+
+		if not worker.start():
+			if use_workers.is_set():
+				log("Couldn't start migrate workers, migrating every site separately", level=3)
+			use_workers.clear()
+			return None
+
+		return worker
+
+	def migrate(site):
+		with db_host_slots[db_hosts[site]]:
+			if stop.is_set():
+				return {"status": "not started", "duration": 0, "log_file": None}
+
+			previous = maintenance and enable_site_maintenance_mode(site, bench_path=bench_path)
+			worker = use_workers.is_set() and get_worker()
+			result = worker and worker.migrate(site)
+
+			# a failed migration isn't retried, its patches may have partly run
+			if worker and not result:
+				log(f"Migrating {site} again in a fresh interpreter", level=3)
+
+			if not result:
+				result = migrate_site_in_process(
+					site, bench_path=bench_path, append=bool(worker), code_path=code_path
+				)
+
+			if maintenance and result["status"] == "success":
+				restore_site_maintenance_mode(site, previous, bench_path=bench_path)
+
+		if result["status"] == "success" and inputs.get(site):
+			set_migrated_record(site, inputs[site], bench_path=bench_path)
+
+		if result["status"] == "failed" and fail_fast:
+			stop.set()
+
+		if on_result:
+			on_result(site, result)
+
+		return result
+
+	log(
+		f"Migrating {len(to_migrate)} sites, {jobs} at a time and at most {jobs_per_db_host}"
+		" per database server",
+		no_log=True,
+	)
+	try:
+		results = run_in_parallel(
+			migrate, interleave_by_db_host(to_migrate, db_hosts), jobs=jobs, fail_fast=False
+		)
+	finally:
+		for worker in workers:
+			worker.stop()
+
+	# anything raised outside the migration itself, like a missing env
+	for site, result in results.items():
+		if isinstance(result, Exception):
+			logger.exception(result)
+			results[site] = {"status": "failed", "duration": 0, "log_file": None}
+
+	results.update(skipped)
+	return {site: results[site] for site in sites}
+
+
+def migrate_site_in_process(
+	site: str, bench_path=".", append=False, code_path: str = None
+) -> Dict:
+	"""Runs `bench --site <site> migrate` in a new interpreter. Its output is echoed
+	prefixed by the site's name in verbose mode."""
+	import bench.cli
+	from bench.utils.bench import get_env_cmd
+	from bench.utils.parallel import capture_cmd
+
+	python = get_env_cmd("python", bench_path=code_path or bench_path)
+	log_file = os.path.abspath(get_migrate_log_file(site, bench_path=bench_path))
+
+	click.secho(f"Migrating {site}", fg="yellow")
+	start = time.monotonic()
+	return_code, _ = capture_cmd(
+		f"{python} -m frappe.utils.bench_helper frappe --site {site} migrate",
+		cwd=os.path.join(bench_path, "sites"),
+		log_file=log_file,
+		append=append,
+		prefix=site if bench.cli.verbose else None,
+	)
+
+	return report_migration(
+		site,
+		{
+			"status": "failed" if return_code else "success",
+			"duration": time.monotonic() - start,
+			"log_file": log_file,
+		},
+	)
+
+
+def report_migration(site: str, result: Dict) -> Dict:
+	if result["status"] == "failed":
+		click.secho(
+			f"Migrating {site} failed after {result['duration']:.1f}s, see {result['log_file']}",
+			fg="red",
+		)
+	else:
+		click.secho(f"Migrated {site} in {result['duration']:.1f}s", fg="green")
+
+	return result
+
+
+class MigrateWorker:
+	"""An env interpreter that migrates sites one after another, running
+	bench/utils/migrate_worker.py. It boots python & imports frappe once instead of
+	once per site."""
+
+	def __init__(self, bench_path=".", code_path=None):
+		self.bench_path = bench_path
+		self.code_path = code_path or bench_path
+		self.process = None
+
+	@property
+	def alive(self) -> bool:
+		return bool(self.process) and self.process.poll() is None
+
+	def start(self) -> bool:
+		"""Starts the worker; returns whether it's ready to migrate sites"""
+		from bench.utils.bench import get_env_cmd
+
+		script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrate_worker.py")
+		self.process = subprocess.Popen(
+			[get_env_cmd("python", bench_path=self.code_path), script],
+			cwd=os.path.join(self.bench_path, "sites"),
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			universal_newlines=True,
+		)
+
+		event = self.read_event()
+		if event and event["event"] == "ready":
+			logger.debug(f"Started migrate worker {event['pid']}")
+			return True
+
+		self.stop()
+		return False
+
+	def read_event(self) -> Dict:
+		line = self.process.stdout.readline()
+		return json.loads(line) if line else None
+
+	def migrate(self, site: str) -> Dict:
+		"""Migrates the site in the worker. Returns None if the worker died midway."""
+		log_file = os.path.abspath(get_migrate_log_file(site, bench_path=self.bench_path))
+
+		try:
+			self.process.stdin.write(f"{site}\t{log_file}\n")
+			self.process.stdin.flush()
+		except BrokenPipeError:
+			return None
+
+		while True:
+			event = self.read_event()
+
+			if not event:
+				click.secho(f"Migrate worker died while migrating {site}", fg="red")
+				return None
+
+			if event["event"] == "start":
+				click.secho(f"Migrating {site}", fg="yellow")
+
+			elif event["event"] == "done":
+				# the worker exits after a failed migration; wait so it's replaced
+				if event["status"] == "failed":
+					self.stop()
+				return report_migration(
+					site,
+					{"status": event["status"], "duration": event["duration"], "log_file": log_file},
+				)
+
+	def stop(self):
+		if not self.process:
+			return
+
+		try:
+			self.process.stdin.close()
+		except BrokenPipeError:
+			pass
+		self.process.wait()
+
+
+def print_migrate_summary(results: Dict[str, Dict]):
+	colors = {"success": "green", "failed": "red", "skipped": "bright_black", "not started": "yellow"}
+	width = max(len(site) for site in results)
+
+	click.secho("\nMigration summary", bold=True)
+	for site, result in sorted(results.items(), key=lambda x: -x[1]["duration"]):
+		click.echo(
+			f"{site:<{width}}  "
+			+ click.style(f"{result['status']:<11}", fg=colors[result["status"]])
+			+ f"  {result['duration']:>7.1f}s"
+			+ (f"  {result['log_file']}" if result["status"] == "failed" else "")
+		)
+
+	counts = defaultdict(int)
+	for result in results.values():
+		counts[result["status"]] += 1
+	click.echo(", ".join(f"{count} {status}" for status, count in counts.items()))
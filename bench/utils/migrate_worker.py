@@ -0,0 +1,103 @@
+"""Migrates sites one after another in a single interpreter, to save booting python
+& importing frappe for every site. This runs with the bench's env python from the
+sites directory, so it must not import anything from bench.
+
+Site names and the log file for each are read from stdin as tab separated lines.
+Progress is written to stdout as JSON lines:
+
+	{"event": "ready"}
+	{"event": "start", "site": "site1.local"}
+	{"event": "done", "site": "site1.local", "status": "success", "duration": 12.3}
+
+Output of each migration goes to its log file. The worker exits after a failed
+migration, since whatever went wrong may have left the interpreter in a bad state.
+"""
+
+import json
+import os
+import sys
+import time
+import traceback
+
+# being run as a script puts bench/utils on sys.path, where bench's modules could
+# shadow packages frappe & apps import
+sys.path = [
+	p for p in sys.path if os.path.abspath(p) != os.path.dirname(os.path.abspath(__file__))
+]
+
+
+def emit(stream, **event):
+	stream.write(json.dumps(event) + "\n")
+	stream.flush()
+
+
+def redirect_output(log_file):
+	"""Points this process' stdout & stderr to log_file, so that output of C
+	extensions & subprocesses ends up there too"""
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+	os.dup2(fd, 1)
+	os.dup2(fd, 2)
+	os.close(fd)
+
+
+def migrate(commands, site):
+	"""Runs `bench --site <site> migrate` the way frappe's bench_helper would"""
+	import click
+	import frappe
+
+	try:
+		# without standalone_mode, click returns the code commands exit with
+		exit_code = click.Group(commands=commands).main(
+			args=["frappe", "--site", site, "migrate"], prog_name="bench", standalone_mode=False
+		)
+	except SystemExit as e:
+		exit_code = e.code
+	finally:
+		frappe.destroy()
+
+	if exit_code:
+		raise SystemExit(exit_code)
+
+
+def main():
+	protocol = os.fdopen(os.dup(1), "w")
+	os.makedirs(os.path.join("..", "logs", "migrate"), exist_ok=True)
+	redirect_output(os.path.join("..", "logs", "migrate", "worker.log"))
+
+	from frappe.utils.bench_helper import get_app_groups
+
+	commands = get_app_groups()
+	emit(protocol, event="ready", pid=os.getpid())
+
+	for line in sys.stdin:
+		site, log_file = line.rstrip("\n").split("\t")
+		redirect_output(log_file)
+		emit(protocol, event="start", site=site)
+		start = time.monotonic()
+
+		try:
+			migrate(commands, site)
+		except BaseException:
+			traceback.print_exc()
+			sys.stderr.flush()
+			emit(
+				protocol,
+				event="done",
+				site=site,
+				status="failed",
+				duration=time.monotonic() - start,
+			)
+			sys.exit(1)
+
+		sys.stdout.flush()
+		sys.stderr.flush()
+		emit(
+			protocol, event="done", site=site, status="success", duration=time.monotonic() - start
+		)
+
+
+if __name__ == "__main__":
+	main()
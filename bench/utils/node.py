@@ -0,0 +1,224 @@
+# imports - standard imports
+import hashlib
+import logging
+import os
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.exceptions import CommandFailedError, ValidationError
+from bench.utils import exec_cmd, get_cmd_output, log, which
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# files that decide the contents of an app's node_modules
+NODE_DEPS_FILES = ("package.json", "yarn.lock", ".yarnrc", ".npmrc")
+NODE_DEPS_DIGEST_FILE = ".bench_deps_digest"
+NODE_PACKAGE_MANAGERS = ("yarn", "pnpm")
+
+
+def get_files_digest(paths) -> str:
+	"""sha256 over the names & contents of the given files; missing files are skipped"""
+	digest = hashlib.sha256()
+
+	for path in paths:
+		if not os.path.isfile(path):
+			continue
+		digest.update(os.path.basename(path).encode())
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+def get_node_deps_digest(app_path: str, package_manager: str = "yarn") -> str:
+	files = list(NODE_DEPS_FILES)
+
+	# pnpm-lock.yaml is generated from yarn.lock when an app doesn't ship its own
+	if not os.path.exists(os.path.join(app_path, "yarn.lock")):
+		files.append("pnpm-lock.yaml")
+
+	digest = get_files_digest(os.path.join(app_path, f) for f in files)
+	return f"{package_manager}:{digest}"
+
+
+def get_installed_node_deps_digest(app_path: str) -> str:
+	try:
+		with open(os.path.join(app_path, "node_modules", NODE_DEPS_DIGEST_FILE)) as f:
+			return f.read().strip()
+	except OSError:
+		return None
+
+
+def set_installed_node_deps_digest(app_path: str, digest: str):
+	with open(os.path.join(app_path, "node_modules", NODE_DEPS_DIGEST_FILE), "w") as f:
+		f.write(digest)
+
+
+def get_yarn_cache_dir(bench_path=".") -> str:
+	"""Yarn cache shared by all benches on the host, unless `yarn_cache_dir` is set in
+	common_site_config.json"""
+	cache_dir = get_config(bench_path).get("yarn_cache_dir") or os.path.join(
+		"~", ".cache", "bench", "yarn"
+	)
+	return os.path.abspath(os.path.expanduser(cache_dir))
+
+
+def get_node_package_manager(bench_path=".") -> str:
+	"""`yarn` unless `node_package_manager` is set to `pnpm` in common_site_config.json"""
+	package_manager = get_config(bench_path).get("node_package_manager") or "yarn"
+
+	if package_manager not in NODE_PACKAGE_MANAGERS:
+		raise ValidationError(
+			f"Unsupported node_package_manager {package_manager}. "
+			f"Use one of {', '.join(NODE_PACKAGE_MANAGERS)}"
+		)
+
+	return package_manager
+
+
+def get_pnpm_store_dir(bench_path=".") -> str:
+	"""Content-addressable pnpm store shared by all benches on the host, unless
+	`pnpm_store_dir` is set in common_site_config.json. Package files are hardlinked
+	from here into every app's node_modules, so it should be on the same filesystem
+	as the benches."""
+	store_dir = get_config(bench_path).get("pnpm_store_dir") or os.path.join(
+		"~", ".local", "share", "bench", "pnpm-store"
+	)
+	return os.path.abspath(os.path.expanduser(store_dir))
+
+
+def is_store_linked(path: str) -> bool:
+	"""Files in pnpm's virtual store are hardlinks to the host-wide store; copies of
+	node_modules should link them too instead of duplicating them"""
+	virtual_store = f"{os.sep}node_modules{os.sep}.pnpm{os.sep}"
+	return virtual_store in path and os.stat(path).st_nlink > 1
+
+
+def exclude_from_git(app_path: str, pattern: str):
+	"""Hides files generated in an app's repo from `git status` without touching its
+	.gitignore, so that they don't block `bench update`"""
+	exclude_file = os.path.join(app_path, ".git", "info", "exclude")
+
+	if not os.path.isdir(os.path.join(app_path, ".git")):
+		return
+
+	os.makedirs(os.path.dirname(exclude_file), exist_ok=True)
+	with open(exclude_file, "a+") as f:
+		f.seek(0)
+		if pattern not in f.read().splitlines():
+			f.write(f"\n{pattern}\n")
+
+
+def is_tracked_by_git(app_path: str, path: str) -> bool:
+	try:
+		get_cmd_output(f"git ls-files --error-unmatch {path}", cwd=app_path)
+	except Exception:
+		return False
+	return True
+
+
+def get_node_install_cmds(app_path: str, package_manager: str, bench_path=".") -> list:
+	if package_manager == "pnpm":
+		store_dir = get_pnpm_store_dir(bench_path)
+		cmds = []
+
+		if not is_tracked_by_git(app_path, "pnpm-lock.yaml"):
+			# pnpm generates one otherwise, which would block `bench update`
+			exclude_from_git(app_path, "pnpm-lock.yaml")
+
+			if os.path.exists(os.path.join(app_path, "yarn.lock")):
+				# keep versions pinned by the app's yarn.lock
+				cmds.append(f"pnpm import --store-dir {store_dir}")
+
+		cmds.append(
+			f"pnpm install --prefer-offline --store-dir {store_dir}"
+			" --config.confirmModulesPurge=false"
+		)
+		return cmds
+
+	# yarn 1 can't write to a cache from several installs at once, which benches on
+	# the host & concurrent installs of a bench's apps would
+	cache_dir = get_yarn_cache_dir(bench_path)
+	os.makedirs(cache_dir, exist_ok=True)
+	mutex = os.path.join(cache_dir, ".yarn-mutex")
+	return [f"yarn install --prefer-offline --cache-folder {cache_dir} --mutex file:{mutex}"]
+
+
+def install_node_dependencies(app: str, bench_path=".", force=False) -> str:
+	"""Installs node dependencies for the app using yarn or pnpm if its package.json or
+	lockfile changed since the last install. yarn resolves packages from a shared
+	cache first; pnpm hardlinks them from the host-wide store.
+
+	Returns "installed", "skipped" or None if the app has no node dependencies.
+	"""
+	import bench.cli
+	from bench.utils.parallel import capture_cmd
+
+	app_path = os.path.join(bench_path, "apps", app)
+
+	if not os.path.exists(os.path.join(app_path, "package.json")):
+		return None
+
+	package_manager = get_node_package_manager(bench_path)
+	digest = get_node_deps_digest(app_path, package_manager)
+	if not force and digest == get_installed_node_deps_digest(app_path):
+		click.secho(f"Node dependencies for {app} are up to date", fg="bright_black")
+		return "skipped"
+
+	click.secho(f"Installing node dependencies for {app}", fg="yellow")
+	log_file = os.path.join(bench_path, "logs", "node", f"{app}.log")
+
+	cmds = get_node_install_cmds(app_path, package_manager, bench_path=bench_path)
+
+	for idx, cmd in enumerate(cmds):
+		return_code, _ = capture_cmd(cmd, cwd=app_path, log_file=log_file, append=idx > 0)
+		if return_code:
+			break
+
+	if return_code or bench.cli.verbose:
+		with open(log_file) as f:
+			click.echo("".join(f"{app} | {line}" for line in f))
+
+	if return_code:
+		raise CommandFailedError(f"{cmd} failed for {app}, see {log_file}")
+
+	# pnpm may have generated a lockfile, so digest again
+	set_installed_node_deps_digest(app_path, get_node_deps_digest(app_path, package_manager))
+	return "installed"
+
+
+def install_node_packages(bench_path=".", apps=None, jobs=None, force=False):
+	"""Installs node dependencies of the given apps concurrently"""
+	from bench.utils.parallel import run_in_parallel
+
+	results = run_in_parallel(
+		lambda app: install_node_dependencies(app, bench_path=bench_path, force=force),
+		apps,
+		jobs=jobs,
+	)
+
+	skipped = [app for app, status in results.items() if status == "skipped"]
+	if skipped:
+		log(f"Skipped node installs for unchanged apps: {', '.join(skipped)}", no_log=True)
+
+	return results
+
+
+def prune_node_store(bench_path="."):
+	"""Removes packages from the pnpm store that aren't linked into any node_modules"""
+	store_dir = get_pnpm_store_dir(bench_path)
+
+	if not which("pnpm"):
+		log("pnpm is not installed, there's no node store to prune", level=3)
+		return
+
+	if not os.path.exists(store_dir):
+		log(f"No node store found at {store_dir}", level=3)
+		return
+
+	exec_cmd(f"pnpm store prune --store-dir {store_dir}")
@@ -0,0 +1,474 @@
+# imports - standard imports
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config
+from bench.exceptions import ValidationError
+from bench.utils import get_bench_name, log
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+MB = 1024 * 1024
+# S3 allows parts of 5 MB to 5 GB, at most 10000 per upload
+DEFAULT_PART_SIZE = 64
+MIN_PART_SIZE = 5
+MAX_PARTS = 10000
+# backup runs kept in the bucket, per bench
+DEFAULT_REMOTE_KEEP = 28
+# multipart uploads older than this are assumed abandoned & aborted
+STALE_UPLOAD_AGE = timedelta(days=2)
+PUSHED_FILE = "pushed.json"
+
+
+def get_offload_config(bench_path=".") -> Dict:
+	"""backup_s3 from common_site_config.json:
+
+	{"bucket": ..., "prefix": ..., "endpoint_url": ..., "region": ...,
+	"access_key_id": ..., "secret_access_key": ..., "part_size": <MB>,
+	"keep": <backup runs>, "auto_push": true}
+
+	Credentials fall back to boto3's usual lookup if they aren't set."""
+	config = get_config(bench_path).get("backup_s3") or {}
+
+	if not config.get("bucket"):
+		raise ValidationError("backup_s3.bucket isn't set in common_site_config.json")
+
+	return config
+
+
+def get_s3_client(config: Dict, jobs: int = None):
+	try:
+		import boto3
+		from botocore.config import Config
+	except ImportError:
+		raise ValidationError(
+			"boto3 is needed to offload backups, install it alongside bench with"
+			" `pip install boto3`"
+		)
+
+	from bench.utils.parallel import get_jobs
+
+	return boto3.client(
+		"s3",
+		endpoint_url=config.get("endpoint_url"),
+		region_name=config.get("region"),
+		aws_access_key_id=config.get("access_key_id"),
+		aws_secret_access_key=config.get("secret_access_key"),
+		config=Config(max_pool_connections=max(10, get_jobs(jobs))),
+	)
+
+
+def get_backup_store(bench_path=".", jobs: int = None) -> "S3BackupStore":
+	config = get_offload_config(bench_path)
+	prefix = "/".join(p for p in (config.get("prefix"), get_bench_name(bench_path)) if p)
+
+	return S3BackupStore(
+		get_s3_client(config, jobs=jobs),
+		config["bucket"],
+		prefix=prefix,
+		part_size=int(config.get("part_size") or DEFAULT_PART_SIZE),
+		jobs=jobs,
+	)
+
+
+class S3BackupStore:
+	"""Backups of a bench in an S3 compatible bucket, laid out as
+
+	<prefix>/<site>/<backup file>
+	<prefix>/manifests/<run id>.json	the run's manifest, pushed after its files
+
+	Files are uploaded in parts concurrently. An interrupted upload is resumed
+	from the parts that made it, and files already in the bucket with the same
+	checksum aren't uploaded again.
+	"""
+
+	def __init__(self, client, bucket: str, prefix: str = "", part_size: int = DEFAULT_PART_SIZE, jobs: int = None):
+		self.client = client
+		self.bucket = bucket
+		self.prefix = prefix.strip("/")
+		self.part_size = max(part_size, MIN_PART_SIZE) * MB
+		self.jobs = jobs
+
+	def key(self, *parts: str) -> str:
+		return "/".join(p.strip("/") for p in (self.prefix, *parts) if p)
+
+	def head(self, key: str) -> Dict:
+		try:
+			return self.client.head_object(Bucket=self.bucket, Key=key)
+		except self.client.exceptions.ClientError as e:
+			if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+				return None
+			raise
+
+	def has(self, key: str, size: int, sha256: str) -> bool:
+		remote = self.head(key)
+		return bool(remote) and (
+			remote["ContentLength"],
+			remote.get("Metadata", {}).get("sha256"),
+		) == (size, sha256)
+
+	def get_part_size(self, size: int) -> int:
+		return max(self.part_size, -(-size // MAX_PARTS))
+
+	def upload(self, path: str, key: str, sha256: str) -> bool:
+		"""Uploads the file unless it's there already; returns whether it was uploaded"""
+		from bench.utils.parallel import run_in_parallel
+
+		size = os.path.getsize(path)
+		if self.has(key, size, sha256):
+			return False
+
+		metadata = {"sha256": sha256}
+		if size <= self.part_size:
+			with open(path, "rb") as f:
+				self.client.put_object(Bucket=self.bucket, Key=key, Body=f, Metadata=metadata)
+			return True
+
+		part_size = self.get_part_size(size)
+		upload_id, uploaded = self.find_upload(key)
+		if not upload_id:
+			upload_id = self.client.create_multipart_upload(
+				Bucket=self.bucket, Key=key, Metadata=metadata
+			)["UploadId"]
+
+		def upload_part(number):
+			with open(path, "rb") as f:
+				f.seek((number - 1) * part_size)
+				data = f.read(part_size)
+
+			# parts of an interrupted upload are reused if they match the file
+			etag = uploaded.get(number)
+			if etag and etag.strip('"') == hashlib.md5(data).hexdigest():
+				return etag
+
+			return self.client.upload_part(
+				Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+			)["ETag"]
+
+		numbers = range(1, -(-size // part_size) + 1)
+		etags = run_in_parallel(upload_part, numbers, jobs=self.jobs)
+		self.client.complete_multipart_upload(
+			Bucket=self.bucket,
+			Key=key,
+			UploadId=upload_id,
+			MultipartUpload={"Parts": [{"PartNumber": n, "ETag": etags[n]} for n in numbers]},
+		)
+
+		if not self.has(key, size, sha256):
+			raise ValidationError(f"Uploaded {key} doesn't match {path}")
+
+		return True
+
+	def find_upload(self, key: str):
+		"""The latest unfinished multipart upload of key & its parts' etags"""
+		uploads = [
+			upload
+			for upload in self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=key).get(
+				"Uploads", []
+			)
+			if upload["Key"] == key
+		]
+		if not uploads:
+			return None, {}
+
+		upload_id = max(uploads, key=lambda u: u["Initiated"])["UploadId"]
+		parts, marker = {}, 0
+
+		while True:
+			response = self.client.list_parts(
+				Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumberMarker=marker
+			)
+			parts.update({part["PartNumber"]: part["ETag"] for part in response.get("Parts", [])})
+			if not response.get("IsTruncated"):
+				break
+			marker = response["NextPartNumberMarker"]
+
+		return upload_id, parts
+
+	def download(self, key: str, path: str, size: int, sha256: str) -> bool:
+		"""Downloads key to path in ranges concurrently, unless path is already intact.
+		Returns whether it was downloaded."""
+		from bench.utils.backup import get_file_checksum
+		from bench.utils.parallel import run_in_parallel
+
+		if os.path.exists(path) and os.path.getsize(path) == size and get_file_checksum(path) == sha256:
+			return False
+
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		tmp_path = f"{path}.part"
+		part_size = self.get_part_size(size)
+
+		with open(tmp_path, "wb") as f:
+			f.truncate(size)
+
+		fd = os.open(tmp_path, os.O_WRONLY)
+		try:
+
+			def download_range(start):
+				end = min(start + part_size, size) - 1
+				body = self.client.get_object(
+					Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}"
+				)["Body"].read()
+				os.pwrite(fd, body, start)
+
+			run_in_parallel(download_range, range(0, size, part_size), jobs=self.jobs)
+		finally:
+			os.close(fd)
+
+		if get_file_checksum(tmp_path) != sha256:
+			os.remove(tmp_path)
+			raise ValidationError(f"Downloaded {key} doesn't match its checksum")
+
+		os.replace(tmp_path, path)
+		return True
+
+	def put_json(self, key: str, data: Dict):
+		self.client.put_object(
+			Bucket=self.bucket, Key=key, Body=json.dumps(data, indent=1).encode()
+		)
+
+	def get_json(self, key: str) -> Dict:
+		return json.loads(self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read())
+
+	def list_keys(self, *parts: str) -> List[str]:
+		keys, token = [], None
+
+		while True:
+			kwargs = {"ContinuationToken": token} if token else {}
+			response = self.client.list_objects_v2(
+				Bucket=self.bucket, Prefix=self.key(*parts) + "/", **kwargs
+			)
+			keys += [obj["Key"] for obj in response.get("Contents", [])]
+			if not response.get("IsTruncated"):
+				return keys
+			token = response["NextContinuationToken"]
+
+	def delete(self, keys: List[str]):
+		for i in range(0, len(keys), 1000):
+			self.client.delete_objects(
+				Bucket=self.bucket,
+				Delete={"Objects": [{"Key": key} for key in keys[i : i + 1000]], "Quiet": True},
+			)
+
+	def get_run_ids(self) -> List[str]:
+		return sorted(
+			os.path.basename(key)[: -len(".json")]
+			for key in self.list_keys("manifests")
+			if key.endswith(".json")
+		)
+
+	def get_manifest(self, run_id: str) -> Dict:
+		return self.get_json(self.key("manifests", f"{run_id}.json"))
+
+	def prune(self, keep: int) -> List[str]:
+		"""Removes all but the latest `keep` runs, keeping files the remaining runs
+		reference, and aborts abandoned multipart uploads"""
+		run_ids = self.get_run_ids()
+		removed = run_ids[:-keep] if keep else run_ids
+		kept_files = {
+			f["key"]
+			for run_id in run_ids[len(removed) :]
+			for result in self.get_manifest(run_id)["sites"].values()
+			for f in result.get("files", [])
+			if f.get("key")
+		}
+
+		for run_id in removed:
+			files = [
+				f["key"]
+				for result in self.get_manifest(run_id)["sites"].values()
+				for f in result.get("files", [])
+				if f.get("key") and f["key"] not in kept_files
+			]
+			self.delete(files + [self.key("manifests", f"{run_id}.json")])
+
+		now = datetime.now(timezone.utc)
+		uploads = self.client.list_multipart_uploads(
+			Bucket=self.bucket, Prefix=self.key() + "/"
+		).get("Uploads", [])
+		for upload in uploads:
+			if now - upload["Initiated"] > STALE_UPLOAD_AGE:
+				self.client.abort_multipart_upload(
+					Bucket=self.bucket, Key=upload["Key"], UploadId=upload["UploadId"]
+				)
+
+		return removed
+
+
+def get_pushed_runs(bench_path=".") -> Dict:
+	"""Run id → when it was pushed, or None if it was skipped as its files are gone or
+	changed"""
+	from bench.utils.backup import get_backups_path
+
+	try:
+		with open(os.path.join(get_backups_path(bench_path), PUSHED_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def set_pushed_run(run_id: str, bench_path=".", skipped: bool = False):
+	from bench.utils.backup import get_backups_path
+
+	pushed = get_pushed_runs(bench_path)
+	pushed[run_id] = None if skipped else datetime.now().isoformat()
+	pushed_file = os.path.join(get_backups_path(bench_path), PUSHED_FILE)
+
+	with open(f"{pushed_file}.tmp", "w") as f:
+		json.dump(pushed, f, indent=1)
+	os.replace(f"{pushed_file}.tmp", pushed_file)
+
+
+def read_backup_manifest(run_id: str, bench_path=".") -> Dict:
+	from bench.utils.backup import get_backups_path
+
+	try:
+		with open(os.path.join(get_backups_path(bench_path), "manifests", f"{run_id}.json")) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		raise ValidationError(f"Backup run {run_id} not found")
+
+
+def push_backups(
+	bench_path=".", run_ids: List[str] = None, jobs: int = None, store: S3BackupStore = None
+) -> List[str]:
+	"""Uploads backups of the given runs (or those not pushed yet) with their
+	manifests, after checking the files against the checksums in them. Runs whose
+	files have been removed or changed meanwhile, by frappe's retention say, are
+	skipped & not retried. Runs in the bucket beyond backup_s3.keep (or 28) are pruned afterwards.
+	Returns the runs pushed."""
+	from bench.utils.backup import get_backups_path, get_file_checksum
+	from bench.utils.parallel import run_in_parallel
+
+	store = store or get_backup_store(bench_path, jobs=jobs)
+	keep = int(get_offload_config(bench_path).get("keep") or DEFAULT_REMOTE_KEEP)
+
+	if run_ids is None:
+		pushed = get_pushed_runs(bench_path)
+		manifests_path = os.path.join(get_backups_path(bench_path), "manifests")
+		run_ids = sorted(
+			name[: -len(".json")]
+			for name in (os.listdir(manifests_path) if os.path.isdir(manifests_path) else [])
+			if name.endswith(".json") and name[: -len(".json")] not in pushed
+		)
+
+	pushed_run_ids = []
+	for run_id in run_ids:
+		manifest = read_backup_manifest(run_id, bench_path)
+		files = [
+			(site, f)
+			for site, result in manifest["sites"].items()
+			if result["status"] == "success"
+			for f in result["files"]
+		]
+
+		missing = [f["path"] for _, f in files if not os.path.exists(f["path"])]
+		changed = [
+			f["path"]
+			for _, f in files
+			if f["path"] not in missing and get_file_checksum(f["path"]) != f["sha256"]
+		]
+		if missing or changed:
+			log(
+				f"Skipping backup run {run_id}, its files"
+				+ (f" {', '.join(missing)} are gone" if missing else "")
+				+ (" &" if missing and changed else "")
+				+ (f" {', '.join(changed)} don't match their checksums" if changed else ""),
+				level=3,
+			)
+			set_pushed_run(run_id, bench_path, skipped=True)
+			continue
+
+		for site, f in files:
+			f["key"] = store.key(site, os.path.basename(f["path"]))
+
+		def upload(i):
+			f = files[i][1]
+			return store.upload(f["path"], f["key"], f["sha256"])
+
+		# small files go up concurrently, large ones one after another in concurrent parts
+		small = [i for i, (_, f) in enumerate(files) if f["size"] <= store.part_size]
+		uploaded = run_in_parallel(upload, small, jobs=jobs)
+		for i in set(range(len(files))) - set(small):
+			uploaded[i] = upload(i)
+
+		store.put_json(store.key("manifests", f"{run_id}.json"), manifest)
+		set_pushed_run(run_id, bench_path)
+		pushed_run_ids.append(run_id)
+		log(
+			f"Pushed backup run {run_id}: {sum(uploaded.values())} files uploaded,"
+			f" {len(files) - sum(uploaded.values())} already there",
+			level=1,
+		)
+
+	removed = store.prune(keep)
+	if removed:
+		log(f"Pruned {len(removed)} old backup runs from the bucket", no_log=True)
+
+	return pushed_run_ids
+
+
+def pull_backups(
+	bench_path=".",
+	run_id: str = None,
+	sites: List[str] = None,
+	target: str = None,
+	jobs: int = None,
+	store: S3BackupStore = None,
+) -> List[str]:
+	"""Downloads backups of the run (the latest if not given) into the sites' backup
+	folders or target, verifying them against the run's manifest. Returns the paths
+	of the downloaded files."""
+	from bench.utils.backup import get_site_backups_path
+
+	store = store or get_backup_store(bench_path, jobs=jobs)
+	run_id = run_id or (store.get_run_ids() or [None])[-1]
+	if not run_id:
+		raise ValidationError("No backups in the bucket yet")
+
+	manifest = store.get_manifest(run_id)
+	missing = set(sites or []) - set(manifest["sites"])
+	if missing:
+		raise ValidationError(f"Run {run_id} has no backups of {', '.join(missing)}")
+
+	paths = []
+	for site, result in manifest["sites"].items():
+		if sites and site not in sites:
+			continue
+		for f in result.get("files", []):
+			if not f.get("key"):
+				continue
+			path = os.path.join(
+				os.path.join(target, site) if target else get_site_backups_path(site, bench_path),
+				os.path.basename(f["path"]),
+			)
+			click.secho(f"Pulling {os.path.basename(path)}", fg="yellow")
+			store.download(f["key"], path, f["size"], f["sha256"])
+			paths.append(path)
+
+	log(f"Pulled {len(paths)} files of backup run {run_id}", level=1)
+	return paths
+
+
+def push_after_backup(manifest: Dict, bench_path="."):
+	"""Pushes the run, along with earlier runs that failed to push, if
+	backup_s3.auto_push is set. Failures are logged rather than raised, the run is
+	pushed with the next one."""
+	config = get_config(bench_path).get("backup_s3") or {}
+	if not config.get("auto_push"):
+		return
+
+	try:
+		push_backups(bench_path=bench_path)
+	except Exception:
+		logger.exception(f"Pushing backup run {manifest['id']} failed")
+		log(f"Pushing backup run {manifest['id']} failed, see logs/bench.log", level=3)
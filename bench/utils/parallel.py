@@ -0,0 +1,271 @@
+# imports - standard imports
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import (
+	ALL_COMPLETED,
+	FIRST_COMPLETED,
+	FIRST_EXCEPTION,
+	ThreadPoolExecutor,
+	wait,
+)
+from contextlib import contextmanager
+from shlex import split
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# imports - module imports
+import bench
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+_output_lock = threading.Lock()
+
+
+def get_jobs(jobs: int = None) -> int:
+	"""Returns the number of concurrent jobs to use; defaults to the CPU count"""
+	if jobs and int(jobs) > 0:
+		return int(jobs)
+	return os.cpu_count() or 1
+
+
+def run_in_parallel(
+	fn: Callable, items: Iterable, jobs: int = None, fail_fast: bool = True
+) -> Dict:
+	"""Runs `fn(item)` for every item with at most `jobs` calls running at once.
+
+	Returns a dict of item → result. If `fail_fast` is set, pending calls are
+	cancelled as soon as one of them fails and the exception is re-raised. Otherwise
+	all calls run to completion and exceptions are returned in place of results.
+	"""
+	items = list(items)
+	results = {}
+
+	if not items:
+		return results
+
+	with ThreadPoolExecutor(max_workers=min(get_jobs(jobs), len(items))) as executor:
+		futures = {executor.submit(fn, item): item for item in items}
+		done, pending = wait(
+			futures, return_when=FIRST_EXCEPTION if fail_fast else ALL_COMPLETED
+		)
+
+		for future in pending:
+			future.cancel()
+
+		for future in done:
+			item = futures[future]
+			exc = future.exception()
+			if exc and fail_fast:
+				raise exc
+			results[item] = exc or future.result()
+
+	return results
+
+
+def run_task_graph(
+	tasks: Dict[str, Tuple[Callable, Iterable[str]]], jobs: int = None, fail_fast: bool = True
+) -> Dict[str, Dict]:
+	"""Runs tasks, a dict of name → (fn, names of the tasks it depends on), calling
+	each fn once all its dependencies have succeeded & with at most `jobs` running at
+	once. Ready tasks are started in the order they're given in.
+
+	Returns a dict of name → {"status", "started", "finished", "error"} with times in
+	seconds since the graph started. A task whose dependency failed isn't started.
+	If `fail_fast` is set, no more tasks are started after the first failure, and its
+	exception is re-raised once running tasks are done.
+	"""
+	deps = {name: set(task_deps) for name, (_, task_deps) in tasks.items()}
+	for name, task_deps in deps.items():
+		unknown = task_deps - set(tasks)
+		if unknown:
+			raise ValueError(f"{name} depends on unknown tasks {', '.join(sorted(unknown))}")
+
+	ordered = set()
+	while len(ordered) < len(tasks):
+		ready = {name for name in tasks if name not in ordered and deps[name] <= ordered}
+		if not ready:
+			raise ValueError(f"Tasks {', '.join(sorted(set(tasks) - ordered))} depend on each other")
+		ordered |= ready
+
+	results = {name: {"status": "not started", "error": None} for name in tasks}
+	pending, running, errors = list(tasks), {}, []
+	jobs = get_jobs(jobs)
+	start = time.monotonic()
+
+	def run(name):
+		results[name].update({"status": "running", "started": time.monotonic() - start})
+		try:
+			tasks[name][0]()
+		finally:
+			results[name]["finished"] = time.monotonic() - start
+
+	with ThreadPoolExecutor(max_workers=jobs) as executor:
+		while True:
+			if not (fail_fast and errors):
+				for name in [
+					name
+					for name in pending
+					if all(results[dep]["status"] == "success" for dep in deps[name])
+				][: jobs - len(running)]:
+					pending.remove(name)
+					running[executor.submit(run, name)] = name
+
+			if not running:
+				break
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				name = running.pop(future)
+				exc = future.exception()
+				results[name].update({"status": "failed" if exc else "success", "error": exc})
+				if exc:
+					logger.exception(exc)
+					errors.append(exc)
+
+	if errors and fail_fast:
+		raise errors[0]
+
+	return results
+
+
+def get_critical_path(results: Dict[str, Dict], deps: Dict[str, Iterable[str]]) -> List[str]:
+	"""The chain of tasks run by run_task_graph that ended last, following each task
+	back to the dependency that finished last: the tasks that made the graph take as
+	long as it did"""
+	finished = {name: result["finished"] for name, result in results.items() if "finished" in result}
+	path, current = [], max(finished, key=finished.get, default=None)
+
+	while current:
+		path.insert(0, current)
+		current = max(
+			(dep for dep in deps[current] if dep in finished), key=finished.get, default=None
+		)
+
+	return path
+
+
+def capture_cmd(
+	cmd, cwd=".", env=None, log_file=None, append=False, prefix=None
+) -> Tuple[int, str]:
+	"""Runs `cmd` without attaching it to the terminal, so that concurrent commands
+	don't interleave their output. Output is written (or appended) to `log_file` if
+	given and returned as a string otherwise. If `prefix` is set, output lines are
+	also echoed as they arrive, prefixed so that concurrent commands can be told apart.
+
+	Returns a tuple of (return code, output).
+	"""
+	if env:
+		env = {**os.environ, **env}
+
+	cwd_info = f"cd {cwd} && " if cwd != "." else ""
+	logger.debug(f"{cwd_info}{cmd}")
+
+	if prefix:
+		return_code, output = _stream_cmd(cmd, cwd, env, prefix, log_file, append)
+	elif log_file:
+		os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+		with open(log_file, "a" if append else "w") as f:
+			return_code = subprocess.call(
+				split(cmd), cwd=cwd, env=env, stdout=f, stderr=subprocess.STDOUT
+			)
+		output = ""
+	else:
+		p = subprocess.run(
+			split(cmd),
+			cwd=cwd,
+			env=env,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT,
+			universal_newlines=True,
+		)
+		return_code, output = p.returncode, p.stdout
+
+	if return_code:
+		logger.warning(f"{cwd_info}{cmd} executed with exit code {return_code}")
+
+	return return_code, output
+
+
+def _stream_cmd(cmd, cwd, env, prefix, log_file=None, append=False):
+	import click
+
+	lines = []
+	log = None
+
+	if log_file:
+		os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+		log = open(log_file, "a" if append else "w")
+
+	p = subprocess.Popen(
+		split(cmd),
+		cwd=cwd,
+		env=env,
+		stdout=subprocess.PIPE,
+		stderr=subprocess.STDOUT,
+		universal_newlines=True,
+	)
+
+	for line in p.stdout:
+		with _output_lock:
+			click.echo(f"{click.style(prefix, fg='cyan')} | {line}", nl=False)
+		if log:
+			log.write(line)
+		else:
+			lines.append(line)
+
+	if log:
+		log.close()
+
+	return p.wait(), "".join(lines)
+
+
+def get_available_memory() -> int:
+	"""Memory (in MB) available for new processes without swapping, or None if it
+	can't be determined"""
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) // 1024
+	except OSError:
+		pass
+
+	try:
+		return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+	except (ValueError, OSError):
+		return None
+
+
+class MemoryGate:
+	"""Admits jobs only while at least `memory_per_job` MB of memory is available.
+	A job is always admitted when none are running, so that progress is guaranteed.
+
+	gate = MemoryGate(memory_per_job=1024)
+	with gate.admit():
+		run_memory_hungry_job()
+	"""
+
+	def __init__(self, memory_per_job: int, poll_interval: float = 2):
+		self.memory_per_job = memory_per_job
+		self.poll_interval = poll_interval
+		self.running = 0
+		self.condition = threading.Condition()
+
+	def has_memory(self) -> bool:
+		available = get_available_memory()
+		return available is None or available >= self.memory_per_job
+
+	@contextmanager
+	def admit(self):
+		with self.condition:
+			while self.running and not self.has_memory():
+				self.condition.wait(timeout=self.poll_interval)
+			self.running += 1
+
+		try:
+			yield
+		finally:
+			with self.condition:
+				self.running -= 1
+				self.condition.notify_all()
@@ -0,0 +1,388 @@
+# imports - standard imports
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.config.common_site_config import get_config, update_config
+from bench.exceptions import ValidationError
+from bench.utils import exec_cmd, get_cmd_output, log
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# releases are complete sets of apps, env & assets under releases/<id>; the bench's
+# own paths are symlinks to the active release's
+RELEASES_DIR = "releases"
+RELEASE_FILE = "release.json"
+RELEASE_LINKS = ("apps", "env", os.path.join("sites", "assets"))
+# paths of a release that are shared with the bench
+SHARED_LINKS = ("config", "logs", ".cache", os.path.join("sites", "common_site_config.json"))
+DEFAULT_RELEASES_KEEP = 3
+
+
+def get_releases_path(bench_path=".") -> str:
+	return os.path.join(os.path.abspath(bench_path), RELEASES_DIR)
+
+
+def get_release_path(release_id: str, bench_path=".") -> str:
+	return os.path.join(get_releases_path(bench_path), release_id)
+
+
+def new_release_id(bench_path=".") -> str:
+	"""A timestamp, so that ids sort in the order releases were made"""
+	release_id = base_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+	suffix = 0
+	while os.path.lexists(get_release_path(release_id, bench_path)):
+		suffix += 1
+		release_id = f"{base_id}-{suffix}"
+
+	return release_id
+
+
+def read_release(release_id: str, bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(get_release_path(release_id, bench_path), RELEASE_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+
+def write_release(release: Dict, bench_path="."):
+	release_file = os.path.join(get_release_path(release["id"], bench_path), RELEASE_FILE)
+
+	with open(f"{release_file}.tmp", "w") as f:
+		json.dump(release, f, indent=1)
+	os.replace(f"{release_file}.tmp", release_file)
+
+
+def get_releases(bench_path=".") -> List[Dict]:
+	"""Releases that were built completely, oldest first"""
+	releases_path = get_releases_path(bench_path)
+	if not os.path.isdir(releases_path):
+		return []
+
+	releases = (read_release(release_id, bench_path) for release_id in os.listdir(releases_path))
+	return sorted((r for r in releases if r), key=lambda r: r["id"])
+
+
+def get_active_release(bench_path=".") -> str:
+	"""Id of the release the bench's apps link to, or None if it isn't managed through
+	releases"""
+	apps_path = os.path.join(bench_path, "apps")
+	if not os.path.islink(apps_path):
+		return None
+
+	return os.path.basename(os.path.dirname(os.path.normpath(os.readlink(apps_path))))
+
+
+def get_app_commits(apps: List[str], path: str) -> Dict[str, str]:
+	commits = {}
+	for app in apps:
+		try:
+			commits[app] = get_cmd_output("git rev-parse HEAD", cwd=os.path.join(path, "apps", app))
+		except Exception:
+			commits[app] = None
+	return commits
+
+
+def link(target: str, path: str):
+	"""Points the symlink at path to target atomically, replacing whatever is there"""
+	tmp = f"{path}.new"
+	if os.path.lexists(tmp):
+		os.remove(tmp)
+
+	os.symlink(os.path.relpath(target, os.path.dirname(path)), tmp)
+	os.replace(tmp, path)
+
+
+def build_release(bench_path=".", python: str = None, jobs: int = None) -> str:
+	"""Assembles a new release next to the live bench, without touching it: apps are
+	copied from the active ones & fast-forwarded to their remote branches, installed
+	in a fresh env and their assets are built. Sites are shared with the bench.
+
+	A bench that isn't managed through releases yet is converted first, which moves
+	its apps, env & assets into a release of their own without changing what runs.
+	Returns the release's id."""
+	from bench.bench import Bench
+	from bench.utils.assets import build_assets
+	from bench.utils.fs import copy_tree, is_immutable_git_object
+	from bench.utils.node import install_node_packages, is_store_linked
+	from bench.utils.parallel import run_in_parallel
+	from bench.utils.update import get_update_target
+
+	bench_path = os.path.abspath(bench_path)
+	if not get_active_release(bench_path):
+		convert_to_releases(bench_path)
+
+	bench = Bench(bench_path)
+	apps = ["frappe"] + [app for app in bench.apps if app != "frappe"]
+	python = python or get_base_python(os.path.join(bench_path, "env"))
+
+	release_id = new_release_id(bench_path)
+	release_path = get_release_path(release_id, bench_path)
+	os.makedirs(release_path)
+
+	try:
+		log(f"Building release {release_id}", level=1)
+		copy_tree(
+			os.path.realpath(os.path.join(bench_path, "apps")),
+			os.path.join(release_path, "apps"),
+			jobs=jobs,
+			link=lambda path: is_immutable_git_object(path) or is_store_linked(path),
+		)
+
+		def fast_forward(app):
+			if app in bench.excluded_apps:
+				return
+			target = get_update_target(app, bench_path=release_path)
+			if target and target["head"] != target["target"]:
+				exec_cmd(
+					f"git merge --ff-only {target['target']}",
+					cwd=os.path.join(release_path, "apps", app),
+				)
+
+		run_in_parallel(fast_forward, apps, jobs=jobs)
+
+		os.makedirs(os.path.join(release_path, "sites", "assets"))
+		for name in ("apps.txt", "apps.json", "excluded_apps.txt"):
+			if os.path.exists(os.path.join(bench_path, "sites", name)):
+				shutil.copy2(
+					os.path.join(bench_path, "sites", name), os.path.join(release_path, "sites", name)
+				)
+		for name in SHARED_LINKS:
+			if os.path.exists(os.path.join(bench_path, name)):
+				link(os.path.join(bench_path, name), os.path.join(release_path, name))
+
+		build_release_env(release_path, apps, python, jobs=jobs)
+		install_node_packages(bench_path=release_path, apps=apps, jobs=jobs)
+		build_assets(bench_path=release_path, jobs=jobs)
+	except BaseException:
+		logger.warning(f"Building release {release_id} failed", exc_info=True)
+		shutil.rmtree(release_path, ignore_errors=True)
+		raise
+
+	# written last, a release without it is incomplete
+	write_release(
+		{
+			"id": release_id,
+			"created_at": datetime.now().isoformat(),
+			"python": python,
+			"apps": get_app_commits(apps, release_path),
+		},
+		bench_path=bench_path,
+	)
+	log(f"Built release {release_id}. Run `bench release activate` to switch to it", level=1)
+	return release_id
+
+
+def get_base_python(env_path: str) -> str:
+	"""The interpreter the env was created from. The env's own bin/python won't do
+	for new envs: the env may be a release's, and links into it break once another
+	release is active."""
+	config = {}
+	try:
+		with open(os.path.join(env_path, "pyvenv.cfg")) as f:
+			for line in f:
+				key, _, value = line.partition("=")
+				config[key.strip()] = value.strip()
+	except OSError:
+		pass
+
+	# written by Python 3.11+ & virtualenv respectively
+	for key in ("executable", "base-executable"):
+		if config.get(key) and os.path.exists(config[key]):
+			return config[key]
+
+	python = os.path.realpath(os.path.join(env_path, "bin", "python"))
+	if config.get("home"):
+		home_python = os.path.join(config["home"], os.path.basename(python))
+		if os.path.exists(home_python):
+			return home_python
+
+	return python
+
+
+def build_release_env(release_path: str, apps: List[str], python: str, jobs: int = None):
+	"""Creates the release's env with its apps installed in editable mode"""
+	import bench.cli
+	from bench.utils.bench import validate_env_imports
+
+	quiet_flag = "" if bench.cli.verbose else "--quiet"
+	env_path = os.path.join(release_path, "env")
+	env_python = os.path.join(env_path, "bin", "python")
+
+	exec_cmd(f"{python} -m venv {env_path}")
+	exec_cmd(f"{env_python} -m pip install --quiet --upgrade pip wheel")
+
+	# one resolve for all apps, frappe first
+	app_paths = " ".join(f"-e {os.path.join(release_path, 'apps', app)}" for app in apps)
+	exec_cmd(f"{env_python} -m pip install {quiet_flag} --upgrade {app_paths}")
+
+	validate_env_imports(env_path, apps, jobs=jobs)
+
+
+def convert_to_releases(bench_path="."):
+	"""Moves the bench's apps, env & assets into its first release & links them back.
+	Paths pointing into the bench's apps & env are repointed into the release, so that
+	this release keeps working once another one is active."""
+	from bench.bench import Bench
+	from bench.utils.bench import get_env_cmd, relocate_env
+
+	bench_path = os.path.abspath(bench_path)
+	release_id = new_release_id(bench_path)
+	release_path = get_release_path(release_id, bench_path)
+	apps = list(Bench(bench_path).apps)
+
+	log(f"Moving apps, env & assets into release {release_id}", level=1)
+	for name in RELEASE_LINKS:
+		target = os.path.join(release_path, name)
+		os.makedirs(os.path.dirname(target), exist_ok=True)
+		os.rename(os.path.join(bench_path, name), target)
+		link(target, os.path.join(bench_path, name))
+
+	relocate_env(os.path.join(bench_path, "env"), os.path.join(release_path, "env"))
+	repoint_paths(
+		release_path, os.path.join(bench_path, "apps"), os.path.join(release_path, "apps")
+	)
+	get_env_cmd.cache_clear()
+
+	write_release(
+		{
+			"id": release_id,
+			"created_at": datetime.now().isoformat(),
+			"activated_at": datetime.now().isoformat(),
+			"apps": get_app_commits(apps, release_path),
+		},
+		bench_path=bench_path,
+	)
+	update_config({"release_bench": True}, bench_path=bench_path)
+	return release_id
+
+
+def repoint_paths(release_path: str, source: str, target: str):
+	"""Rewrites references to source in the release env's editable install records &
+	the release's asset symlinks to target"""
+	from glob import glob
+
+	site_packages = os.path.join(release_path, "env", "lib", "python*", "site-packages")
+	records = [
+		path
+		for pattern in ("*.pth", "*.egg-link", "__editable__*", "*.dist-info/direct_url.json")
+		for path in glob(os.path.join(site_packages, pattern))
+		if os.path.isfile(path)
+	]
+	source_bytes, target_bytes = os.fsencode(source), os.fsencode(target)
+
+	for path in records:
+		with open(path, "rb") as f:
+			contents = f.read()
+		if source_bytes in contents:
+			with open(path, "wb") as f:
+				f.write(contents.replace(source_bytes + b"/", target_bytes + b"/"))
+
+	for path in glob(os.path.join(release_path, "sites", "assets", "*")):
+		if os.path.islink(path) and os.readlink(path).startswith(source + os.sep):
+			link(target + os.readlink(path)[len(source) :], path)
+
+
+def activate_release(
+	release_id: str = None,
+	bench_path=".",
+	migrate: bool = True,
+	jobs: int = None,
+	site_maintenance: bool = False,
+	restart_supervisor: bool = False,
+	restart_systemd: bool = False,
+):
+	"""Migrates sites with the release's apps & env, then switches the bench's apps,
+	env & assets over to the release and reloads processes. The latest release is
+	activated if none is given.
+
+	Activating an older release rolls back to it without migrating, as migrating
+	with older code doesn't undo schema changes; restore backups for that. A bench
+	not managed by releases yet has its apps, env & assets moved into a release of
+	their own first."""
+	from bench.bench import Bench
+	from bench.utils.bench import clear_redis_cache, get_env_cmd, patch_sites
+
+	bench_path = os.path.abspath(bench_path)
+	releases = {release["id"]: release for release in get_releases(bench_path)}
+	release_id = release_id or (releases and max(releases))
+
+	if not release_id or release_id not in releases:
+		raise ValidationError(
+			f"Release {release_id} not found" if release_id else "No release built yet"
+		)
+
+	active = get_active_release(bench_path)
+	if release_id == active:
+		log(f"Release {release_id} is already active", level=1)
+		return
+
+	# benches not managed by releases yet have nothing older to roll back to
+	if migrate and active and release_id < active:
+		log(f"Rolling back to release {release_id}, sites won't be migrated", level=3)
+		migrate = False
+
+	release_path = get_release_path(release_id, bench_path)
+	conf = Bench(bench_path).conf
+
+	if migrate and not site_maintenance:
+		conf.update({"maintenance_mode": 1, "pause_scheduler": 1})
+		update_config(conf, bench_path=bench_path)
+
+	if migrate:
+		# a failed migration leaves the active release live
+		patch_sites(
+			bench_path=bench_path,
+			jobs=jobs,
+			site_maintenance=site_maintenance,
+			code_path=release_path,
+		)
+
+	if not active:
+		# keeps the bench's own apps, env & assets as a release to go back to
+		convert_to_releases(bench_path)
+
+	for name in RELEASE_LINKS:
+		link(os.path.join(release_path, name), os.path.join(bench_path, name))
+	get_env_cmd.cache_clear()
+
+	releases[release_id]["activated_at"] = datetime.now().isoformat()
+	write_release(releases[release_id], bench_path=bench_path)
+
+	bench = Bench(bench_path)
+	clear_redis_cache(bench)
+	bench.reload(
+		web=False, supervisor=restart_supervisor, systemd=restart_systemd, _raise=False
+	)
+
+	if migrate and not site_maintenance:
+		conf.update({"maintenance_mode": 0, "pause_scheduler": 0})
+		update_config(conf, bench_path=bench_path)
+
+	log(f"Activated release {release_id}, previously {active}", level=1)
+	prune_releases(bench_path=bench_path)
+
+
+def prune_releases(bench_path=".", keep: int = None) -> List[str]:
+	"""Removes all but the `keep` latest releases (release_keep in
+	common_site_config.json, or 3). The active release is never removed."""
+	keep = keep or get_config(bench_path).get("release_keep") or DEFAULT_RELEASES_KEEP
+	active = get_active_release(bench_path)
+	releases = [release["id"] for release in get_releases(bench_path)]
+
+	removed = [release_id for release_id in releases[:-keep] if release_id != active]
+	for release_id in removed:
+		click.secho(f"Removing release {release_id}", fg="yellow")
+		shutil.rmtree(get_release_path(release_id, bench_path))
+
+	return removed
@@ -0,0 +1,440 @@
+# imports - standard imports
+import gzip
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.config.common_site_config import get_config
+from bench.config.site_config import get_site_config
+from bench.exceptions import CommandFailedError, ValidationError
+from bench.utils import log, which
+
+# split backups: a directory per dump, restored with `bench restore-parallel`
+#
+# 	manifest.json		tables, their row files, sizes & deferred indexes
+# 	header.sql			the dump's session settings, run before every other part
+# 	schema.sql			tables without their secondary indexes
+# 	tables/<n>.sql.gz	rows of each table
+# 	post.sql			views, triggers & routines
+SPLIT_FORMAT = 1
+SPLIT_SUFFIX = ".split"
+SPLIT_MANIFEST = "manifest.json"
+DUMP_EXTENSIONS = (".sql.gz", ".sql.zst", ".sql")
+# row files are written once & read once; favour speed over size
+SPLIT_COMPRESSLEVEL = 1
+READ_SIZE = 1024 * 1024
+
+CREATE_TABLE = re.compile(rb"^CREATE TABLE `((?:[^`]|``)+)` \(")
+INSERT_INTO = re.compile(rb"^INSERT INTO `((?:[^`]|``)+)`")
+# mysqldump's per table noise, redone by the restore itself
+SKIPPED_LINE = re.compile(
+	rb"^(--|\s*$|DROP TABLE IF EXISTS `|LOCK TABLES `|UNLOCK TABLES;"
+	rb"|/\*!40000 ALTER TABLE `|/\*!40101 SET (@saved_cs_client|character_set_client = ))"
+)
+# lines before the first table that are kept in header.sql, the rest go to post.sql
+SESSION_SETTING = re.compile(rb"^(/\*!\d+ SET |SET |/\*M!)")
+DEFERRED_KEYS = (b"KEY ", b"UNIQUE KEY ", b"FULLTEXT KEY ", b"SPATIAL KEY ")
+
+CLIENT_PROGRAMS = ("mariadb", "mysql")
+DUMP_PROGRAMS = ("mariadb-dump", "mysqldump")
+
+# session settings while loading rows; the dump is consistent so checks are skipped
+LOAD_PREAMBLE = b"SET FOREIGN_KEY_CHECKS=0;\nSET UNIQUE_CHECKS=0;\nSET autocommit=0;\n"
+LOAD_POSTAMBLE = b"\nCOMMIT;\n"
+
+
+def get_split_path(dump_path: str) -> str:
+	for extension in DUMP_EXTENSIONS:
+		if dump_path.endswith(extension):
+			return dump_path[: -len(extension)] + SPLIT_SUFFIX
+	raise ValidationError(f"{dump_path} isn't a database backup ({', '.join(DUMP_EXTENSIONS)})")
+
+
+def quote_name(name: str) -> str:
+	return "`{}`".format(name.replace("`", "``"))
+
+
+def unquote_name(name: bytes) -> str:
+	return name.replace(b"``", b"`").decode("utf-8", "surrogateescape")
+
+
+@contextmanager
+def open_dump(path: str):
+	"""Opens a database backup for streaming reads, decompressing it on the way"""
+	if path.endswith(".sql.gz"):
+		with gzip.open(path, "rb") as f:
+			yield f
+	elif path.endswith(".sql.zst"):
+		if not which("zstd"):
+			raise ValidationError("zstd is needed to read zstd compressed backups")
+		process = subprocess.Popen(["zstd", "-dc", path], stdout=subprocess.PIPE)
+		try:
+			yield process.stdout
+		finally:
+			process.stdout.close()
+			if process.wait():
+				raise CommandFailedError(f"Couldn't decompress {path}")
+	else:
+		with open(path, "rb") as f:
+			yield f
+
+
+def split_table_schema(lines: List[bytes]):
+	"""Splits a dumped CREATE TABLE into the statement without secondary indexes, the
+	indexes & the foreign keys"""
+	head, *body, tail = lines
+	definitions, keys, foreign_keys = [], [], []
+
+	for line in body:
+		definition = line.strip().rstrip(b",")
+		if definition.startswith(DEFERRED_KEYS):
+			keys.append(definition)
+		elif definition.startswith(b"CONSTRAINT ") and b" FOREIGN KEY " in definition:
+			foreign_keys.append(definition)
+		else:
+			definitions.append(definition)
+
+	# an auto increment column has to be the first part of some key from the start
+	if not any(d.startswith(b"PRIMARY KEY ") for d in definitions) and any(
+		b" AUTO_INCREMENT" in d for d in definitions
+	):
+		definitions, keys = definitions + keys, []
+
+	statement = head + b",\n".join(b"  " + d for d in definitions) + b"\n" + tail
+	return statement, [k.decode("utf-8", "surrogateescape") for k in keys], [
+		k.decode("utf-8", "surrogateescape") for k in foreign_keys
+	]
+
+
+def split_dump(dump_path: str, output_path: str = None) -> str:
+	"""Converts a mysqldump backup into the split format in one streaming pass.
+	Returns the split backup's path, <dump name>.split by default."""
+	output_path = output_path or get_split_path(dump_path)
+	tmp_path = f"{output_path}.tmp"
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	os.makedirs(os.path.join(tmp_path, "tables"))
+
+	tables = {}
+	create, current, rows = None, None, None
+	parts = {
+		part: open(os.path.join(tmp_path, f"{part}.sql"), "wb")
+		for part in ("header", "schema", "post")
+	}
+
+	try:
+		with open_dump(dump_path) as dump:
+			for line in dump:
+				if create is not None:
+					create.append(line)
+					if line.rstrip().endswith(b";"):
+						statement, keys, foreign_keys = split_table_schema(create)
+						name = unquote_name(CREATE_TABLE.match(create[0]).group(1))
+						parts["schema"].write(statement)
+						tables[name] = {
+							"file": f"tables/{len(tables):05d}.sql.gz",
+							"size": 0,
+							"keys": keys,
+							"foreign_keys": foreign_keys,
+						}
+						create = None
+					continue
+
+				if CREATE_TABLE.match(line):
+					create = [line]
+					continue
+
+				match = INSERT_INTO.match(line)
+				if match:
+					name = unquote_name(match.group(1))
+					if name != current:
+						if rows:
+							rows.close()
+						current = name
+						rows = gzip.open(
+							os.path.join(tmp_path, tables[name]["file"]),
+							"ab",
+							compresslevel=SPLIT_COMPRESSLEVEL,
+						)
+					rows.write(line)
+					tables[name]["size"] += len(line)
+					continue
+
+				if not SKIPPED_LINE.match(line):
+					in_header = not tables and SESSION_SETTING.match(line)
+					parts["header" if in_header else "post"].write(line)
+	finally:
+		if rows:
+			rows.close()
+		for f in parts.values():
+			f.close()
+
+	if create is not None:
+		shutil.rmtree(tmp_path)
+		raise ValidationError(f"{dump_path} is truncated")
+
+	with open(os.path.join(tmp_path, SPLIT_MANIFEST), "w") as f:
+		json.dump(
+			{"format": SPLIT_FORMAT, "source": os.path.basename(dump_path), "tables": tables},
+			f,
+			indent=1,
+		)
+
+	shutil.rmtree(output_path, ignore_errors=True)
+	os.rename(tmp_path, output_path)
+	return output_path
+
+
+def read_split_manifest(split_path: str) -> Dict:
+	try:
+		with open(os.path.join(split_path, SPLIT_MANIFEST)) as f:
+			manifest = json.load(f)
+	except (OSError, ValueError):
+		raise ValidationError(f"{split_path} isn't a split backup")
+
+	if manifest.get("format") != SPLIT_FORMAT:
+		raise ValidationError(f"{split_path} is in an unsupported split format")
+
+	return manifest
+
+
+def get_db_credentials(site: str, bench_path=".") -> Dict:
+	site_config = get_site_config(site, bench_path=bench_path)
+	config = get_config(bench_path)
+
+	if not site_config.get("db_name"):
+		raise ValidationError(f"{site} doesn't have a database configured")
+	if site_config.get("db_type", "mariadb") != "mariadb":
+		raise ValidationError("Parallel restores are only supported for MariaDB sites")
+
+	return {
+		"host": site_config.get("db_host") or config.get("db_host") or "localhost",
+		"port": site_config.get("db_port") or config.get("db_port") or 3306,
+		"user": site_config.get("db_user") or site_config["db_name"],
+		"password": site_config["db_password"],
+		"database": site_config["db_name"],
+	}
+
+
+@contextmanager
+def mysql_client(credentials: Dict, programs=CLIENT_PROGRAMS):
+	"""The command to run the mysql client (or another of `programs`, like the dump
+	ones) against the database in credentials, if any, with them passed in a private
+	defaults file"""
+	executable = next(filter(None, map(which, programs)), None)
+	if not executable:
+		raise ValidationError(f"{' or '.join(programs)} is needed to run this")
+
+	fd, defaults_file = tempfile.mkstemp(prefix="bench-restore-", suffix=".cnf")
+	try:
+		with os.fdopen(fd, "w") as f:
+			f.write("[client]\n")
+			for key in ("host", "port", "user", "password"):
+				f.write(f"{key}={credentials[key]}\n")
+
+		yield [executable, f"--defaults-extra-file={defaults_file}"] + (
+			[credentials["database"]] if credentials.get("database") else []
+		)
+	finally:
+		os.remove(defaults_file)
+
+
+def load_sql(client: List[str], chunks: Iterable[bytes], what: str):
+	"""Streams SQL into a client session, raising if any of it fails"""
+	with tempfile.TemporaryFile() as stderr:
+		process = subprocess.Popen(
+			client, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr
+		)
+		try:
+			for chunk in chunks:
+				process.stdin.write(chunk)
+			process.stdin.close()
+		except BrokenPipeError:
+			pass
+		except BaseException:
+			process.kill()
+			process.wait()
+			raise
+
+		if process.wait():
+			stderr.seek(0)
+			raise CommandFailedError(
+				f"Restoring {what} failed: {stderr.read().decode(errors='replace').strip()}"
+			)
+
+
+def read_chunks(path: str, on_read=None) -> Iterable[bytes]:
+	opener = gzip.open if path.endswith(".gz") else open
+	with opener(path, "rb") as f:
+		for chunk in iter(lambda: f.read(READ_SIZE), b""):
+			if on_read:
+				on_read(len(chunk))
+			yield chunk
+
+
+class RestoreProgress:
+	"""Prints how much of the rows have been loaded, every 5% & as tables finish"""
+
+	def __init__(self, tables: Dict):
+		self.total = sum(table["size"] for table in tables.values()) or 1
+		self.tables = len(tables)
+		self.loaded = 0
+		self.loaded_tables = 0
+		self.reported = 0
+		self.started_at = time.monotonic()
+		self.lock = threading.Lock()
+
+	def advance(self, size: int):
+		with self.lock:
+			self.loaded += size
+			if self.loaded * 20 // self.total > self.reported:
+				self.reported = self.loaded * 20 // self.total
+				self.report()
+
+	def table_loaded(self):
+		with self.lock:
+			self.loaded_tables += 1
+			if self.loaded_tables == self.tables:
+				self.report()
+
+	def report(self):
+		click.echo(
+			f"Loaded {self.loaded * 100 // self.total}% of rows"
+			f" ({self.loaded_tables}/{self.tables} tables)"
+			f" in {time.monotonic() - self.started_at:.0f}s"
+		)
+
+
+def restore_parallel(site: str, backup_path: str, bench_path=".", jobs: int = None):
+	"""Restores the site's database from a split backup, or from a dump which is split
+	first, `jobs` tables at a time (restore_jobs in common_site_config.json, or the
+	CPU count). The site is in maintenance mode & the bench locked meanwhile."""
+	from bench.config.site_config import site_maintenance_mode
+	from bench.utils.lock import bench_lock
+
+	credentials = get_db_credentials(site, bench_path=bench_path)
+
+	if os.path.isdir(backup_path):
+		split_path = backup_path
+	else:
+		split_path = get_split_path(backup_path)
+		if not os.path.exists(os.path.join(split_path, SPLIT_MANIFEST)):
+			log(f"Splitting {backup_path} into tables", no_log=True)
+			split_dump(backup_path, split_path)
+
+	started_at = time.monotonic()
+	with bench_lock("restore", bench_path=bench_path), site_maintenance_mode(
+		site, bench_path=bench_path
+	):
+		with mysql_client(credentials) as client:
+			load_split_backup(client, split_path, jobs=jobs, bench_path=bench_path)
+
+	log(
+		f"Restored {site} in {time.monotonic() - started_at:.0f}s. Run `bench --site {site}"
+		" migrate` if the backup is from older versions of its apps",
+		level=1,
+	)
+
+
+def load_split_backup(client: List[str], split_path: str, jobs: int = None, bench_path="."):
+	"""Replaces what's in the client's database with the split backup. Tables are
+	created without their secondary indexes, filled concurrently, largest first, and
+	then indexed concurrently. Foreign keys, views & triggers are restored last."""
+	from bench.utils.parallel import get_jobs, run_in_parallel
+
+	jobs = get_jobs(jobs or get_config(bench_path).get("restore_jobs"))
+	tables = read_split_manifest(split_path)["tables"]
+
+	with open(os.path.join(split_path, "header.sql"), "rb") as f:
+		header = f.read()
+
+	def part(name, on_read=None):
+		return read_chunks(os.path.join(split_path, name), on_read=on_read)
+
+	log(f"Restoring {len(tables)} tables, {jobs} at a time", no_log=True)
+	load_sql(
+		client,
+		[header, b"SET FOREIGN_KEY_CHECKS=0;\n", get_drop_statements(client), *part("schema.sql")],
+		"the schema",
+	)
+
+	progress = RestoreProgress(tables)
+
+	def load_table(name):
+		load_sql(
+			client,
+			[header, LOAD_PREAMBLE, *part(tables[name]["file"], progress.advance), LOAD_POSTAMBLE],
+			f"rows of {name}",
+		)
+		progress.table_loaded()
+
+	run_in_parallel(
+		load_table, sorted(tables, key=lambda t: tables[t]["size"], reverse=True), jobs=jobs
+	)
+
+	indexed = [name for name in tables if tables[name]["keys"]]
+	log(f"Building indexes of {len(indexed)} tables", no_log=True)
+	run_in_parallel(
+		lambda name: load_sql(
+			client, [header, get_index_statements(name, tables[name]["keys"])], f"indexes of {name}"
+		),
+		indexed,
+		jobs=jobs,
+	)
+
+	foreign_keys = b"".join(
+		get_alter_statement(name, table["foreign_keys"])
+		for name, table in tables.items()
+		if table["foreign_keys"]
+	)
+	load_sql(
+		client,
+		[header, b"SET FOREIGN_KEY_CHECKS=0;\n", foreign_keys, *part("post.sql")],
+		"foreign keys, views & triggers",
+	)
+
+
+def get_index_statements(name: str, keys: List[str]) -> bytes:
+	# InnoDB builds all indexes of one ALTER in a single pass, but FULLTEXT ones have
+	# to be added one at a time
+	fulltext = [key for key in keys if key.startswith("FULLTEXT ")]
+	other = [key for key in keys if key not in fulltext]
+	groups = ([other] if other else []) + [[key] for key in fulltext]
+	return b"".join(get_alter_statement(name, group) for group in groups)
+
+
+def get_alter_statement(name: str, definitions: List[str]) -> bytes:
+	additions = ", ".join(f"ADD {definition}" for definition in definitions)
+	return f"ALTER TABLE {quote_name(name)} {additions};\n".encode("utf-8", "surrogateescape")
+
+
+def get_drop_statements(client: List[str]) -> bytes:
+	"""Drops what's in the database, like restoring into a new one would"""
+	output = subprocess.check_output(
+		[
+			*client,
+			"--batch",
+			"--raw",
+			"--skip-column-names",
+			"--execute",
+			"SELECT table_type, table_name FROM information_schema.tables WHERE table_schema = DATABASE()",
+		]
+	).decode("utf-8", "surrogateescape")
+
+	statements = []
+	for line in output.splitlines():
+		table_type, name = line.split("\t", 1)
+		kind = "VIEW" if table_type == "VIEW" else "TABLE"
+		statements.append(f"DROP {kind} IF EXISTS {quote_name(name)};\n")
+
+	return "".join(statements).encode("utf-8", "surrogateescape")
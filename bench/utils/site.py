@@ -0,0 +1,232 @@
+# imports - standard imports
+import hashlib
+import os
+import secrets
+import shutil
+import string
+import subprocess
+import tempfile
+import time
+from base64 import urlsafe_b64encode
+from contextlib import contextmanager
+from typing import Dict
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.config.common_site_config import get_config
+from bench.config.site_config import get_site_config, put_site_config
+from bench.exceptions import CommandFailedError, ValidationError
+from bench.utils import log
+
+SITE_FILE_DIRS = (os.path.join("public", "files"), os.path.join("private", "files"))
+SITE_DIRS = (*SITE_FILE_DIRS, os.path.join("private", "backups"), "locks", "logs")
+# keys of a site's site_config.json that don't carry over to sites made from it
+SITE_SPECIFIC_KEYS = (
+	"db_name",
+	"db_password",
+	"db_user",
+	"encryption_key",
+	"host_name",
+	"domains",
+	"ssl_certificate",
+	"ssl_certificate_key",
+	"nginx_port",
+	"maintenance_mode",
+	"pause_scheduler",
+	"admin_password",
+)
+# staging copies shouldn't email people or run the source's integrations
+STAGING_SITE_CONFIG = {"mute_emails": 1, "pause_scheduler": 1}
+
+
+def get_db_name(site: str) -> str:
+	# the way frappe names sites' databases
+	return "_" + hashlib.sha1(site.encode()).hexdigest()[:16]
+
+
+def new_password(length: int = 16) -> str:
+	return "".join(secrets.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def new_encryption_key() -> str:
+	# a Fernet key, like frappe generates
+	return urlsafe_b64encode(secrets.token_bytes(32)).decode()
+
+
+@contextmanager
+def new_site(
+	site: str,
+	site_config: Dict,
+	bench_path=".",
+	db_root_username: str = None,
+	db_root_password: str = None,
+):
+	"""Creates the site's directories, its site_config.json with site_config & new
+	database credentials, and its database & user with the root credentials
+	(root_login & root_password in common_site_config.json if not given). Yields the
+	client command for the new database; if the block fails, all of it is removed.
+
+	Holds the bench lock shared, so that sites can be created alongside each other
+	but not during updates."""
+	from bench.utils.lock import bench_lock
+	from bench.utils.restore import load_sql, mysql_client
+
+	site_path = os.path.join(bench_path, "sites", site)
+	if os.path.exists(site_path):
+		raise ValidationError(f"Site {site} already exists")
+
+	config = get_config(bench_path)
+	db_name = get_db_name(site)
+	db_password = new_password()
+	host = site_config.get("db_host") or config.get("db_host") or "localhost"
+	user_host = config.get("mariadb_user_host_login_scope") or (
+		"localhost" if host in ("localhost", "127.0.0.1") else "%"
+	)
+	root_credentials = {
+		"host": host,
+		"port": site_config.get("db_port") or config.get("db_port") or 3306,
+		"user": db_root_username or config.get("root_login") or "root",
+		"password": db_root_password or config.get("root_password") or "",
+	}
+	created_db = False
+
+	lock = bench_lock("new site", bench_path=bench_path, shared=True)
+	with lock, mysql_client(root_credentials) as root_client:
+		try:
+			for site_dir in SITE_DIRS:
+				os.makedirs(os.path.join(site_path, site_dir), exist_ok=True)
+			put_site_config(
+				site,
+				{**site_config, "db_name": db_name, "db_password": db_password, "db_type": "mariadb"},
+				bench_path=bench_path,
+			)
+
+			load_sql(
+				root_client,
+				[f"CREATE DATABASE `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;\n".encode()],
+				f"the database of {site}",
+			)
+			created_db = True
+			load_sql(
+				root_client,
+				[
+					f"CREATE USER '{db_name}'@'{user_host}' IDENTIFIED BY '{db_password}';\n"
+					f"GRANT ALL PRIVILEGES ON `{db_name}`.* TO '{db_name}'@'{user_host}';\n"
+					"FLUSH PRIVILEGES;\n".encode()
+				],
+				f"the database user of {site}",
+			)
+
+			with mysql_client({**root_credentials, "database": db_name}) as client:
+				yield client
+		except BaseException:
+			if created_db:
+				load_sql(
+					root_client,
+					[
+						f"DROP DATABASE IF EXISTS `{db_name}`;\n"
+						f"DROP USER IF EXISTS '{db_name}'@'{user_host}';\n".encode()
+					],
+					f"the database of {site}",
+				)
+			shutil.rmtree(site_path, ignore_errors=True)
+			raise
+
+
+def clone_site(
+	source: str,
+	site: str,
+	bench_path=".",
+	db_root_username: str = None,
+	db_root_password: str = None,
+	hardlink_files: bool = False,
+	as_is: bool = False,
+):
+	"""Copies the source site into a new one, e.g. for staging. The source's database
+	is dumped in a single transaction & piped straight into the new one; its files
+	are reflinked where the filesystem supports it, or hardlinked if
+	`hardlink_files` is set (only safe if neither site's files are edited in place).
+
+	The new site keeps the source's config & encryption key but gets its own
+	database credentials. Unless `as_is` is set, its emails are muted & scheduler
+	paused."""
+	from bench.utils.fs import copy_tree
+	from bench.utils.restore import DUMP_PROGRAMS, get_db_credentials, load_sql, mysql_client
+
+	source_credentials = get_db_credentials(source, bench_path=bench_path)
+	source_config = get_site_config(source, bench_path=bench_path)
+	site_config = {
+		**{k: v for k, v in source_config.items() if k not in SITE_SPECIFIC_KEYS},
+		"encryption_key": source_config.get("encryption_key") or new_encryption_key(),
+		**({} if as_is else STAGING_SITE_CONFIG),
+	}
+	started_at = time.monotonic()
+
+	with new_site(
+		site,
+		site_config,
+		bench_path=bench_path,
+		db_root_username=db_root_username,
+		db_root_password=db_root_password,
+	) as client, mysql_client(source_credentials, programs=DUMP_PROGRAMS) as dump:
+		click.secho(f"Copying the database of {source}", fg="yellow")
+		with tempfile.TemporaryFile() as stderr:
+			dump_process = subprocess.Popen(
+				[
+					*dump,
+					"--single-transaction",
+					"--quick",
+					"--skip-lock-tables",
+					"--no-autocommit",
+					"--routines",
+					"--triggers",
+				],
+				stdout=subprocess.PIPE,
+				stderr=stderr,
+			)
+			try:
+				load_sql(
+					client,
+					iter(lambda: dump_process.stdout.read(1024 * 1024), b""),
+					f"the database of {site}",
+				)
+			except BaseException:
+				dump_process.kill()
+				dump_process.wait()
+				raise
+
+			dump_process.stdout.close()
+			if dump_process.wait():
+				stderr.seek(0)
+				raise CommandFailedError(
+					f"Dumping {source} failed: {stderr.read().decode(errors='replace').strip()}"
+				)
+
+		click.secho(f"Copying files of {source}", fg="yellow")
+		for files_dir in SITE_FILE_DIRS:
+			path = os.path.join(bench_path, "sites", source, files_dir)
+			if os.path.isdir(path):
+				copy_tree(
+					path,
+					os.path.join(bench_path, "sites", site, files_dir),
+					link=(lambda _: True) if hardlink_files else None,
+				)
+
+	update_nginx_conf(bench_path)
+	log(f"Cloned {source} into {site} in {time.monotonic() - started_at:.0f}s", level=1)
+
+
+def update_nginx_conf(bench_path="."):
+	"""Regenerates nginx.conf of benches set up for production, reloading nginx only
+	if it changed"""
+	from bench.config.nginx import make_nginx_conf
+	from bench.config.production_setup import reload_nginx
+
+	if not os.path.exists(os.path.join(bench_path, "config", "nginx.conf")):
+		return
+
+	if make_nginx_conf(bench_path=bench_path, yes=True):
+		click.secho("Reloading nginx", fg="yellow")
+		reload_nginx()
@@ -0,0 +1,206 @@
+# imports - standard imports
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, List
+
+# imports - module imports
+from bench.config.common_site_config import get_config
+from bench.config.site_config import get_site_config
+from bench.exceptions import ValidationError
+from bench.utils import log, run_frappe_cmd
+from bench.utils.site import SITE_FILE_DIRS, SITE_SPECIFIC_KEYS
+
+# templates live in <bench>/site-templates/<name>/
+#
+# 	template.json		source site, apps' commits & sanitized site config
+# 	database.split		the site's database in the split format, see bench.utils.restore
+# 	files/				the site's public/files & private/files
+SITE_TEMPLATES_DIR = "site-templates"
+TEMPLATE_FILE = "template.json"
+# emptied in templates: sessions, logs, queues & secrets (passwords, api secrets &
+# encrypted fields, which new sites couldn't decrypt anyway)
+SANITIZED_TABLES = (
+	"__Auth",
+	"tabSessions",
+	"tabError Log",
+	"tabActivity Log",
+	"tabAccess Log",
+	"tabRoute History",
+	"tabScheduled Job Log",
+	"tabEmail Queue",
+	"tabEmail Queue Recipient",
+	"tabOAuth Bearer Token",
+	"tabOAuth Authorization Code",
+)
+
+
+def get_site_templates_path(bench_path=".") -> str:
+	return os.path.join(bench_path, SITE_TEMPLATES_DIR)
+
+
+def get_site_template_path(name: str, bench_path=".") -> str:
+	if not re.match(r"^[\w.-]+$", name):
+		raise ValidationError(f"{name} isn't a valid template name")
+	return os.path.join(get_site_templates_path(bench_path), name)
+
+
+def read_site_template(name: str, bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(get_site_template_path(name, bench_path), TEMPLATE_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		raise ValidationError(f"Site template {name} not found")
+
+
+def get_site_templates(bench_path=".") -> List[Dict]:
+	path = get_site_templates_path(bench_path)
+	return [
+		read_site_template(name, bench_path)
+		for name in sorted(os.listdir(path) if os.path.isdir(path) else [])
+		if os.path.exists(os.path.join(path, name, TEMPLATE_FILE))
+	]
+
+
+def sanitize_split_backup(split_path: str, tables=SANITIZED_TABLES):
+	"""Empties the given tables of a split backup, keeping their schema"""
+	from bench.utils.restore import SPLIT_MANIFEST, read_split_manifest
+
+	manifest = read_split_manifest(split_path)
+	for name in set(tables) & set(manifest["tables"]):
+		with gzip.open(os.path.join(split_path, manifest["tables"][name]["file"]), "wb"):
+			pass
+		manifest["tables"][name]["size"] = 0
+
+	with open(os.path.join(split_path, SPLIT_MANIFEST), "w") as f:
+		json.dump(manifest, f, indent=1)
+
+
+def create_site_template(name: str, site: str, bench_path=".") -> Dict:
+	"""Captures the site's database & files as a template for new sites. The database
+	is backed up & split; sessions, logs & secrets (SANITIZED_TABLES & tables in
+	site_template_sanitized_tables of common_site_config.json) are left out."""
+	from bench.bench import Bench
+	from bench.utils.backup import run_site_backup
+	from bench.utils.fs import copy_tree
+	from bench.utils.lock import bench_lock
+	from bench.utils.release import get_app_commits
+	from bench.utils.restore import DUMP_EXTENSIONS, split_dump
+
+	path = get_site_template_path(name, bench_path)
+	tmp_path = f"{path}.tmp"
+	if site not in Bench(bench_path).sites:
+		raise ValidationError(f"Site {site} doesn't exist")
+
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	os.makedirs(tmp_path)
+
+	with bench_lock("site template", bench_path=bench_path, shared=True):
+		result = run_site_backup(site, bench_path=bench_path)
+
+	try:
+		database = next(
+			(f["path"] for f in result["files"] if f["path"].endswith(DUMP_EXTENSIONS)), None
+		)
+		if result["status"] != "success" or not database:
+			raise ValidationError(f"Backing up {site} failed, see {result['log_file']}")
+
+		split_path = split_dump(database, os.path.join(tmp_path, "database.split"))
+	finally:
+		for f in result["files"]:
+			os.remove(f["path"])
+
+	sanitize_split_backup(
+		split_path,
+		SANITIZED_TABLES + tuple(get_config(bench_path).get("site_template_sanitized_tables") or ()),
+	)
+
+	for files_dir in SITE_FILE_DIRS:
+		source = os.path.join(bench_path, "sites", site, files_dir)
+		if os.path.isdir(source):
+			copy_tree(source, os.path.join(tmp_path, "files", files_dir), link=None)
+
+	site_config = get_site_config(site, bench_path=bench_path)
+	template = {
+		"name": name,
+		"site": site,
+		"created_at": datetime.now().isoformat(),
+		"apps": get_app_commits(Bench(bench_path).apps, bench_path),
+		"site_config": {k: v for k, v in site_config.items() if k not in SITE_SPECIFIC_KEYS},
+	}
+	with open(os.path.join(tmp_path, TEMPLATE_FILE), "w") as f:
+		json.dump(template, f, indent=1)
+
+	shutil.rmtree(path, ignore_errors=True)
+	os.rename(tmp_path, path)
+	log(f"Created site template {name} from {site}", level=1)
+	return template
+
+
+def remove_site_template(name: str, bench_path="."):
+	read_site_template(name, bench_path)
+	shutil.rmtree(get_site_template_path(name, bench_path))
+
+
+def new_site_from_template(
+	site: str,
+	template_name: str,
+	admin_password: str,
+	bench_path=".",
+	db_root_username: str = None,
+	db_root_password: str = None,
+	jobs: int = None,
+):
+	"""Creates a site from a template: a new database & user are created with the
+	root credentials (root_login & root_password in common_site_config.json if not
+	given), the template's database is loaded into it concurrently & its files are
+	copied. The site gets its own encryption key & administrator password. It's
+	migrated if apps have changed since the template was made, and nginx.conf is
+	regenerated for benches set up for production."""
+	from bench.bench import Bench
+	from bench.utils.fs import copy_tree
+	from bench.utils.release import get_app_commits
+	from bench.utils.restore import load_split_backup
+	from bench.utils.site import new_encryption_key, new_site, update_nginx_conf
+
+	template = read_site_template(template_name, bench_path)
+	template_path = get_site_template_path(template_name, bench_path)
+
+	apps = get_app_commits(Bench(bench_path).apps, bench_path)
+	missing = set(template["apps"]) - set(apps)
+	if missing:
+		raise ValidationError(f"{template_name} needs apps this bench doesn't have: {', '.join(missing)}")
+	needs_migrate = any(apps[app] != commit for app, commit in template["apps"].items())
+
+	started_at = time.monotonic()
+	site_config = {**template["site_config"], "encryption_key": new_encryption_key()}
+
+	with new_site(
+		site,
+		site_config,
+		bench_path=bench_path,
+		db_root_username=db_root_username,
+		db_root_password=db_root_password,
+	) as client:
+		load_split_backup(
+			client, os.path.join(template_path, "database.split"), jobs=jobs, bench_path=bench_path
+		)
+
+		for files_dir in SITE_FILE_DIRS:
+			source = os.path.join(template_path, "files", files_dir)
+			if os.path.isdir(source):
+				copy_tree(source, os.path.join(bench_path, "sites", site, files_dir), link=None)
+
+		run_frappe_cmd(
+			"--site", site, "set-admin-password", admin_password, bench_path=bench_path, _raise=True
+		)
+		if needs_migrate:
+			log(f"Apps have changed since {template_name} was made, migrating {site}", level=3)
+			run_frappe_cmd("--site", site, "migrate", bench_path=bench_path, _raise=True)
+
+	update_nginx_conf(bench_path)
+	log(f"Created {site} from {template_name} in {time.monotonic() - started_at:.0f}s", level=1)
@@ -0,0 +1,252 @@
+# imports - standard imports
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.config.common_site_config import get_config, update_config
+from bench.exceptions import CommandFailedError, ValidationError
+from bench.utils import get_cmd_output, log
+
+# snapshots taken by `bench update --snapshot`, restored by `bench rollback`
+#
+# 	snapshots/<id>/snapshot.json	apps' branches & commits, sites' backups
+# 	snapshots/<id>/env				copy of the env
+# 	snapshots/<id>/assets			copy of sites/assets
+# 	snapshots/<id>/sites/<site>/	the site's database backup & migrated record
+SNAPSHOTS_DIR = "snapshots"
+SNAPSHOT_FILE = "snapshot.json"
+DEFAULT_SNAPSHOT_KEEP = 2
+
+
+def get_snapshots_path(bench_path=".") -> str:
+	return os.path.join(bench_path, SNAPSHOTS_DIR)
+
+
+def get_snapshot_path(snapshot_id: str, bench_path=".") -> str:
+	return os.path.join(get_snapshots_path(bench_path), snapshot_id)
+
+
+def read_snapshot(snapshot_id: str, bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(get_snapshot_path(snapshot_id, bench_path), SNAPSHOT_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		raise ValidationError(f"Snapshot {snapshot_id} not found")
+
+
+def get_snapshots(bench_path=".") -> List[Dict]:
+	path = get_snapshots_path(bench_path)
+	return [
+		read_snapshot(snapshot_id, bench_path)
+		for snapshot_id in sorted(os.listdir(path) if os.path.isdir(path) else [])
+		if os.path.exists(os.path.join(path, snapshot_id, SNAPSHOT_FILE))
+	]
+
+
+def get_app_state(app: str, bench_path=".") -> Dict:
+	app_path = os.path.join(bench_path, "apps", app)
+	if not os.path.exists(os.path.join(app_path, ".git")):
+		return None
+
+	state = {
+		"branch": get_cmd_output("git rev-parse --abbrev-ref HEAD", cwd=app_path),
+		"commit": get_cmd_output("git rev-parse HEAD", cwd=app_path),
+	}
+	if get_cmd_output("git status --porcelain --untracked-files=no", cwd=app_path):
+		log(f"{app} has local changes, rolling back to this snapshot will discard them", level=3)
+
+	return state
+
+
+def create_snapshot(
+	bench_path=".", backup: bool = True, maintenance: bool = False, jobs: int = None
+) -> Dict:
+	"""Captures what an update changes: the apps' branches & commits, copies of the env
+	& assets (reflinked where the filesystem supports it) and, if `backup` is set,
+	backups of all sites' databases, which are linked into the snapshot. Snapshots
+	beyond snapshot_keep in common_site_config.json (or 2) are removed."""
+	from bench.bench import Bench
+	from bench.utils.backup import backup_sites, print_backup_summary
+	from bench.utils.fs import copy_file, copy_tree
+	from bench.utils.migrate import MIGRATED_RECORD_FILE
+	from bench.utils.restore import DUMP_EXTENSIONS
+
+	bench_path = os.path.abspath(bench_path)
+	bench = Bench(bench_path)
+	snapshot_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+	path = get_snapshot_path(snapshot_id, bench_path)
+	tmp_path = f"{path}.tmp"
+
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	os.makedirs(tmp_path)
+	log(f"Taking snapshot {snapshot_id}", no_log=True)
+
+	snapshot = {
+		"id": snapshot_id,
+		"created_at": datetime.now().isoformat(),
+		"apps": {app: get_app_state(app, bench_path) for app in bench.apps},
+		"sites": {},
+	}
+
+	try:
+		copy_tree(os.path.join(bench_path, "env"), os.path.join(tmp_path, "env"), jobs=jobs, link=None)
+		if os.path.isdir(os.path.join(bench_path, "sites", "assets")):
+			copy_tree(
+				os.path.join(bench_path, "sites", "assets"),
+				os.path.join(tmp_path, "assets"),
+				jobs=jobs,
+				link=None,
+			)
+
+		if backup:
+			manifest = backup_sites(bench_path=bench_path, jobs=jobs, maintenance=maintenance)
+			print_backup_summary(manifest)
+
+			failed = [site for site, result in manifest["sites"].items() if result["status"] != "success"]
+			if failed:
+				raise CommandFailedError(f"Backups failed for {', '.join(failed)}")
+
+			for site, result in manifest["sites"].items():
+				site_path = os.path.join(tmp_path, "sites", site)
+				os.makedirs(site_path)
+
+				database = next(f for f in result["files"] if f["path"].endswith(DUMP_EXTENSIONS))
+				# backups aren't written to after they're taken, so hardlinks are safe
+				copy_file(
+					database["path"],
+					os.path.join(site_path, os.path.basename(database["path"])),
+					link=True,
+				)
+
+				migrated_record = os.path.join(bench_path, "sites", site, MIGRATED_RECORD_FILE)
+				if os.path.exists(migrated_record):
+					shutil.copy2(migrated_record, site_path)
+
+				snapshot["sites"][site] = {
+					"database": os.path.basename(database["path"]),
+					"sha256": database["sha256"],
+				}
+
+		with open(os.path.join(tmp_path, SNAPSHOT_FILE), "w") as f:
+			json.dump(snapshot, f, indent=1)
+	except BaseException:
+		shutil.rmtree(tmp_path, ignore_errors=True)
+		raise
+
+	os.rename(tmp_path, path)
+	prune_snapshots(bench_path=bench_path)
+	log(f"Took snapshot {snapshot_id}, `bench rollback` restores it", level=1)
+	return snapshot
+
+
+def prune_snapshots(bench_path=".", keep: int = None) -> List[str]:
+	keep = keep or get_config(bench_path).get("snapshot_keep") or DEFAULT_SNAPSHOT_KEEP
+	removed = [snapshot["id"] for snapshot in get_snapshots(bench_path)][:-keep]
+
+	for snapshot_id in removed:
+		shutil.rmtree(get_snapshot_path(snapshot_id, bench_path))
+
+	return removed
+
+
+def restore_copy(source: str, path: str, jobs: int = None):
+	"""Replaces path with a copy of source; the snapshot stays intact for another
+	rollback"""
+	from bench.utils.fs import copy_tree, exchange_paths
+
+	tmp_path = f"{path}.rollback"
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	copy_tree(source, tmp_path, jobs=jobs, link=None)
+
+	if os.path.exists(path):
+		exchange_paths(tmp_path, path)
+		shutil.rmtree(tmp_path)
+	else:
+		os.rename(tmp_path, path)
+
+
+def rollback(
+	snapshot_id: str = None,
+	bench_path=".",
+	code_only: bool = False,
+	jobs: int = None,
+	restart_supervisor: bool = False,
+	restart_systemd: bool = False,
+):
+	"""Restores a snapshot, the latest if none is given: apps are reset to their
+	branches & commits, the env & assets are swapped for copies of the snapshot's and,
+	unless `code_only` is set, sites' databases are restored from its backups. Sites
+	are in maintenance mode meanwhile."""
+	from bench.bench import Bench
+	from bench.utils.bench import clear_redis_cache, get_env_cmd
+	from bench.utils.lock import bench_lock
+	from bench.utils.migrate import MIGRATED_RECORD_FILE
+	from bench.utils.parallel import run_in_parallel
+	from bench.utils.restore import restore_parallel
+
+	bench_path = os.path.abspath(bench_path)
+	snapshots = get_snapshots(bench_path)
+	snapshot_id = snapshot_id or (snapshots and snapshots[-1]["id"])
+	if not snapshot_id:
+		raise ValidationError("No snapshots taken yet, see `bench update --snapshot`")
+
+	snapshot = read_snapshot(snapshot_id, bench_path)
+	path = get_snapshot_path(snapshot_id, bench_path)
+
+	if not code_only:
+		missing = set(Bench(bench_path).sites) - set(snapshot["sites"])
+		if missing:
+			raise ValidationError(
+				f"Snapshot {snapshot_id} has no backups of {', '.join(sorted(missing))}; use"
+				" --code-only to only roll back apps, env & assets"
+			)
+
+	with bench_lock("rollback", bench_path=bench_path):
+		update_config({"maintenance_mode": 1, "pause_scheduler": 1}, bench_path=bench_path)
+
+		def reset_app(app):
+			state = snapshot["apps"][app]
+			app_path = os.path.join(bench_path, "apps", app)
+			if state["branch"] != "HEAD":
+				get_cmd_output(f"git checkout --quiet {state['branch']}", cwd=app_path)
+			get_cmd_output(f"git reset --quiet --hard {state['commit']}", cwd=app_path)
+
+		click.secho(f"Rolling back to snapshot {snapshot_id}", fg="yellow")
+		apps = [
+			app
+			for app, state in snapshot["apps"].items()
+			if state and os.path.isdir(os.path.join(bench_path, "apps", app))
+		]
+		run_in_parallel(reset_app, apps, jobs=jobs)
+
+		restore_copy(os.path.join(path, "env"), os.path.join(bench_path, "env"), jobs=jobs)
+		get_env_cmd.cache_clear()
+		if os.path.isdir(os.path.join(path, "assets")):
+			restore_copy(
+				os.path.join(path, "assets"), os.path.join(bench_path, "sites", "assets"), jobs=jobs
+			)
+
+		if not code_only:
+			for site, backup in snapshot["sites"].items():
+				site_path = os.path.join(path, "sites", site)
+				restore_parallel(site, os.path.join(site_path, backup["database"]), bench_path=bench_path, jobs=jobs)
+
+				# so that the next update migrates sites whose apps have changed since
+				migrated_record = os.path.join(bench_path, "sites", site, MIGRATED_RECORD_FILE)
+				if os.path.exists(os.path.join(site_path, MIGRATED_RECORD_FILE)):
+					shutil.copy2(os.path.join(site_path, MIGRATED_RECORD_FILE), migrated_record)
+				elif os.path.exists(migrated_record):
+					os.remove(migrated_record)
+
+		bench = Bench(bench_path)
+		clear_redis_cache(bench)
+		bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd, _raise=False)
+		update_config({"maintenance_mode": 0, "pause_scheduler": 0}, bench_path=bench_path)
+
+	log(f"Rolled back to snapshot {snapshot_id}", level=1)
@@ -35,6 +35,7 @@ def init(
 	skip_assets=False,
 	python="python3",
 	install_app=None,
+	jobs=None,
 ):
 	"""Initialize a new bench directory
 
@@ -69,7 +70,10 @@ def init(
 	# local apps
 	if clone_from:
 		clone_apps_from(
-			bench_path=path, clone_from=clone_from, update_app=not clone_without_update
+			bench_path=path,
+			clone_from=clone_from,
+			update_app=not clone_without_update,
+			jobs=jobs,
 		)
 
 	# remote apps
@@ -101,7 +105,7 @@ def init(
 		)
 
 	if not skip_assets:
-		build_assets(bench_path=path)
+		build_assets(bench_path=path, jobs=jobs)
 
 	if not no_backups:
 		bench.setup.backups()
@@ -160,19 +164,44 @@ def start(no_dev=False, concurrency=None, procfile=None, no_prefix=False, procma
 	os.execv(program, command)
 
 
-def migrate_site(site, bench_path="."):
-	run_frappe_cmd("--site", site, "migrate", bench_path=bench_path)
-
-
 def backup_site(site, bench_path="."):
 	run_frappe_cmd("--site", site, "backup", bench_path=bench_path)
 
 
-def backup_all_sites(bench_path="."):
-	from bench.bench import Bench
+def backup_all_sites(
+	bench_path=".",
+	maintenance=False,
+	jobs=None,
+	with_files=False,
+	compress=None,
+	idle_io=False,
+	sites=None,
+	on_result=None,
+):
+	"""Backs up all sites (or `sites`) concurrently, returning the run's manifest. If
+	`maintenance` is set, each site is in maintenance mode only while it's being
+	backed up. `on_result` is called with each site & its result as soon as it's
+	backed up."""
+	from bench.exceptions import CommandFailedError
+	from bench.utils.backup import backup_sites, print_backup_summary
+
+	manifest = backup_sites(
+		bench_path=bench_path,
+		sites=sites,
+		jobs=jobs,
+		with_files=with_files,
+		compress=compress,
+		idle_io=idle_io,
+		maintenance=maintenance,
+		on_result=on_result,
+	)
+	print_backup_summary(manifest)
+
+	failed = [site for site, result in manifest["sites"].items() if result["status"] != "success"]
+	if failed:
+		raise CommandFailedError(f"Backups failed for {', '.join(failed)}")
 
-	for site in Bench(bench_path).sites:
-		backup_site(site, bench_path=bench_path)
+	return manifest
 
 
 def fix_prod_setup_perms(bench_path=".", frappe_user=None):
@@ -0,0 +1,552 @@
+# imports - standard imports
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from shlex import quote
+from typing import Dict, List
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.exceptions import CannotUpdateReleaseBench, CommandFailedError, ValidationError
+from bench.utils import exec_cmd, get_cmd_output, log
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# where `bench update --prepare` stages sources, wheels & builds for `--apply`
+STAGING_DIR = ".staging"
+PREPARED_UPDATE_FILE = "prepared.json"
+
+
+def get_staging_path(bench_path=".") -> str:
+	return os.path.join(os.path.abspath(bench_path), STAGING_DIR)
+
+
+def read_prepared_update(bench_path=".") -> Dict:
+	try:
+		with open(os.path.join(get_staging_path(bench_path), PREPARED_UPDATE_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+
+def clear_prepared_update(bench_path="."):
+	shutil.rmtree(get_staging_path(bench_path), ignore_errors=True)
+
+
+def get_update_target(app: str, bench_path=".") -> Dict:
+	"""Fetches the app's branch into its remote-tracking ref, leaving the working tree
+	alone. Returns the current & target commits, or None if the app has no remote."""
+	from bench.utils.app import get_current_branch, get_remote
+
+	app_path = os.path.join(bench_path, "apps", app)
+	if not os.path.exists(os.path.join(app_path, ".git")):
+		return None
+
+	remote = get_remote(app, bench_path=bench_path)
+	if not remote:
+		return None
+
+	if get_cmd_output("git status --porcelain --untracked-files=no", cwd=app_path):
+		raise ValidationError(f"Cannot prepare update: {app} has uncommitted changes")
+
+	branch = get_current_branch(app, bench_path=bench_path)
+	exec_cmd(
+		f"git fetch --no-tags {remote} +refs/heads/{branch}:refs/remotes/{remote}/{branch}",
+		cwd=app_path,
+	)
+
+	head = get_cmd_output("git rev-parse HEAD", cwd=app_path)
+	target = get_cmd_output(f"git rev-parse {remote}/{branch}", cwd=app_path)
+
+	if head != target and not is_ancestor(head, target, app_path):
+		raise ValidationError(
+			f"Cannot prepare update: {app} has diverged from {remote}/{branch} and can't be"
+			" fast-forwarded. Use `bench update` instead."
+		)
+
+	return {"remote": remote, "branch": branch, "head": head, "target": target}
+
+
+def is_ancestor(commit: str, descendant: str, repo_path: str) -> bool:
+	from bench.utils.parallel import capture_cmd
+
+	return_code, _ = capture_cmd(
+		f"git merge-base --is-ancestor {commit} {descendant}", cwd=repo_path
+	)
+	return not return_code
+
+
+def stage_app_sources(app: str, commit: str, staging_path: str, bench_path="."):
+	"""Exports the app's tree at commit into the staging directory"""
+	import subprocess
+	import tarfile
+
+	target_path = os.path.join(staging_path, "apps", app)
+	os.makedirs(target_path, exist_ok=True)
+
+	p = subprocess.Popen(
+		["git", "archive", "--format=tar", commit],
+		cwd=os.path.join(bench_path, "apps", app),
+		stdout=subprocess.PIPE,
+	)
+	with tarfile.open(fileobj=p.stdout, mode="r|") as tar:
+		tar.extractall(target_path)
+
+	if p.wait():
+		raise CommandFailedError(f"git archive {commit} failed for {app}")
+
+
+def get_build_requirements(app_path: str) -> List[str]:
+	"""Build backend requirements declared in the app's pyproject.toml"""
+	try:
+		from tomli import loads
+	except ImportError:
+		from tomllib import loads
+
+	try:
+		with open(os.path.join(app_path, "pyproject.toml")) as f:
+			return loads(f.read()).get("build-system", {}).get("requires", [])
+	except (OSError, ValueError):
+		return []
+
+
+def prepare_wheels(apps: List[str], staging_path: str, bench_path="."):
+	"""Builds wheels for the staged apps, their dependencies & build backends, so that
+	they can be installed without reaching an index"""
+	from bench.bench import Bench
+	from bench.utils.parallel import capture_cmd
+
+	python = Bench(bench_path).python
+	wheels_path = os.path.join(staging_path, "wheels")
+	app_paths = [os.path.join(staging_path, "apps", app) for app in apps]
+	build_requirements = {
+		requirement for path in app_paths for requirement in get_build_requirements(path)
+	}
+
+	log(f"Building wheels for {', '.join(apps)}", no_log=True)
+	return_code, _ = capture_cmd(
+		f"{python} -m pip wheel --wheel-dir {wheels_path} {' '.join(app_paths)}"
+		f" {' '.join(quote(r) for r in build_requirements)}",
+		cwd=bench_path,
+		log_file=os.path.join(staging_path, "logs", "wheels.log"),
+	)
+
+	if return_code:
+		raise CommandFailedError(
+			f"Building wheels failed, see {os.path.join(staging_path, 'logs', 'wheels.log')}"
+		)
+
+
+def prepare_assets(apps: List[str], targets: Dict, staging_path: str, bench_path="."):
+	"""Builds assets of the staged apps with frappe's esbuild & publishes them to the
+	assets store, for `bench build` to restore after the apps are fast-forwarded.
+	Returns the apps whose builds were published."""
+	from bench.bench import Bench
+	from bench.config.common_site_config import get_config, put_config
+	from bench.utils.assets import (
+		get_assets_path,
+		get_assets_store,
+		get_build_tool_version,
+		is_app_cacheable,
+	)
+	from bench.utils.node import install_node_dependencies
+	from bench.utils.parallel import capture_cmd
+
+	store = get_assets_store(bench_path)
+	if not store:
+		log("assets_store is disabled, assets will be built while applying the update", level=3)
+		return []
+
+	all_apps = list(Bench(bench_path).apps)
+	apps = [app for app in apps if is_app_cacheable(app, staging_path)]
+	if not apps:
+		return []
+
+	os.makedirs(os.path.join(staging_path, "sites"), exist_ok=True)
+	with open(os.path.join(staging_path, "sites", "apps.txt"), "w") as f:
+		f.write("\n".join(all_apps))
+
+	# node & assets store settings apply, but the build mustn't reach live redis
+	config = {k: v for k, v in get_config(bench_path).items() if not k.startswith("redis")}
+	put_config(config, bench_path=staging_path)
+
+	os.makedirs(get_assets_path(staging_path), exist_ok=True)
+	for app in all_apps:
+		link = os.path.join(get_assets_path(staging_path), app)
+		if not os.path.lexists(link):
+			os.symlink(os.path.join(staging_path, "apps", app, app, "public"), link)
+
+	for app in {"frappe", *apps}:
+		install_node_dependencies(app, bench_path=staging_path)
+
+	log_file = os.path.join(staging_path, "logs", "build.log")
+	return_code, _ = capture_cmd(
+		f"yarn run production --apps {','.join(apps)}",
+		cwd=os.path.join(staging_path, "apps", "frappe"),
+		log_file=log_file,
+	)
+	if return_code:
+		log(f"Building assets failed, see {log_file}", level=3)
+		return []
+
+	build_tool_version = get_build_tool_version(bench_path=staging_path)
+	for app in apps:
+		store.publish(
+			store.get_key(app, targets[app]["target"], build_tool_version),
+			app,
+			bench_path=staging_path,
+			commit=targets[app]["target"],
+			build_tool_version=build_tool_version,
+		)
+
+	return apps
+
+
+def prepare_update(bench_path=".", apps: List[str] = None, jobs: int = None):
+	"""Does the slow parts of an update without touching the live bench: fetches apps
+	into their remote-tracking refs, builds wheels for & assets of the commits they'd
+	be fast-forwarded to. `bench update --apply` then only has to fast-forward,
+	install, migrate & restore the builds."""
+	from bench.bench import Bench
+	from bench.utils.parallel import run_in_parallel
+
+	bench_path = os.path.abspath(bench_path)
+	bench = Bench(bench_path)
+
+	if bench.conf.get("release_bench"):
+		raise CannotUpdateReleaseBench("Release bench detected, cannot update!")
+
+	apps = [app for app in (apps or bench.apps) if app not in bench.excluded_apps]
+	staging_path = get_staging_path(bench_path)
+
+	clear_prepared_update(bench_path)
+	os.makedirs(staging_path)
+
+	targets = run_in_parallel(lambda app: get_update_target(app, bench_path), apps, jobs=jobs)
+	targets = {app: target for app, target in targets.items() if target}
+	changed = [app for app in targets if targets[app]["head"] != targets[app]["target"]]
+
+	if not changed:
+		log("All apps are up to date, nothing to prepare", level=1)
+		clear_prepared_update(bench_path)
+		return
+
+	# all apps are staged as builds may import from apps that haven't changed
+	run_in_parallel(
+		lambda app: stage_app_sources(app, targets[app]["target"], staging_path, bench_path),
+		targets,
+		jobs=jobs,
+	)
+
+	prepare_wheels(changed, staging_path, bench_path=bench_path)
+	prebuilt = prepare_assets(changed, targets, staging_path, bench_path=bench_path)
+
+	# only what --apply needs is kept
+	shutil.rmtree(os.path.join(staging_path, "apps"))
+	shutil.rmtree(os.path.join(staging_path, "sites"), ignore_errors=True)
+
+	with open(os.path.join(staging_path, PREPARED_UPDATE_FILE), "w") as f:
+		json.dump(
+			{
+				"prepared_at": datetime.now().isoformat(),
+				"apps": {app: targets[app] for app in changed},
+				"prebuilt_assets": prebuilt,
+			},
+			f,
+			indent=1,
+		)
+
+	for app in changed:
+		click.echo(f"{app}: {targets[app]['head'][:10]} → {targets[app]['target'][:10]}")
+	log("Update prepared, run `bench update --apply` to apply it", level=1)
+
+
+def validate_prepared_update(prepared: Dict, bench_path="."):
+	"""Makes sure apps are still at the commits the update was prepared from"""
+	for app, target in prepared["apps"].items():
+		app_path = os.path.join(bench_path, "apps", app)
+		head = get_cmd_output("git rev-parse HEAD", cwd=app_path)
+
+		if head != target["head"] or get_cmd_output(
+			"git status --porcelain --untracked-files=no", cwd=app_path
+		):
+			raise ValidationError(
+				f"{app} has changed since the update was prepared, run `bench update --prepare`"
+				" again"
+			)
+
+
+def apply_prepared_sources(prepared: Dict, bench_path=".", jobs: int = None):
+	"""Fast-forwards apps to the commits the update was prepared for"""
+	from bench.utils.parallel import run_in_parallel
+
+	def fast_forward(app):
+		app_path = os.path.join(bench_path, "apps", app)
+		exec_cmd(f"git merge --ff-only {prepared['apps'][app]['target']}", cwd=app_path)
+		exec_cmd('find . -name "*.pyc" -delete', cwd=app_path)
+
+	run_in_parallel(fast_forward, prepared["apps"], jobs=jobs)
+
+
+def install_prepared_requirements(prepared: Dict, bench_path=".", jobs: int = None):
+	"""Installs python dependencies of updated apps from the prepared wheels, falling
+	back to the package index if any are missing, and updates node dependencies"""
+	import bench.cli
+	from bench.bench import Bench
+	from bench.utils.bench import update_yarn_packages
+
+	quiet_flag = "" if bench.cli.verbose else "--quiet"
+	python = Bench(bench_path).python
+	wheels_path = os.path.join(get_staging_path(bench_path), "wheels")
+	apps = list(prepared["apps"])
+	app_paths = " ".join(f"-e {os.path.join(bench_path, 'apps', app)}" for app in apps)
+
+	try:
+		exec_cmd(
+			f"{python} -m pip install {quiet_flag} --upgrade --no-index"
+			f" --find-links {wheels_path} {app_paths}",
+			cwd=bench_path,
+		)
+	except CommandFailedError:
+		log("Prepared wheels are incomplete, installing from the package index", level=3)
+		exec_cmd(
+			f"{python} -m pip install {quiet_flag} --upgrade --find-links {wheels_path}"
+			f" {app_paths}",
+			cwd=bench_path,
+		)
+
+	update_yarn_packages(bench_path=bench_path, apps=apps, jobs=jobs)
+
+
+def get_update_tasks(
+	journal,
+	bench_path=".",
+	prepared: Dict = None,
+	jobs: int = None,
+	continue_on_error: bool = False,
+	restart_supervisor: bool = False,
+	restart_systemd: bool = False,
+) -> Dict:
+	"""The update, as tasks for run_task_graph, with the options of its journal.
+	Tasks already done in the journal do nothing when run.
+
+	Apps are fetched while sites are backed up, but only pulled once they're backed
+	up (or snapshotted) & none of them has local changes. Each app is pip installed
+	once it's pulled, frappe first and one at a time as they share the env; node
+	dependencies are installed alongside. Once all apps are installed, sites are
+	migrated while assets are built.
+	"""
+	import threading
+
+	from bench.app import App, check_local_changes, pull_apps
+	from bench.bench import Bench
+	from bench.utils.app import get_current_branch, get_remote
+	from bench.utils.bench import patch_sites, post_upgrade
+	from bench.utils.migrate import get_app_revision
+	from bench.utils.node import install_node_dependencies
+	from bench.utils.parallel import capture_cmd
+	from bench.utils.snapshot import create_snapshot
+	from bench.utils.system import backup_all_sites
+
+	bench = Bench(bench_path)
+	options = journal.options
+	apps = list(bench.apps)
+	tasks = {}
+	pip_lock = threading.Lock()
+
+	def phase(name, fn):
+		def run():
+			if not journal.is_done(name):
+				with journal.phase(name):
+					fn()
+
+		return run
+
+	def unit(phase, name, fn):
+		def run():
+			if journal.pending(phase, [name]):
+				with journal.unit(phase, name) as details:
+					fn(details)
+
+		return run
+
+	def record_site(phase):
+		def on_result(site, result):
+			journal.set_unit(
+				phase,
+				site,
+				result["status"],
+				log_file=result["log_file"],
+				files=[f["path"] for f in result.get("files", [])],
+			)
+
+		return on_result
+
+	def take_snapshot():
+		snapshot = create_snapshot(
+			bench_path=bench_path,
+			backup=options["backup"],
+			maintenance=options["site_maintenance"],
+			jobs=jobs,
+		)
+		with journal.lock:
+			journal.data["snapshot"] = snapshot["id"]
+
+	def backup():
+		print("Backing up sites...")
+		backup_all_sites(
+			bench_path=bench_path,
+			maintenance=options["site_maintenance"],
+			sites=journal.pending("backup", bench.sites),
+			on_result=record_site("backup"),
+		)
+
+	def check(apps):
+		if apps:
+			check_local_changes(apps=apps, bench_path=bench_path)
+
+	def fetch(app):
+		# nothing is checked out, so this is safe while sites are backed up
+		app_path = os.path.join(bench_path, "apps", app)
+		if app in bench.excluded_apps or not os.path.exists(os.path.join(app_path, ".git")):
+			return
+		if os.path.exists(os.path.join(app_path, ".git", "shallow")):
+			return
+
+		remote = get_remote(app, bench_path=bench_path)
+		if remote:
+			branch = get_current_branch(app, bench_path=bench_path)
+			capture_cmd(f"git fetch --quiet {remote} {branch}", cwd=app_path)
+
+	def pull(app, details):
+		pull_apps(apps=[app], bench_path=bench_path, reset=options["reset"])
+		details["commit"] = get_app_revision(app, bench_path)
+
+	def install_python(app, details):
+		with pip_lock:
+			App(os.path.join(bench_path, "apps", app), bench=bench, to_clone=False).install(
+				skip_assets=True, restart_bench=False, ignore_resolution=True, skip_node=True
+			)
+
+	def install_node(app, details):
+		details["result"] = install_node_dependencies(app, bench_path=bench_path)
+
+	def patch():
+		print("Patching sites...")
+		patch_sites(
+			bench_path=bench_path,
+			jobs=jobs,
+			continue_on_error=continue_on_error,
+			force=options["force"],
+			site_maintenance=options["site_maintenance"],
+			sites=journal.pending("patch", bench.sites),
+			on_result=record_site("patch"),
+		)
+
+	def build():
+		print("Building assets...")
+		bench.build(jobs=jobs)
+
+	def reload():
+		bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+
+	# nothing changes code or the env until sites are backed up
+	if options["snapshot"]:
+		tasks["snapshot"] = (phase("snapshot", take_snapshot), [])
+	elif options["backup"]:
+		tasks["backup"] = (phase("backup", backup), [])
+	backed_up = list(tasks)
+
+	pulled = {}
+	if options["pull"] and prepared:
+		tasks["pull"] = (
+			phase("pull", lambda: apply_prepared_sources(prepared, bench_path=bench_path, jobs=jobs)),
+			backed_up,
+		)
+		pulled = {app: ["pull"] for app in apps}
+	elif options["pull"]:
+		to_pull = options["apps"] or apps
+		checked = []
+		if not options["reset"]:
+			# before any app is pulled, so that a dirty app doesn't leave others half-updated
+			tasks["check"] = (lambda: check(journal.pending("pull", to_pull)), [])
+			checked = ["check"]
+
+		for app in to_pull:
+			tasks[f"fetch:{app}"] = (lambda app=app: fetch(app), [])
+			tasks[f"pull:{app}"] = (
+				unit("pull", app, lambda details, app=app: pull(app, details)),
+				[f"fetch:{app}", *checked, *backed_up],
+			)
+			pulled[app] = [f"pull:{app}"]
+
+	installed, node_installed = [], []
+	if options["requirements"] and prepared:
+		tasks["requirements"] = (
+			phase(
+				"requirements",
+				lambda: install_prepared_requirements(prepared, bench_path=bench_path, jobs=jobs),
+			),
+			[*backed_up, *(["pull"] if "pull" in tasks else [])],
+		)
+		installed = node_installed = ["requirements"]
+	elif options["requirements"]:
+		tasks["pip"] = (lambda: bench.setup.pip(), backed_up)
+		for app in apps:
+			tasks[f"python:{app}"] = (
+				unit("requirements", app, lambda details, app=app: install_python(app, details)),
+				# frappe goes first
+				["pip", *pulled.get(app, []), *([] if app == apps[0] else [f"python:{apps[0]}"])],
+			)
+			tasks[f"node:{app}"] = (
+				unit("node", app, lambda details, app=app: install_node(app, details)),
+				[*backed_up, *pulled.get(app, [])],
+			)
+			installed.append(f"python:{app}")
+			node_installed.append(f"node:{app}")
+
+	all_pulled = sorted({task for app_tasks in pulled.values() for task in app_tasks})
+	if options["patch"]:
+		tasks["patch"] = (phase("patch", patch), [*backed_up, *all_pulled, *installed])
+
+	if options["build"]:
+		# builds run frappe from the env, which pip installs mustn't change meanwhile
+		tasks["build"] = (
+			phase("build", build),
+			[*backed_up, *all_pulled, *installed, *node_installed],
+		)
+
+	version_upgrade = options["version_upgrade"]
+	if version_upgrade[0] or options["force"]:
+		tasks["post_upgrade"] = (
+			phase(
+				"post_upgrade",
+				lambda: post_upgrade(version_upgrade[1], version_upgrade[2], bench_path=bench_path),
+			),
+			[task for task in ("patch", "build") if task in tasks],
+		)
+
+	tasks["reload"] = (phase("reload", reload), list(tasks))
+	return tasks
+
+
+def print_critical_path(results: Dict[str, Dict], tasks: Dict):
+	from bench.utils.parallel import get_critical_path
+
+	path = get_critical_path(results, {name: deps for name, (_, deps) in tasks.items()})
+	if not path:
+		return
+
+	durations = {name: results[name]["finished"] - results[name]["started"] for name in path}
+	width = max(len(name) for name in path)
+	total = max(result.get("finished", 0) for result in results.values())
+
+	click.secho("\nCritical path", bold=True)
+	for name in path:
+		click.echo(f"{name:<{width}}  {durations[name]:>7.1f}s")
+	click.echo(f"{sum(durations.values()):.1f}s of the update's {total:.1f}s")